@@ -1,10 +1,11 @@
-from flask import Flask
-from app.config import config
-from app.core.logger import main_logger
-from app.core.download_manager import DownloadManager
-
 def create_app(config_name='default'):
     """Create Flask application"""
+    # Imported here so `python -m app` (the headless CLI) never loads Flask
+    from flask import Flask
+    from app.config import config
+    from app.core.logger import main_logger
+    from app.core.download_manager import create_download_manager
+    
     # Initialize Flask app
     app = Flask(__name__)
     
@@ -13,8 +14,10 @@ def create_app(config_name='default'):
     config[config_name].init_app(app)
     
     # Initialize download manager
-    download_manager = DownloadManager(
-        max_workers=app.config['MAX_WORKERS'],
+    engine = app.config['DOWNLOAD_ENGINE']
+    download_manager = create_download_manager(
+        engine,
+        max_workers=app.config['ASYNC_MAX_CONCURRENCY' if engine == 'asyncio' else 'MAX_WORKERS'],
         bandwidth_limit=app.config['DEFAULT_BANDWIDTH_LIMIT']
     )
     
@@ -0,0 +1,232 @@
+"""Headless batch mode: download a manifest without the web interface.
+
+    python -m app urls.csv
+    python -m app --format jsonl --report result.json - < urls.jsonl
+
+Manifests are the CSV or JSONL URL lists accepted by POST /api/queue/import.
+They are fed to a DownloadManager with persistence, resume and Telegram off,
+and the command returns when every URL has finished and, with
+PIPELINE_STAGES set, been post-processed. Only the engine is loaded: Flask
+and the Telegram client are never imported, and the engine waits until the
+arguments and manifests have been checked.
+
+Exit status: 0 when every URL completed or was unchanged; 1 when any failed,
+was cancelled, was rejected as invalid or failed post-processing; 2 for
+usage errors or unreadable manifests; 3 when --timeout expired first; 130
+when interrupted.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, TextIO
+from app.config import Config
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_TIMEOUT = 3
+EXIT_INTERRUPTED = 130
+
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class BatchProgress:
+    """Collects finished items from the manager's events and reports on them"""
+
+    def __init__(self, stream: TextIO, live: bool):
+        self.stream = stream
+        self.live = live
+        self.expected: Optional[int] = None  # known once the manifests are read
+        self.finished: Dict[str, dict] = {}  # url -> last state
+        self.counts: Dict[str, int] = {}
+        self.started = time.monotonic()
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def on_event(self, event_type: str, data: dict):
+        if event_type != 'state' or data['status'] not in ('completed', 'skipped_unchanged', 'failed', 'cancelled'):
+            return
+        with self._lock:
+            previous = self.finished.get(data['url'])
+            if previous is not None:
+                self.counts[previous['status']] -= 1
+            self.finished[data['url']] = data
+            self.counts[data['status']] = self.counts.get(data['status'], 0) + 1
+            if self.expected is not None and len(self.finished) >= self.expected:
+                self.done.set()
+
+    def set_expected(self, expected: int):
+        with self._lock:
+            self.expected = expected
+            if len(self.finished) >= expected:
+                self.done.set()
+
+    def line(self, nbytes: int) -> str:
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            finished = len(self.finished)
+            failed = self.counts.get('failed', 0) + self.counts.get('cancelled', 0)
+        total = '?' if self.expected is None else self.expected
+        rate = format_bytes(nbytes / elapsed) if elapsed > 0 else '-'
+        return (f"[{finished}/{total}] {failed} failed, {format_bytes(nbytes)} at {rate}/s, "
+                f"{elapsed:.1f}s")
+
+    def tick(self, nbytes: int):
+        if self.live:
+            self.stream.write('\r\033[K' + self.line(nbytes))
+            self.stream.flush()
+
+    def summary(self, nbytes: int, imported: dict) -> str:
+        if self.live:
+            self.stream.write('\r\033[K')
+        elapsed = time.monotonic() - self.started
+        parts = [f"{self.counts.get(status, 0)} {label}" for status, label in
+                 (('completed', 'completed'), ('skipped_unchanged', 'unchanged'),
+                  ('failed', 'failed'), ('cancelled', 'cancelled')) if self.counts.get(status)]
+        for key in ('deduped', 'rejected'):
+            if imported.get(key):
+                parts.append(f"{imported[key]} {key}")
+        return (f"{imported.get('accepted', 0)} downloads: {', '.join(parts) or 'none finished'}; "
+                f"{format_bytes(nbytes)} in {elapsed:.1f}s")
+
+
+def build_report(progress: BatchProgress, imported: dict, nbytes: int, exit_code: int,
+                 pending: List[str]) -> dict:
+    """Machine-readable outcome of a batch run"""
+    return {
+        'exit_code': exit_code,
+        'seconds': round(time.monotonic() - progress.started, 3),
+        'bytes': nbytes,
+        'imported': imported,
+        'counts': {status: count for status, count in progress.counts.items() if count},
+        'downloads': list(progress.finished.values()),
+        'unfinished': pending
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m app', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifests', nargs='*', default=['-'],
+                        help="CSV or JSONL files of url,caption,priority rows; '-' reads stdin (default)")
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='manifest format (default: from the file extension, CSV for stdin)')
+    parser.add_argument('-o', '--output-dir', help='where to save files (default: DOWNLOAD_DIR)')
+    parser.add_argument('-j', '--workers', type=int, default=Config.MAX_WORKERS,
+                        help='concurrent downloads (default: MAX_WORKERS)')
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded',
+                        help='download engine (default: threaded)')
+    parser.add_argument('--bandwidth-limit', type=int, default=Config.DEFAULT_BANDWIDTH_LIMIT,
+                        help='bytes per second across all downloads, 0 for unlimited (default: DEFAULT_BANDWIDTH_LIMIT)')
+    parser.add_argument('--timeout', type=float, help='give up after this many seconds (exit status 3)')
+    parser.add_argument('--report', help="write a JSON report of every download to this file, '-' for stdout")
+    parser.add_argument('-q', '--quiet', action='store_true', help='nothing on stderr but the exit status')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the engine\'s log on stderr')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.manifests.count('-') > 1:
+        parser.error("stdin ('-') can only be read once")
+    return args
+
+
+def open_manifests(args: argparse.Namespace) -> List[tuple]:
+    """Open every manifest up front so a bad path fails before the engine starts"""
+    opened = []
+    for path in args.manifests:
+        if path == '-':
+            opened.append((sys.stdin, args.format or 'csv'))
+        else:
+            from app.core.bulk_import import detect_format
+            opened.append((open(path, encoding='utf-8', newline=''), args.format or detect_format(path)))
+    return opened
+
+
+def configure(args: argparse.Namespace):
+    """Settings for a one-shot run; the rest come from the environment as usual"""
+    Config.PERSIST_DOWNLOADS = False
+    Config.RESUME_ON_STARTUP = False
+    Config.TELEGRAM_ENABLED = False
+    if args.output_dir:
+        Config.DOWNLOAD_DIR = os.path.abspath(args.output_dir)
+    from app.core.logger import console_handler
+    # The log files keep everything; stderr is for the progress line and errors
+    console_handler.setLevel(logging.INFO if args.verbose else logging.CRITICAL if args.quiet else logging.ERROR)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        manifests = open_manifests(args)
+    except OSError as e:
+        print(f"python -m app: cannot read manifest: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    configure(args)
+
+    from itertools import chain
+    from app.core.bulk_import import iter_rows
+    from app.core.download_manager import create_download_manager
+
+    progress = BatchProgress(sys.stderr, live=not args.quiet and sys.stderr.isatty())
+    manager = create_download_manager(args.engine, max_workers=args.workers,
+                                      bandwidth_limit=args.bandwidth_limit)
+    manager.events.add_listener(progress.on_event)
+    imported: dict = {}
+    exit_code = EXIT_OK
+    deadline = time.monotonic() + args.timeout if args.timeout else None
+    try:
+        try:
+            imported = manager.import_downloads(chain.from_iterable(iter_rows(f, fmt) for f, fmt in manifests))
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f"python -m app: invalid manifest: {e}", file=sys.stderr)
+            exit_code = EXIT_USAGE
+        finally:
+            for f, _ in manifests:
+                if f is not sys.stdin:
+                    f.close()
+        if exit_code == EXIT_OK:
+            progress.set_expected(imported['accepted'])
+        # After a bad manifest nothing is waited for, but the manager is still closed below
+        while exit_code == EXIT_OK and not progress.done.wait(0.5):
+            progress.tick(manager.bytes_downloaded)
+            if deadline is not None and time.monotonic() >= deadline:
+                exit_code = EXIT_TIMEOUT
+                break
+        # Post-processing of the last files may still be running
+        while exit_code == EXIT_OK and manager.pipeline is not None and not manager.pipeline.join(0.5):
+            progress.tick(manager.bytes_downloaded)
+            if deadline is not None and time.monotonic() >= deadline:
+                exit_code = EXIT_TIMEOUT
+    except KeyboardInterrupt:
+        exit_code = EXIT_INTERRUPTED
+    pipeline = manager.get_pipeline_stats(limit=imported.get('accepted') or 1)
+    if exit_code == EXIT_OK and (progress.counts.get('failed') or progress.counts.get('cancelled')
+                                 or imported.get('rejected') or (pipeline and pipeline['failed'])):
+        exit_code = EXIT_FAILED
+
+    nbytes = manager.bytes_downloaded
+    pending = [item.url for item in manager.get_queued_downloads()]
+    pending += list(manager.active_downloads) + list(manager.waiting_downloads)
+    manager.close()
+    if not args.quiet:
+        print(progress.summary(nbytes, imported), file=sys.stderr)
+    if args.report:
+        report = build_report(progress, imported, nbytes, exit_code, pending)
+        if pipeline is not None:
+            report['pipeline'] = pipeline
+        report = json.dumps(report, indent=2)
+        if args.report == '-':
+            print(report)
+        else:
+            with open(args.report, 'w') as f:
+                f.write(report + '\n')
+    return exit_code
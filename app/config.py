@@ -8,7 +8,83 @@ class Config:
     # Download settings
     MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 5))
     DEFAULT_BANDWIDTH_LIMIT = int(os.environ.get('DEFAULT_BANDWIDTH_LIMIT', 1024 * 1024))  # 1MB/s
-    DOWNLOAD_CHUNK_SIZE = 8192  # 8KB chunks
+    DOWNLOAD_CHUNK_SIZE = 8192  # 8KB, smallest read size
+    DOWNLOAD_MAX_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_MAX_CHUNK_SIZE', 4 * 1024 * 1024))  # 4MB
+    PROGRESS_INTERVAL = 0.25  # seconds between progress updates per download
+    
+    # Integrity: hash every download as it streams; items may also carry an expected digest/size
+    HASH_DOWNLOADS = os.environ.get('HASH_DOWNLOADS', 'true').lower() == 'true'
+    DIGEST_ALGORITHM = os.environ.get('DIGEST_ALGORITHM', 'sha256')
+    
+    # Content-addressed cache of finished downloads (needs HASH_DOWNLOADS)
+    CACHE_ENABLED = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))  # 10GB
+    
+    # HTTP connection pooling (per scheme and host)
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))  # keep-alive connections per host
+    HTTP_POOL_IDLE_TIMEOUT = int(os.environ.get('HTTP_POOL_IDLE_TIMEOUT', 60))  # seconds
+    DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))  # seconds, 0 disables
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))  # seconds
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))  # seconds without receiving data
+    
+    # Per-host scheduling: connection cap, fair dispatch across hosts and priority aging
+    HOST_MAX_CONNECTIONS = int(os.environ.get('HOST_MAX_CONNECTIONS', 8))  # per host, segments included; 0 = unlimited
+    HOST_FAIR_SHARE = float(os.environ.get('HOST_FAIR_SHARE', 1.0))  # priority levels a host yields per open connection
+    PRIORITY_AGING = float(os.environ.get('PRIORITY_AGING', 300))  # seconds queued that raise an item one level, 0 disables
+    
+    # Automatic retries of transient failures (connection errors, timeouts, 5xx, 429)
+    RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 5))  # attempts per download, 1 disables retries
+    RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 2))  # seconds, doubled per attempt
+    RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 300))  # seconds, also caps Retry-After
+    
+    # Per-host circuit breakers: stop dispatching to an origin that keeps failing
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))  # consecutive failures, 0 disables
+    BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', 30))  # seconds before the first probe
+    BREAKER_MAX_RESET_TIMEOUT = float(os.environ.get('BREAKER_MAX_RESET_TIMEOUT', 600))  # seconds
+    
+    # Download engine: 'threaded' (one thread per transfer), 'asyncio', or
+    # 'distributed' (transfers run in worker processes leasing from this one)
+    DOWNLOAD_ENGINE = os.environ.get('DOWNLOAD_ENGINE', 'threaded')
+    ASYNC_MAX_CONCURRENCY = int(os.environ.get('ASYNC_MAX_CONCURRENCY', 1000))
+    ASYNC_LIMIT_PER_HOST = int(os.environ.get('ASYNC_LIMIT_PER_HOST', 0))  # 0 = unlimited
+    ASYNC_IO_THREADS = int(os.environ.get('ASYNC_IO_THREADS', 4))
+    ASYNC_WRITE_BUFFER = 64 * 1024  # bytes buffered per transfer before a disk write
+    
+    # Coordinator for the distributed engine; workers run `python -m app.core.worker`
+    COORDINATOR_ADDRESS = os.environ.get('COORDINATOR_ADDRESS')  # unix:/path or tcp://host:port; default below
+    COORDINATOR_TOKEN = os.environ.get('COORDINATOR_TOKEN')  # shared secret workers must present
+    COORDINATOR_LOCAL_WORKERS = int(os.environ.get('COORDINATOR_LOCAL_WORKERS', 2))  # worker processes started alongside
+    LEASE_TIMEOUT = float(os.environ.get('LEASE_TIMEOUT', 30))  # seconds without a heartbeat before an item is requeued
+    HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', 5))  # seconds between worker heartbeats
+    
+    # Worker pool autoscaling from measured throughput
+    AUTOSCALE_WORKERS = os.environ.get('AUTOSCALE_WORKERS', 'false').lower() == 'true'
+    AUTOSCALE_MIN_WORKERS = int(os.environ.get('AUTOSCALE_MIN_WORKERS', 1))
+    AUTOSCALE_MAX_WORKERS = int(os.environ.get('AUTOSCALE_MAX_WORKERS', 32))
+    AUTOSCALE_INTERVAL = float(os.environ.get('AUTOSCALE_INTERVAL', 5))  # seconds
+    
+    # Post-download processing: comma-separated stages run in order on each completed file,
+    # built-ins (decompress, extract, checksum, move) or module:function[@cpu|@io]
+    PIPELINE_STAGES = os.environ.get('PIPELINE_STAGES', '')
+    PIPELINE_PROCESSES = int(os.environ.get('PIPELINE_PROCESSES', os.cpu_count() or 1))  # for CPU-heavy stages
+    PIPELINE_THREADS = int(os.environ.get('PIPELINE_THREADS', 4))  # for I/O stages
+    PIPELINE_MAX_PENDING = int(os.environ.get('PIPELINE_MAX_PENDING', 100))  # files in the pipeline before downloads wait
+    PIPELINE_DEST_DIR = os.environ.get('PIPELINE_DEST_DIR')  # where the 'move' stage puts files
+    
+    # Segmented downloads (parallel HTTP range requests)
+    SEGMENTED_DOWNLOADS = os.environ.get('SEGMENTED_DOWNLOADS', 'true').lower() == 'true'
+    SEGMENT_COUNT = int(os.environ.get('SEGMENT_COUNT', 4))
+    SEGMENT_MIN_SIZE = int(os.environ.get('SEGMENT_MIN_SIZE', 4 * 1024 * 1024))  # 4MB
+    
+    # Re-queue interrupted transfers found in DOWNLOAD_DIR on startup
+    RESUME_ON_STARTUP = os.environ.get('RESUME_ON_STARTUP', 'true').lower() == 'true'
+    
+    # Persistent download store (SQLite, WAL mode)
+    PERSIST_DOWNLOADS = os.environ.get('PERSIST_DOWNLOADS', 'true').lower() == 'true'
+    STORE_BATCH_INTERVAL = 0.2  # seconds the store writer waits to batch changes
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))  # rows enqueued per lock acquisition
+    IMPORT_DIR = os.environ.get('IMPORT_DIR')  # server-side files POST /api/queue/import may read; unset disables `path`
+    HISTORY_MEMORY_SIZE = int(os.environ.get('HISTORY_MEMORY_SIZE', 10000))  # finished downloads kept in memory
     
     # Telegram settings (Pyrogram)
     TELEGRAM_API_ID = os.environ.get('TELEGRAM_API_ID')
@@ -16,23 +92,42 @@ class Config:
     TELEGRAM_SESSION_NAME = os.environ.get('TELEGRAM_SESSION_NAME', 'download_manager')
     TELEGRAM_PHONE = os.environ.get('TELEGRAM_PHONE')
     TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')  # Chat to send notifications to
-    TELEGRAM_ENABLED = bool(TELEGRAM_API_ID and TELEGRAM_API_HASH and TELEGRAM_PHONE)
+    TELEGRAM_CLIENT = os.environ.get('TELEGRAM_CLIENT', 'pyrogram')  # 'stub' records calls offline
+    TELEGRAM_ENABLED = TELEGRAM_CLIENT == 'stub' or bool(TELEGRAM_API_ID and TELEGRAM_API_HASH and TELEGRAM_PHONE)
+    TELEGRAM_SEND_FILES = os.environ.get('TELEGRAM_SEND_FILES', 'true').lower() == 'true'
+    TELEGRAM_MESSAGE_INTERVAL = float(os.environ.get('TELEGRAM_MESSAGE_INTERVAL', 1.0))  # seconds between API calls
+    TELEGRAM_EDIT_INTERVAL = float(os.environ.get('TELEGRAM_EDIT_INTERVAL', 5.0))  # seconds between progress edits
+    TELEGRAM_DIGEST_THRESHOLD = int(os.environ.get('TELEGRAM_DIGEST_THRESHOLD', 5))  # pending events sent as one digest above this
+    TELEGRAM_SPLIT_UPLOADS = os.environ.get('TELEGRAM_SPLIT_UPLOADS', 'true').lower() == 'true'  # send large files as parts
+    TELEGRAM_PART_SIZE = int(os.environ.get('TELEGRAM_PART_SIZE', 2000 * 1024 * 1024))  # at most Telegram's 2000MB limit
+    TELEGRAM_UPLOAD_CONCURRENCY = int(os.environ.get('TELEGRAM_UPLOAD_CONCURRENCY', 2))  # files or parts uploading at once
+    TELEGRAM_PROGRESS_MIN_SIZE = 20 * 1024 * 1024  # smaller uploads get no progress message
+    TELEGRAM_MAX_PENDING = 10000  # events buffered for the dispatcher before new ones are dropped
     
     # File paths
     BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
     INSTANCE_DIR = os.path.join(BASE_DIR, 'instance')
     LOG_DIR = os.path.join(BASE_DIR, 'logs')
     CSV_FILE = os.path.join(INSTANCE_DIR, 'downloads.csv')
+    DATABASE_FILE = os.environ.get('DATABASE_FILE') or os.path.join(INSTANCE_DIR, 'downloads.db')
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(INSTANCE_DIR, 'cache')
     SESSION_DIR = os.path.join(INSTANCE_DIR, 'sessions')
+    DOWNLOAD_DIR = os.environ.get('DOWNLOAD_DIR') or os.path.join(BASE_DIR, 'temp_downloads')
+    COORDINATOR_ADDRESS = COORDINATOR_ADDRESS or f"unix:{os.path.join(INSTANCE_DIR, 'coordinator.sock')}"
     
     # Logging settings
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     LOG_MAX_BYTES = 10 * 1024 * 1024  # 10MB
     LOG_BACKUP_COUNT = 5
+    LOG_JSON = os.environ.get('LOG_JSON', 'false').lower() == 'true'  # one JSON object per line in the log files
+    LOG_TAIL_MAX_LINES = 5000  # most lines GET /api/logs returns
     
     # Web interface settings
     REFRESH_INTERVAL = 500  # milliseconds
+    SSE_MAX_RATE = float(os.environ.get('SSE_MAX_RATE', 4))  # event batches per second per stream
+    SSE_KEEPALIVE = 15  # seconds between keepalive comments on an idle stream
+    SSE_RETRY_MS = 3000  # browser reconnect delay
     
     @staticmethod
     def init_app(app):
@@ -0,0 +1,295 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Set
+import aiohttp
+from app.config import Config
+from app.core.logger import main_logger
+from app.core.download_manager import DownloadManager, DownloadItem, DownloadCancelled
+from app.core.integrity import IntegrityError, StreamHasher
+from app.core.connections import ConnectionStats
+from app.core.fileio import ProgressThrottle, preallocate, write_all
+from app.core.journal import TransferJournal
+from app.core.retry import TruncatedTransfer
+from app.core.segments import supports_ranges
+
+
+class AsyncDownloadManager(DownloadManager):
+    """DownloadManager that runs every transfer on a single asyncio event loop.
+
+    Transfers are coroutines rather than threads, so `max_workers` bounds
+    in-flight transfers (typically thousands) instead of OS threads. Sockets
+    are non-blocking through aiohttp and file writes are batched onto a small
+    I/O thread pool, so the loop never waits on disk. The public API is the
+    same as the threaded manager. Segmented range downloads are left to the
+    threaded engine; this one targets many small-to-medium files.
+    """
+
+    def __init__(self, max_workers: int = 1000, bandwidth_limit: int = 1024*1024,
+                 io_threads: int = 4):
+        self.loop = asyncio.new_event_loop()
+        self._io_pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='download-io')
+        self._tasks: Set[asyncio.Task] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._dispatcher = None
+        self._connection_stats = ConnectionStats()
+        self._dns_stats = {'hits': 0, 'misses': 0}
+        # Resolved and replaced on every state change; coroutines waiting for
+        # work, a resume or a cancel await the current one.
+        self._changed = self.loop.create_future()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True,
+                                             name='download-loop')
+        self._loop_thread.start()
+        super().__init__(max_workers=max_workers, bandwidth_limit=bandwidth_limit)
+        self.retry_policy.transient += (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+    def run_coroutine(self, coro):
+        """Schedule a coroutine on the engine's event loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _start_workers(self):
+        """Start the dispatcher coroutine, or wake it after a resize"""
+        if self._dispatcher is None:
+            self._dispatcher = self.run_coroutine(self._dispatch())
+        else:
+            self.loop.call_soon_threadsafe(self._signal)
+
+    def _notify_workers(self, all: bool = False):
+        super()._notify_workers(all)
+        self.loop.call_soon_threadsafe(self._signal)
+
+    def _signal(self):
+        """Wake every coroutine waiting for a state change (loop thread only)"""
+        changed, self._changed = self._changed, self.loop.create_future()
+        if not changed.done():
+            changed.set_result(None)
+
+    async def _wait_for_change(self):
+        await asyncio.shield(self._changed)
+
+    async def _run_io(self, func, *args):
+        """Run blocking file work on the I/O pool"""
+        return await self.loop.run_in_executor(self._io_pool, func, *args)
+
+    async def _dispatch(self):
+        """Start transfers whenever there is queued work and a free slot"""
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=Config.ASYNC_LIMIT_PER_HOST,
+            keepalive_timeout=Config.HTTP_POOL_IDLE_TIMEOUT,
+            use_dns_cache=Config.DNS_CACHE_TTL > 0,
+            ttl_dns_cache=Config.DNS_CACHE_TTL or None
+        )
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=Config.HTTP_CONNECT_TIMEOUT,
+                                        sock_read=Config.HTTP_READ_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                              trace_configs=[self._trace_config()])
+        main_logger.info(f"Asyncio download engine started with {self.max_workers} slots")
+        while True:
+            with self._wakeup:
+                while len(self._tasks) < self.max_workers:
+                    item = self._take_item()
+                    if item is None:
+                        break
+                    task = self.loop.create_task(self._run_item(item))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._task_done)
+            await self._wait_for_change()
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """Count requests, new connections and DNS cache use per host"""
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.host = params.url.host
+            self._connection_stats.add(ctx.host, request_count=1)
+
+        async def on_connection_create_end(session, ctx, params):
+            self._connection_stats.add(ctx.host, connection_count=1)
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self._dns_stats['hits'] += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self._dns_stats['misses'] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+    def get_connection_stats(self) -> dict:
+        """Get connection reuse and DNS cache counters from the aiohttp connector"""
+        stats = ConnectionStats.summarize(self._connection_stats.snapshot())
+        stats['pools'] = len(stats['hosts'])
+        stats['dns'] = dict(self._dns_stats)
+        return stats
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._signal()
+
+    async def _run_item(self, item: DownloadItem):
+        self.metrics.observe('queue_wait_seconds', time.monotonic() - item.queued_at)
+        busy = time.perf_counter()
+        with self._stats_lock:
+            self.busy_workers += 1
+        try:
+            await self._process_download_async(item)
+        except Exception as e:
+            main_logger.error(f"Async transfer error: {str(e)}")
+        finally:
+            self._finish_item(item)
+            with self._stats_lock:
+                self.busy_workers -= 1
+            self.metrics.inc('worker_busy_seconds_total', time.perf_counter() - busy)
+
+    async def _process_download_async(self, item: DownloadItem):
+        """Process a single download on the event loop"""
+        if await self._run_io(self._serve_from_cache, item):
+            return
+        journal = None
+        hasher = None
+        try:
+            validator = await self._run_io(self._load_validator, item)
+            filename, journal = await self._run_io(self._begin_transfer, item, validator)
+
+            headers = self._request_headers(journal, validator)
+            started = time.perf_counter()
+            response = await self._session.get(item.url, headers=headers)
+            self.metrics.observe('download_ttfb_seconds', time.perf_counter() - started)
+            if response.status == 304:
+                response.release()
+                if await self._run_io(self._skip_unchanged, item, validator):
+                    return
+                # The cached copy was evicted since it was checked: fetch the file after all
+                response = await self._session.get(item.url)
+            async with response:
+                response.raise_for_status()
+                journal, resumed = self._resolve_journal(item, journal, filename, response, response.status)
+                hasher = self._start_hasher(item, journal)
+                resume_offset = journal.offset if resumed else 0
+                await self._download_single_async(item, response, journal, resumed, hasher)
+
+            await self._run_io(self._verify_transfer, item, journal, hasher, resume_offset)
+            await self._run_io(self._complete_transfer, item, journal, filename)
+
+        except DownloadCancelled:
+            await self._run_io(self._cancel_transfer, item, journal)
+        except IntegrityError as e:
+            await self._run_io(self._discard_part, journal)
+            await self._run_io(self._fail_transfer, item, None, e)
+        except Exception as e:
+            await self._run_io(self._fail_transfer, item, journal, e)
+        finally:
+            if hasher is not None:
+                hasher.cancel()
+
+    @staticmethod
+    def _open_part(path: str, resumed: bool, offset: int, total_size: int):
+        f = open(path, 'r+b' if resumed else 'wb', buffering=0)
+        f.seek(offset)
+        f.truncate()
+        preallocate(f, total_size)
+        return f
+
+    async def _download_single_async(self, item: DownloadItem, response: aiohttp.ClientResponse,
+                                     journal: TransferJournal, resumed: bool,
+                                     hasher: Optional[StreamHasher] = None):
+        """Stream a response body to disk, batching writes onto the I/O pool"""
+        total_size = journal.total_size
+        host = item.host
+        downloaded_size = journal.offset if resumed else 0
+        segment = [0, downloaded_size, total_size]
+        journal.segments = [segment]
+
+        f = await self._run_io(self._open_part, journal.part_path, resumed, downloaded_size, total_size)
+        progress = ProgressThrottle(Config.PROGRESS_INTERVAL)
+        buffer = bytearray()
+        try:
+            try:
+                # iter_any hands over each received block as is, without re-chunking
+                async for chunk in response.content.iter_any():
+                    buffer += chunk
+                    downloaded_size += len(chunk)
+                    if total_size and progress.due():
+                        self._set_progress(item, (downloaded_size / total_size) * 100)
+                    if len(buffer) >= Config.ASYNC_WRITE_BUFFER:
+                        data, buffer = buffer, bytearray()
+                        await self._run_io(write_all, f, memoryview(data))
+                        segment[1] = downloaded_size
+                        if hasher is not None:
+                            hasher.advance(downloaded_size)
+                        self._report_written(item, journal, downloaded_size)
+                        if journal.validator and journal.flush_due():
+                            await self._run_io(journal.save)
+                    await self._after_chunk_async(item, host, len(chunk))
+            except aiohttp.ClientPayloadError:
+                # Truncated body: keep what arrived and fetch the rest below if possible
+                if not (total_size and journal.validator and supports_ranges(response)):
+                    raise
+            if buffer:
+                await self._run_io(write_all, f, memoryview(buffer))
+            segment[1] = downloaded_size
+        finally:
+            await self._run_io(f.close)
+
+        if total_size and downloaded_size < total_size and journal.validator and supports_ranges(response):
+            main_logger.warning(
+                f"Connection closed after {downloaded_size} of {total_size} bytes for {item.url}, "
+                f"fetching the rest"
+            )
+            downloaded_size += await self._run_io(
+                self._fetch_range, item, journal, downloaded_size, total_size
+            )
+            segment[1] = downloaded_size
+        if total_size and downloaded_size != total_size:
+            raise TruncatedTransfer(f"Connection closed after {downloaded_size} of {total_size} bytes")
+        if total_size:
+            self._set_progress(item, 100)
+
+    async def _after_chunk_async(self, item: DownloadItem, host: Optional[str], nbytes: int):
+        """Account for, throttle and check control state after each chunk"""
+        self.metrics.inc('download_bytes_total', nbytes, (('host', host),))
+        delay = self.rate_limiter.reserve(nbytes, host, item.url)
+        while delay > 0:
+            # Sleep in short steps so limit changes apply mid-wait
+            await asyncio.sleep(min(delay, 0.5))
+            delay = self.rate_limiter.pending_delay(host, item.url)
+        await self._checkpoint_async(item)
+
+    async def _checkpoint_async(self, item: DownloadItem):
+        """Wait while paused, abort when cancelled"""
+        if (self.paused or item.paused) and not item.cancelled:
+            self._set_status(item, "paused")
+            while (self.paused or item.paused) and not item.cancelled:
+                await self._wait_for_change()
+            if not item.cancelled:
+                self._set_status(item, "downloading")
+        if item.cancelled:
+            raise DownloadCancelled(f"Download cancelled: {item.url}")
+
+    def get_worker_stats(self) -> dict:
+        """Get transfer slot usage"""
+        stats = super().get_worker_stats()
+        stats['engine'] = 'asyncio'
+        stats['workers'] = len(self._tasks)
+        return stats
+
+    def close(self):
+        """Cancel running transfers, close the HTTP session and stop the event loop"""
+        async def shutdown():
+            self._dispatcher.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            if self._session is not None:
+                await self._session.close()
+
+        self.run_coroutine(shutdown()).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join(timeout=10)
+        self._io_pool.shutdown(wait=False)
+        super().close()
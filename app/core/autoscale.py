@@ -0,0 +1,68 @@
+import threading
+import time
+from app.core.logger import main_logger
+
+
+class PoolAutoscaler:
+    """Hill-climbing controller for the download worker pool.
+
+    Every `interval` seconds it samples the manager's byte counter. While
+    there is queued work it adds one worker at a time, and keeps doing so
+    as long as each step raises aggregate throughput by at least `min_gain`.
+    When a step stops paying off, the pool steps back down and growth pauses
+    for a few intervals before it probes again.
+    """
+
+    def __init__(self, manager, min_workers: int = 1, max_workers: int = 32,
+                 interval: float = 5.0, min_gain: float = 0.05, cooldown: int = 6):
+        self.manager = manager
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.min_gain = min_gain
+        self.cooldown = cooldown
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        main_logger.info(f"Worker autoscaling enabled ({self.min_workers}-{self.max_workers} workers)")
+
+    def stop(self):
+        self._stop.set()
+        main_logger.info("Worker autoscaling disabled")
+
+    def _run(self):
+        last_bytes = self.manager.bytes_downloaded
+        last_time = time.monotonic()
+        baseline = None  # throughput measured before the last grow step
+        hold = 0
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            total = self.manager.bytes_downloaded
+            throughput = (total - last_bytes) / max(now - last_time, 1e-6)
+            last_bytes, last_time = total, now
+
+            size = self.manager.max_workers
+            if baseline is not None:
+                if throughput < baseline * (1 + self.min_gain) and size > self.min_workers:
+                    self.manager.set_max_workers(size - 1)
+                    hold = self.cooldown
+                    main_logger.info(
+                        f"Autoscaler: {size} workers gave {throughput:.0f} B/s "
+                        f"vs {baseline:.0f} B/s, stepping back"
+                    )
+                baseline = None
+                continue
+
+            if hold:
+                hold -= 1
+                continue
+
+            saturated = self.manager.busy_workers >= size and self.manager.get_queue_size() > 0
+            if saturated and size < self.max_workers:
+                baseline = throughput
+                self.manager.set_max_workers(size + 1)
+            elif size < self.min_workers:
+                self.manager.set_max_workers(self.min_workers)
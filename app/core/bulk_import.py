@@ -0,0 +1,120 @@
+import csv
+import json
+from typing import IO, Iterator, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+from app.core.integrity import format_digest, parse_digest
+
+# One parsed row: (url, caption, priority, expected digest, expected size),
+# or None for a row that was rejected
+ImportRow = Optional[Tuple[str, str, int, Optional[str], Optional[int]]]
+
+# Column or key names accepted for the expected digest
+DIGEST_FIELDS = ('digest', 'sha256', 'md5', 'checksum')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """Canonical form of an http(s) URL, or None if it is not one.
+
+    The scheme and host are lowercased, default ports and fragments are
+    dropped, and an empty path becomes '/', so trivially different
+    spellings of the same URL dedupe against each other.
+    """
+    url = (url or '').strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname.lower()
+    if ':' in netloc:
+        netloc = f"[{netloc}]"
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else '')
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def _row(url, caption=None, priority=None, digest=None, size=None) -> ImportRow:
+    url = normalize_url(url)
+    if url is None:
+        return None
+    try:
+        priority = int(priority) if priority not in (None, '') else 5
+        digest = format_digest(*parse_digest(digest)) if digest else None
+        size = int(size) if size not in (None, '') else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if size is not None and size < 0:
+        return None
+    return url, str(caption or ''), priority, digest, size
+
+
+def _record_row(record: dict) -> ImportRow:
+    digest = next((record[key] for key in DIGEST_FIELDS if record.get(key)), None)
+    return _row(record.get('url'), record.get('caption'), record.get('priority'),
+                digest, record.get('size'))
+
+
+def iter_csv(stream: IO[str]) -> Iterator[ImportRow]:
+    """Rows of a CSV file.
+
+    With a header line, columns are matched by name (url, caption, priority,
+    digest/sha256/md5, size); without one they are read positionally as
+    url,caption,priority,digest,size.
+    """
+    reader = csv.reader(stream)
+    header = None
+    for fields in reader:
+        if not fields or not any(field.strip() for field in fields):
+            continue
+        if reader.line_num == 1 and fields[0].strip().lower() == 'url':
+            header = [field.strip().lower() for field in fields]
+            continue
+        if header:
+            yield _record_row(dict(zip(header, fields)))
+        else:
+            yield _row(*fields[:5])
+
+
+def iter_jsonl(stream: IO[str]) -> Iterator[ImportRow]:
+    """Rows of a JSON Lines file: objects with url/caption/priority, or bare URL strings"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        if isinstance(record, str):
+            yield _row(record)
+        elif isinstance(record, dict):
+            yield _record_row(record)
+        else:
+            yield None
+
+
+def iter_rows(stream: IO[str], fmt: str) -> Iterator[ImportRow]:
+    """Parse an import stream incrementally in the given format ('csv' or 'jsonl')"""
+    if fmt == 'csv':
+        return iter_csv(stream)
+    if fmt == 'jsonl':
+        return iter_jsonl(stream)
+    raise ValueError(f"Unsupported import format: {fmt}")
+
+
+def detect_format(filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    """Guess the import format from a file name or MIME type, defaulting to CSV"""
+    name = (filename or '').lower()
+    mime = (content_type or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in mime or 'jsonl' in mime:
+        return 'jsonl'
+    return 'csv'
@@ -0,0 +1,211 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+from app.core.logger import main_logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_last_used ON blobs (last_used);
+DROP TABLE IF EXISTS urls;
+"""
+
+# Columns added to blobs after the first release, applied to older index databases
+MIGRATIONS = {
+    'mtime_ns': 'INTEGER',
+}
+
+# ioctl request for reflink copies on Linux filesystems that support them (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def link_file(src: str, dest: str) -> str:
+    """Make `dest` a copy of `src` as cheaply as the filesystem allows.
+
+    Tries a hardlink, then a reflink, then falls back to a full copy, and
+    returns which one was used. `dest` is replaced atomically.
+    """
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        # Already linked; rename() between two links to one inode is a no-op
+        return 'hardlink'
+    tmp = f"{dest}.link-{threading.get_ident()}"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+        method = 'hardlink'
+    except OSError:
+        method = 'copy'
+        try:
+            import fcntl
+            with open(src, 'rb') as s, open(tmp, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            method = 'reflink'
+        except (ImportError, OSError):
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+    return method
+
+
+class ContentCache:
+    """Content-addressed store of finished downloads.
+
+    Blobs live under `root/objects/<algorithm>/<xx>/<hex>` and are shared
+    with the download directory through hardlinks where possible. The index
+    is a small SQLite database; blobs are evicted least recently used first
+    once they exceed `max_bytes`. Blobs are looked up by digest only: a
+    URL's content is known from a digest the user gave or from a server
+    that answered 304 to the validators recorded with one.
+
+    A hardlinked blob is the same inode as the file in the download
+    directory, so editing that file in place edits the blob. Each blob's
+    size and mtime are recorded when it is stored; a blob that no longer
+    matches them is hashed again before it is served, and dropped if its
+    content changed.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(blobs)')}
+        for column, kind in MIGRATIONS.items():
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE blobs ADD COLUMN {column} {kind}")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def blob_path(self, digest: str) -> str:
+        algorithm, hexdigest = digest.split(':', 1)
+        return os.path.join(self.root, 'objects', algorithm, hexdigest[:2], hexdigest)
+
+    def lookup(self, digest: str) -> Optional[Tuple[str, int]]:
+        """Digest and size of the intact cached blob for a digest, if any"""
+        with self._lock:
+            row = self._conn.execute('SELECT size, mtime_ns FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                return None
+        try:
+            st = os.stat(self.blob_path(digest))
+        except OSError:
+            self._forget(digest)
+            return None
+        if (st.st_size, st.st_mtime_ns) != tuple(row) and not self._rehash(digest, st):
+            return None
+        return digest, st.st_size
+
+    def _rehash(self, digest: str, st: os.stat_result) -> bool:
+        """Check a blob whose size or mtime changed against its digest, dropping it if it differs"""
+        algorithm, hexdigest = digest.split(':', 1)
+        h = hashlib.new(algorithm)
+        try:
+            with open(self.blob_path(digest), 'rb') as f:
+                while block := f.read(1024 * 1024):
+                    h.update(block)
+        except OSError:
+            self._forget(digest)
+            return False
+        if h.hexdigest() != hexdigest:
+            main_logger.warning(f"Cached blob {digest} was modified on disk, dropping it")
+            self._forget(digest)
+            return False
+        with self._lock:
+            self._conn.execute('UPDATE blobs SET size = ?, mtime_ns = ? WHERE digest = ?',
+                               (st.st_size, st.st_mtime_ns, digest))
+            self._conn.commit()
+        return True
+
+    def materialize(self, digest: str, dest: str) -> bool:
+        """Place a cached blob at `dest`; False if it has gone missing"""
+        try:
+            method = link_file(self.blob_path(digest), dest)
+        except FileNotFoundError:
+            self._forget(digest)
+            return False
+        except OSError as e:
+            main_logger.warning(f"Could not link cached blob {digest} to {dest}: {str(e)}")
+            return False
+        with self._lock:
+            self._conn.execute('UPDATE blobs SET last_used = ? WHERE digest = ?', (time.time(), digest))
+            self._conn.commit()
+            self.hits += 1
+            self.bytes_saved += os.path.getsize(dest)
+        main_logger.debug(f"Cache hit for {digest} ({method}) -> {dest}")
+        return True
+
+    def insert(self, path: str, digest: str):
+        """Add a finished file to the cache"""
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            link_file(path, blob)
+        st = os.stat(blob)
+        size = st.st_size
+        now = time.time()
+        with self._lock:
+            new = self._conn.execute(
+                'INSERT OR IGNORE INTO blobs (digest, size, last_used, mtime_ns) VALUES (?, ?, ?, ?)',
+                (digest, size, now, st.st_mtime_ns)
+            ).rowcount
+            if not new:
+                self._conn.execute('UPDATE blobs SET last_used = ? WHERE digest = ?', (now, digest))
+            self._conn.commit()
+            self.misses += 1
+            if new:
+                self.total_bytes += size
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used blobs until the cache fits in max_bytes"""
+        evicted = 0
+        while self.total_bytes > self.max_bytes:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT digest FROM blobs ORDER BY last_used LIMIT 1'
+                ).fetchone()
+            if row is None:
+                break
+            self._forget(row[0])
+            evicted += 1
+        if evicted:
+            main_logger.info(f"Evicted {evicted} blobs from the download cache")
+
+    def _forget(self, digest: str):
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            self._conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+            self._conn.commit()
+            if row:
+                self.total_bytes -= row[0]
+        try:
+            os.remove(self.blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            blobs = self._conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+            return {
+                'blobs': blobs,
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_saved': self.bytes_saved
+            }
@@ -0,0 +1,206 @@
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from app.core.logger import main_logger
+
+
+class DNSCache:
+    """Process-wide cache of resolved addresses with a fixed TTL.
+
+    Once installed, it wraps urllib3's `create_connection` so that every new
+    connection reuses a recent lookup instead of calling getaddrinfo again.
+    TLS still verifies against the original hostname, because urllib3 passes
+    that separately as server_hostname.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        """Return cached addresses for host:port, resolving on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._entries[(host, port)] = (now + self.ttl, addresses)
+        return addresses
+
+    def install(self):
+        """Route urllib3's new connections through this cache"""
+        if self._installed:
+            return
+        from urllib3.util import connection
+        original = connection.create_connection
+
+        def create_connection(address, *args, **kwargs):
+            host, port = address
+            try:
+                addresses = self.resolve(host, port)
+            except OSError:
+                return original(address, *args, **kwargs)
+            error = None
+            for ip in addresses:
+                try:
+                    return original((ip, port), *args, **kwargs)
+                except OSError as e:
+                    error = e
+            raise error
+
+        connection.create_connection = create_connection
+        self._installed = True
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+class ConnectionStats:
+    """Request and new-connection counters per host"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts: Dict[str, Dict[str, int]] = {}
+
+    def add(self, host: str, request_count: int = 0, connection_count: int = 0):
+        with self._lock:
+            counters = self.hosts.setdefault(host, {'requests': 0, 'connections': 0})
+            counters['requests'] += request_count
+            counters['connections'] += connection_count
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {host: dict(counters) for host, counters in self.hosts.items()}
+
+    @staticmethod
+    def summarize(hosts: Dict[str, Dict[str, int]]) -> dict:
+        """Totals plus pool hits (reused connections) and misses (new connections)"""
+        for counters in hosts.values():
+            counters['reused'] = max(0, counters['requests'] - counters['connections'])
+        return {
+            'requests': sum(c['requests'] for c in hosts.values()),
+            'hits': sum(c['reused'] for c in hosts.values()),
+            'misses': sum(c['connections'] for c in hosts.values()),
+            'hosts': hosts
+        }
+
+
+class _PoolEntry:
+    __slots__ = ('session', 'last_used')
+
+    def __init__(self, session: requests.Session):
+        self.session = session
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """Keep-alive HTTP sessions keyed by (scheme, host), shared by all workers.
+
+    Each origin gets its own requests.Session whose adapter keeps up to
+    `pool_size` persistent connections. Sessions that have not been used
+    for `idle_timeout` seconds are closed. Transfers still streaming on an
+    evicted session finish normally; their connection is closed when it is
+    released instead of being returned to the pool.
+    """
+
+    def __init__(self, pool_size: int = 10, idle_timeout: float = 60, dns_ttl: float = 300,
+                 timeout: Optional[Tuple[float, float]] = None):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout  # (connect, read) seconds for requests that set none
+        self.dns_cache = DNSCache(dns_ttl) if dns_ttl > 0 else None
+        if self.dns_cache:
+            self.dns_cache.install()
+        self._pools: Dict[Tuple[str, str], _PoolEntry] = {}
+        self._lock = threading.Lock()
+        self._retired = ConnectionStats()
+        self._last_eviction = time.monotonic()
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def session_for(self, url: str) -> requests.Session:
+        """Return the shared session for a URL's origin"""
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.netloc)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._pools.get(key)
+            if entry is None:
+                entry = self._pools[key] = _PoolEntry(self._new_session())
+            entry.last_used = now
+        if now - self._last_eviction > self.idle_timeout:
+            self.evict_idle()
+        return entry.session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET through the pooled session for the URL's origin"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session_for(url).get(url, **kwargs)
+
+    def evict_idle(self):
+        """Close sessions that have not been used within idle_timeout"""
+        now = time.monotonic()
+        with self._lock:
+            self._last_eviction = now
+            idle = [key for key, entry in self._pools.items()
+                    if now - entry.last_used > self.idle_timeout]
+            entries = [self._pools.pop(key) for key in idle]
+        for entry in entries:
+            for host, counters in self._session_counters(entry.session).items():
+                self._retired.add(host, counters['requests'], counters['connections'])
+            entry.session.close()
+        if entries:
+            main_logger.debug(f"Evicted {len(entries)} idle connection pools")
+
+    @staticmethod
+    def _session_counters(session: requests.Session) -> Dict[str, Dict[str, int]]:
+        """Read urllib3's per-pool request and connection counters"""
+        counters: Dict[str, Dict[str, int]] = {}
+        seen = set()
+        for adapter in session.adapters.values():
+            if id(adapter) in seen:
+                continue
+            seen.add(id(adapter))
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = counters.setdefault(pool.host, {'requests': 0, 'connections': 0})
+                host['requests'] += pool.num_requests
+                host['connections'] += pool.num_connections
+        return counters
+
+    def get_stats(self) -> dict:
+        """Pool hit/miss counters per host, plus DNS cache counters"""
+        hosts = self._retired.snapshot()
+        with self._lock:
+            sessions = [entry.session for entry in self._pools.values()]
+        for session in sessions:
+            for host, counters in self._session_counters(session).items():
+                total = hosts.setdefault(host, {'requests': 0, 'connections': 0})
+                total['requests'] += counters['requests']
+                total['connections'] += counters['connections']
+        stats = ConnectionStats.summarize(hosts)
+        stats['pools'] = len(sessions)
+        stats['dns'] = self.dns_cache.get_stats() if self.dns_cache else None
+        return stats
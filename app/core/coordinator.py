@@ -0,0 +1,408 @@
+import atexit
+import hmac
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from app.config import Config
+from app.core.logger import main_logger
+from app.core.download_manager import DownloadManager, DownloadItem
+
+# Item fields a worker needs to run a transfer
+LEASED_FIELDS = ('id', 'url', 'caption', 'priority', 'expected_digest', 'expected_size', 'attempts')
+
+
+class CoordinatorError(Exception):
+    """The coordinator rejected a request"""
+
+
+def parse_address(address: str) -> Tuple[int, object]:
+    """Socket family and address for 'unix:/path', 'tcp://host:port' or 'host:port'"""
+    if address.startswith('unix:'):
+        path = address[5:]
+        return socket.AF_UNIX, path[2:] if path.startswith('//') else path
+    if address.startswith('tcp://'):
+        address = address[6:]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+class CoordinatorClient:
+    """One connection to a coordinator; requests and replies are JSON lines.
+
+    Not thread-safe: each worker thread keeps its own. The connection is
+    opened on first use and again after an error.
+    """
+
+    def __init__(self, address: str, token: Optional[str] = None, timeout: float = 60):
+        self.address = address
+        self.token = token
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def call(self, op: str, **fields) -> dict:
+        if self._sock is None:
+            family, address = parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(address)
+            except OSError:
+                sock.close()
+                raise
+            self._sock, self._file = sock, sock.makefile('rwb')
+        message = dict(fields, op=op)
+        if self.token:
+            message['token'] = self.token
+        try:
+            self._file.write(json.dumps(message).encode() + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError('Coordinator closed the connection')
+        except OSError:
+            self.close()
+            raise
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise CoordinatorError(reply['error'])
+        return reply
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = self._file = None
+
+
+class _Lease:
+    __slots__ = ('id', 'item', 'worker', 'expires')
+
+    def __init__(self, item: DownloadItem, worker: str):
+        self.id = uuid.uuid4().hex
+        self.item = item
+        self.worker = worker
+        self.expires = time.monotonic() + Config.LEASE_TIMEOUT
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        for line in self.rfile:
+            try:
+                reply = coordinator.handle_request(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'error': f"Bad request: {str(e)}"}
+            except Exception as e:
+                main_logger.error(f"Coordinator request failed: {str(e)}", exc_info=True)
+                reply = {'error': str(e)}
+            try:
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+            except OSError:
+                return
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class CoordinatorManager(DownloadManager):
+    """DownloadManager whose transfers run in separate worker processes.
+
+    The coordinator keeps the queue, history, store, breakers and per-host
+    caps just as the threaded engine does, but runs no transfers itself.
+    Workers (`python -m app.core.worker`, on this host or others) connect
+    over a unix or TCP socket and lease queued items. They report progress
+    and bytes received in heartbeats and send back each outcome, which is
+    applied here as if the transfer had run locally, so the web API sees
+    one unified state. A lease not renewed within LEASE_TIMEOUT seconds
+    (the worker died or lost the network) is dropped and its item queued
+    again. Pause, resume and cancel reach the worker in the reply to its
+    next heartbeat.
+
+    Bandwidth limits set here travel with each lease and heartbeat reply.
+    Each worker enforces them on its own transfers, so the global and
+    per-host limits are split evenly between the workers transferring at
+    the time. Segment connections are a worker's own; `max_workers` caps
+    the leases held at once across all workers, so resizing and
+    autoscaling work as with the other engines.
+    """
+
+    def __init__(self, max_workers: int = 5, bandwidth_limit: int = 1024*1024,
+                 address: Optional[str] = None, local_workers: Optional[int] = None):
+        self.address = address or Config.COORDINATOR_ADDRESS
+        self._leases: Dict[str, _Lease] = {}
+        self._remote: Dict[str, dict] = {}  # worker name -> last_seen, leased, completed, failed
+        self._processes: List[subprocess.Popen] = []
+        super().__init__(max_workers=max_workers, bandwidth_limit=bandwidth_limit)
+        self._server = self._listen()
+        threading.Thread(target=self._server.serve_forever, daemon=True, name='coordinator').start()
+        threading.Thread(target=self._reap_leases, daemon=True, name='lease-reaper').start()
+        main_logger.info(f"Coordinator listening on {self.address}")
+        local_workers = Config.COORDINATOR_LOCAL_WORKERS if local_workers is None else local_workers
+        for i in range(local_workers):
+            self._spawn_worker(f"{socket.gethostname()}-local{i + 1}")
+        if self._processes:
+            atexit.register(self.stop_local_workers)
+
+    def _define_metrics(self):
+        super()._define_metrics()
+        self.metrics.counter('lease_expirations_total', 'Leases dropped without a result, by worker')
+
+    def _start_workers(self):
+        """Transfers run in the workers; there are no download threads here"""
+        with self._wakeup:
+            self._notify_workers(all=True)
+
+    def _listen(self) -> socketserver.BaseServer:
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            os.makedirs(os.path.dirname(address) or '.', exist_ok=True)
+            server = _UnixServer(address, _RequestHandler)
+            os.chmod(address, 0o600)
+        else:
+            if not Config.COORDINATOR_TOKEN and address[0] not in ('127.0.0.1', 'localhost', '::1'):
+                main_logger.warning(f"Coordinator on {self.address} accepts workers without a token; "
+                                    f"set COORDINATOR_TOKEN")
+            server = _TCPServer(address, _RequestHandler)
+            if address[1] == 0:
+                # Port 0 picks a free port; workers need the real one
+                self.address = f"tcp://{address[0]}:{server.server_address[1]}"
+        server.coordinator = self
+        return server
+
+    def _spawn_worker(self, name: str):
+        """Start a worker process on this host, connected to this coordinator"""
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'app.core.worker', '--coordinator', self.address, '--name', name],
+            cwd=Config.BASE_DIR
+        )
+        self._processes.append(process)
+        main_logger.info(f"Started local worker {name} (pid {process.pid})")
+
+    def stop_local_workers(self):
+        """Terminate the worker processes this coordinator started"""
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._processes = []
+
+    def close(self):
+        """Stop serving workers and the local ones, then the rest of the engine"""
+        self._server.shutdown()
+        self._server.server_close()
+        self.stop_local_workers()
+        super().close()
+
+    def handle_request(self, request: dict) -> dict:
+        """Serve one request from a worker"""
+        if Config.COORDINATOR_TOKEN and not hmac.compare_digest(
+                str(request.get('token', '')), Config.COORDINATOR_TOKEN):
+            return {'error': 'Invalid coordinator token'}
+        op = request['op']
+        if op == 'lease':
+            return self._lease(str(request['worker']), float(request.get('wait', 0)))
+        if op == 'heartbeat':
+            return self._heartbeat(request['lease'], request.get('progress'),
+                                   request.get('status'), int(request.get('bytes') or 0))
+        if op == 'result':
+            return self._result(request['lease'], request)
+        return {'error': f"Unknown operation: {op}"}
+
+    def _seen(self, worker: str) -> dict:
+        stats = self._remote.get(worker)
+        if stats is None:
+            stats = self._remote[worker] = {'leased': 0, 'completed': 0, 'failed': 0}
+            main_logger.info(f"Worker {worker} connected")
+        stats['last_seen'] = time.time()
+        return stats
+
+    def _lease(self, worker: str, wait: float) -> dict:
+        """Hand the next runnable item to a worker, waiting up to `wait` seconds for one"""
+        deadline = time.monotonic() + min(wait, Config.LEASE_TIMEOUT)
+        with self._wakeup:
+            stats = self._seen(worker)
+            while True:
+                item = self._take_item() if len(self._leases) < self.max_workers else None
+                if item is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {'lease': None}
+                self._wakeup.wait(remaining)
+            lease = _Lease(item, worker)
+            self._leases[lease.id] = lease
+            stats['leased'] += 1
+            item.start_time = time.time()
+            item.attempts += 1
+            self.active_downloads[item.url] = item
+            self._set_status(item, "downloading")
+            limits = self._limits(item)
+        self.metrics.observe('queue_wait_seconds', time.monotonic() - item.queued_at)
+        with self._stats_lock:
+            self.busy_workers += 1
+        validator = self.store.get_validator(item.url) if self.store else None
+        return {
+            'lease': lease.id,
+            'timeout': Config.LEASE_TIMEOUT,
+            'item': {field: getattr(item, field) for field in LEASED_FIELDS},
+            'validator': validator,
+            'limits': limits
+        }
+
+    def _limits(self, item: DownloadItem) -> dict:
+        """Bandwidth limits for the worker running `item`; caller holds self._wakeup"""
+        workers = {lease.worker for lease in self._leases.values()}
+        host_workers = {lease.worker for lease in self._leases.values() if lease.item.host == item.host}
+        host_limit = self.rate_limiter.get_host_limits().get(item.host, 0)
+        return {
+            'global': -(-self.bandwidth_limit // max(1, len(workers))),
+            'host': -(-host_limit // max(1, len(host_workers))),
+            'download': self.rate_limiter.get_item_limits().get(item.url, 0)
+        }
+
+    def _heartbeat(self, lease_id: str, progress: Optional[float], status: Optional[str], nbytes: int) -> dict:
+        """Renew a lease and record progress; the reply carries pause and cancel requests"""
+        with self._wakeup:
+            lease = self._leases.get(lease_id)
+            if lease is None:
+                return {'lease': None}
+            lease.expires = time.monotonic() + Config.LEASE_TIMEOUT
+            self._seen(lease.worker)
+            item = lease.item
+            if status in ('downloading', 'paused') and status != item.status:
+                self._set_status(item, status)
+            limits = self._limits(item)
+        if nbytes:
+            self.metrics.inc('download_bytes_total', nbytes, (('host', item.host),))
+        if progress is not None and progress != item.progress:
+            self._set_progress(item, progress)
+        return {'lease': lease_id, 'paused': self.paused or item.paused, 'cancelled': item.cancelled,
+                'limits': limits}
+
+    def _result(self, lease_id: str, outcome: dict) -> dict:
+        """Apply the outcome of a leased transfer"""
+        with self._wakeup:
+            lease = self._leases.pop(lease_id, None)
+            if lease is None:
+                # Expired and queued again meanwhile; the new lease decides
+                return {'accepted': False}
+            stats = self._seen(lease.worker)
+        item = lease.item
+        status = outcome['status']
+        nbytes = int(outcome.get('bytes') or 0)
+        if nbytes:
+            self.metrics.inc('download_bytes_total', nbytes, (('host', item.host),))
+        try:
+            item.filename = outcome.get('filename') or item.filename
+            item.digest = outcome.get('digest') or item.digest
+            item.end_time = time.time()
+            if status in ('completed', 'skipped_unchanged'):
+                stats['completed'] += 1
+                self._complete_leased(item, status, outcome)
+            elif status == 'cancelled':
+                with self._wakeup:
+                    self.active_downloads.pop(item.url, None)
+                self._set_status(item, "cancelled")
+            else:
+                stats['failed'] += 1
+                item.error = outcome.get('error') or 'Worker reported no outcome'
+                retry_after = outcome.get('retry_after')
+                self._settle_failure(item, outcome.get('error_class') or 'WorkerError',
+                                     bool(outcome.get('retryable')),
+                                     float(retry_after) if retry_after is not None else None)
+        finally:
+            with self._stats_lock:
+                self.busy_workers -= 1
+            self._finish_item(item)
+        return {'accepted': True}
+
+    def _complete_leased(self, item: DownloadItem, status: str, outcome: dict):
+        item.progress = 100
+        if outcome.get('validator') and self.store is not None:
+            self.store.record_validator(outcome['validator'])
+        with self._wakeup:
+            self.active_downloads.pop(item.url, None)
+        if status == 'skipped_unchanged':
+            with self._stats_lock:
+                self.skipped_unchanged += 1
+        elif outcome.get('size') is not None:
+            self._observe_completed(item, int(outcome['size']))
+        # Workers keep no cache; a file they saved where this host can see it is cached here
+        if status == 'completed' and self.cache is not None and item.digest \
+                and item.filename and os.path.exists(item.filename):
+            try:
+                self.cache.insert(item.filename, item.digest)
+            except OSError as e:
+                main_logger.warning(f"Could not add {item.url} to the download cache: {str(e)}")
+        self._host_succeeded(item.host)
+        self._set_status(item, status)
+
+    def _reap_leases(self):
+        """Queue items again whose worker stopped sending heartbeats"""
+        while True:
+            time.sleep(max(0.5, Config.LEASE_TIMEOUT / 4))
+            now = time.monotonic()
+            with self._wakeup:
+                expired = [lease for lease in self._leases.values() if lease.expires < now]
+                for lease in expired:
+                    del self._leases[lease.id]
+                    item = lease.item
+                    self.active_downloads.pop(item.url, None)
+                    self.download_queue.done(item.url)
+                    self.metrics.inc('lease_expirations_total', labels=(('worker', lease.worker),))
+                    main_logger.warning(f"Lease on {item.url} held by {lease.worker} expired, queueing it again")
+                    if item.cancelled:
+                        self._set_status(item, "cancelled")
+                    elif item.paused:
+                        self.paused_downloads[item.url] = item
+                        self._set_status(item, "paused")
+                    else:
+                        item.progress = 0
+                        self._requeue(item)
+            for lease in expired:
+                with self._stats_lock:
+                    self.busy_workers -= 1
+                self._release_probe(lease.item)
+
+    def get_worker_stats(self) -> dict:
+        """Get connected workers and the transfers they hold"""
+        now = time.time()
+        with self._wakeup:
+            held: Dict[str, int] = {}
+            for lease in self._leases.values():
+                held[lease.worker] = held.get(lease.worker, 0) + 1
+            remote = {name: dict(stats, active=held.get(name, 0),
+                                 connected=now - stats['last_seen'] < 2 * Config.LEASE_TIMEOUT)
+                      for name, stats in self._remote.items()}
+        return {
+            'engine': 'distributed',
+            'address': self.address,
+            'max_workers': self.max_workers,
+            'workers': sum(1 for stats in remote.values() if stats['connected']),
+            'busy_workers': sum(held.values()),
+            'autoscale': self.autoscaler is not None,
+            'remote': remote
+        }
@@ -1,111 +1,1313 @@
+import hashlib
 import os
-import queue
+import sys
 import threading
+import time
+import uuid
 import requests
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
+from urllib.parse import urlparse
+from app.config import Config
 from app.core.logger import main_logger
+from app.core.autoscale import PoolAutoscaler
+from app.core.bulk_import import ImportRow, detect_format, iter_rows
+from app.core.connections import ConnectionPool
+from app.core.download_queue import FairQueue, url_host
+from app.core.events import EventBus
+from app.core.history import DownloadHistory
+from app.core.fileio import (AdaptiveChunkSize, ProgressThrottle, ResponseReader,
+                              get_buffer, preallocate, write_all)
+from app.core.integrity import IntegrityError, StreamHasher, contiguous_prefix, format_digest, parse_digest
+from app.core.journal import TransferJournal, find_journals
+from app.core.metrics import LOCK_BUCKETS, RATE_BUCKETS, Metrics, TimedLock
+from app.core.ratelimit import RateLimiter
+from app.core.retry import CircuitBreakers, RetryPolicy, Scheduler, TruncatedTransfer
+from app.core.segments import SegmentedDownload, supports_ranges
+from app.core.store import DownloadStore, PENDING_STATUSES
 
-@dataclass
 class DownloadItem:
-    url: str
-    caption: str = ""
-    priority: int = 5
-    status: str = "queued"
-    progress: float = 0
-    error: Optional[str] = None
-    start_time: Optional[datetime] = None
-    end_time: Optional[datetime] = None
+    """One URL and the state of its download.
+
+    Slotted, since a big manifest queues millions of these: times are epoch
+    seconds rather than datetimes, and host, caption and status strings are
+    interned so items sharing them share one object.
+    """
+    __slots__ = ('url', 'host', 'caption', 'priority', 'status', 'progress', 'error',
+                 'start_time', 'end_time', 'paused', 'cancelled', 'expected_digest',
+                 'expected_size', 'digest', 'filename', 'attempts', 'next_attempt', 'queued_at', 'id')
+
+    def __init__(self, url: str, caption: str = "", priority: int = 5, status: str = "queued",
+                 progress: float = 0, error: Optional[str] = None,
+                 start_time: Optional[float] = None, end_time: Optional[float] = None,
+                 paused: bool = False, cancelled: bool = False,
+                 expected_digest: Optional[str] = None,  # 'algorithm:hex'
+                 expected_size: Optional[int] = None,
+                 digest: Optional[str] = None,  # 'algorithm:hex' of the completed file
+                 filename: Optional[str] = None,  # chosen when the transfer starts
+                 attempts: int = 0,  # transfers started since it was added or manually retried
+                 next_attempt: Optional[float] = None,  # when a scheduled retry is due
+                 queued_at: Optional[float] = None,  # monotonic time it last entered the queue
+                 id: Optional[str] = None):
+        self.url = url
+        self.host = url_host(url)
+        self.caption = sys.intern(caption) if caption else ""
+        self.priority = priority
+        self.status = sys.intern(status)
+        self.progress = progress
+        self.error = error
+        self.start_time = start_time
+        self.end_time = end_time
+        self.paused = paused
+        self.cancelled = cancelled
+        self.expected_digest = expected_digest
+        self.expected_size = expected_size
+        self.digest = digest
+        self.filename = filename
+        self.attempts = attempts
+        self.next_attempt = next_attempt
+        self.queued_at = time.monotonic() if queued_at is None else queued_at
+        self.id = id or uuid.uuid4().hex
+
+    def __repr__(self) -> str:
+        return f"DownloadItem(id={self.id!r}, url={self.url!r}, status={self.status!r}, priority={self.priority})"
+
+# Statuses that end a transfer attempt, counted in downloads_finished_total
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled', 'skipped_unchanged')
+
+class DownloadCancelled(Exception):
+    """Raised inside a transfer when its download has been cancelled"""
 
 class DownloadManager:
     def __init__(self, max_workers: int = 5, bandwidth_limit: int = 1024*1024):
         self.max_workers = max_workers
         self.bandwidth_limit = bandwidth_limit
-        self.download_queue = queue.PriorityQueue()
+        self.rate_limiter = RateLimiter(bandwidth_limit)
+        self.http = ConnectionPool(
+            pool_size=Config.HTTP_POOL_SIZE,
+            idle_timeout=Config.HTTP_POOL_IDLE_TIMEOUT,
+            dns_ttl=Config.DNS_CACHE_TTL,
+            timeout=(Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+        )
+        self.retry_policy = RetryPolicy(Config.RETRY_MAX_ATTEMPTS, Config.RETRY_BASE_DELAY, Config.RETRY_MAX_DELAY)
+        self.breakers = CircuitBreakers(
+            Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RESET_TIMEOUT, Config.BREAKER_MAX_RESET_TIMEOUT
+        )
+        self.scheduler = Scheduler()
+        self.events = EventBus()
+        self.metrics = Metrics()
+        self._define_metrics()
+        self.download_queue: FairQueue[DownloadItem] = FairQueue(
+            max_per_host=Config.HOST_MAX_CONNECTIONS,
+            aging=Config.PRIORITY_AGING,
+            share=Config.HOST_FAIR_SHARE
+        )
+        self.paused_downloads: Dict[str, DownloadItem] = {}
         self.active_downloads: Dict[str, DownloadItem] = {}
-        self.failed_downloads: List[DownloadItem] = []
+        # Items off the queue until a retry is due or their host recovers;
+        # the deferred ones are also indexed by host.
+        self.waiting_downloads: Dict[str, DownloadItem] = {}
+        self._deferred: Dict[str, Dict[str, DownloadItem]] = {}
         self.workers: List[threading.Thread] = []
         self.paused = False
-        self.lock = threading.Lock()
+        self.lock = TimedLock(self.metrics, 'manager')
+        # Workers and paused transfers sleep on this until there is work,
+        # a resume, a cancel or a pool resize.
+        self._wakeup = threading.Condition(TimedLock(self.metrics, 'queue'))
+        self._stats_lock = threading.Lock()
+        self.busy_workers = 0
+        self.skipped_unchanged = 0
+        self.autoscaler = None
+        self.cache = None
+        if Config.CACHE_ENABLED:
+            from app.core.cache import ContentCache
+            self.cache = ContentCache(Config.CACHE_DIR, Config.CACHE_MAX_BYTES)
+        # Download paths in use by active transfers, so two URLs never share one
+        self._claimed_paths: Dict[str, str] = {}
+        self.store = None
+        if Config.PERSIST_DOWNLOADS:
+            self.store = DownloadStore(Config.DATABASE_FILE, batch_interval=Config.STORE_BATCH_INTERVAL)
+        # Completed, failed, cancelled and skipped items; failed ones wait here for a manual retry
+        self.history: DownloadHistory[DownloadItem] = DownloadHistory(
+            Config.HISTORY_MEMORY_SIZE, self.store, self.describe_item, self._item_from_row
+        )
+        if self.store is not None:
+            self.restore_from_store()
+            self.events.add_listener(self._persist)
+        self.notifications = None
+        if Config.TELEGRAM_ENABLED:
+            # asyncio and the client backend load only when notifications are on
+            from app.core.telegram_dispatch import TelegramDispatcher
+            self.notifications = TelegramDispatcher(
+                message_interval=Config.TELEGRAM_MESSAGE_INTERVAL,
+                edit_interval=Config.TELEGRAM_EDIT_INTERVAL,
+                digest_threshold=Config.TELEGRAM_DIGEST_THRESHOLD,
+                max_pending=Config.TELEGRAM_MAX_PENDING,
+                send_files=Config.TELEGRAM_SEND_FILES,
+                progress_min_size=Config.TELEGRAM_PROGRESS_MIN_SIZE,
+                split_uploads=Config.TELEGRAM_SPLIT_UPLOADS,
+                part_size=Config.TELEGRAM_PART_SIZE,
+                upload_concurrency=Config.TELEGRAM_UPLOAD_CONCURRENCY,
+                algorithm=Config.DIGEST_ALGORITHM
+            )
+            self.events.add_listener(self.notifications.on_event)
+        self.pipeline = None
+        if Config.PIPELINE_STAGES:
+            from app.core.pipeline import PostProcessor, load_stages
+            self.pipeline = PostProcessor(
+                load_stages(Config.PIPELINE_STAGES),
+                processes=Config.PIPELINE_PROCESSES,
+                threads=Config.PIPELINE_THREADS,
+                max_pending=Config.PIPELINE_MAX_PENDING,
+                metrics=self.metrics,
+                publish=self._pipeline_event,
+                on_drain=self._pipeline_drained
+            )
         self._start_workers()
+        if Config.AUTOSCALE_WORKERS:
+            self.enable_autoscaling()
+        if Config.RESUME_ON_STARTUP:
+            self.resume_incomplete()
         main_logger.info(f"Download Manager initialized with {max_workers} workers")
 
+    def _define_metrics(self):
+        m = self.metrics
+        m.histogram('download_ttfb_seconds', 'Time from sending a request to receiving its response headers')
+        m.histogram('download_duration_seconds', 'Wall time of completed transfers')
+        m.histogram('download_throughput_bytes_per_second', 'Average speed of completed transfers', RATE_BUCKETS)
+        m.histogram('queue_wait_seconds', 'Time items spend queued before a worker picks them up')
+        m.histogram('lock_wait_seconds', 'Time spent waiting to acquire manager locks', LOCK_BUCKETS)
+        m.histogram('lock_hold_seconds', 'Time manager locks are held', LOCK_BUCKETS)
+        m.counter('download_bytes_total', 'Bytes received, by host')
+        m.counter('worker_busy_seconds_total', 'Time workers spent running transfers')
+        m.counter('worker_idle_seconds_total', 'Time workers spent waiting for work')
+        m.counter('downloads_finished_total', 'Transfers that ended, by status')
+        m.counter('download_failures_total', 'Failed transfers, by error class')
+        m.counter('download_retries_total', 'Failed downloads queued again')
+        m.counter('circuit_breaker_trips_total', 'Times a host was taken out of dispatch, by host')
+        m.counter('download_range_refetches_total', 'Byte ranges fetched again after a short or corrupt body')
+        m.histogram('pipeline_stage_seconds', 'Run time of post-processing stages, by stage')
+        m.counter('pipeline_stage_failures_total', 'Post-processing stages that raised, by stage')
+
+    @property
+    def bytes_downloaded(self) -> int:
+        """Bytes received by all transfers so far"""
+        return int(self.metrics.total('download_bytes_total'))
+
     def _start_workers(self):
-        """Start worker threads"""
-        for _ in range(self.max_workers):
-            worker = threading.Thread(target=self._worker_thread, daemon=True)
-            worker.start()
-            self.workers.append(worker)
+        """Start worker threads until the pool reaches max_workers"""
+        with self._wakeup:
+            while len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self._worker_thread, daemon=True)
+                self.workers.append(worker)
+                worker.start()
 
     def _worker_thread(self):
         """Worker thread for processing downloads"""
         while True:
-            if self.paused:
-                continue
+            idle = time.perf_counter()
+            item = self._next_item()
+            busy = time.perf_counter()
+            self.metrics.inc('worker_idle_seconds_total', busy - idle)
+            if item is None:
+                return
+            self.metrics.observe('queue_wait_seconds', time.monotonic() - item.queued_at)
+            with self._stats_lock:
+                self.busy_workers += 1
             try:
-                priority, item = self.download_queue.get(timeout=1)
                 self._process_download(item)
-            except queue.Empty:
-                continue
             except Exception as e:
                 main_logger.error(f"Worker thread error: {str(e)}")
+            finally:
+                self._finish_item(item)
+                with self._stats_lock:
+                    self.busy_workers -= 1
+                self.metrics.inc('worker_busy_seconds_total', time.perf_counter() - busy)
+
+    def _next_item(self) -> Optional[DownloadItem]:
+        """Block until a download is available; None tells the worker to exit"""
+        with self._wakeup:
+            while True:
+                if len(self.workers) > self.max_workers:
+                    self.workers.remove(threading.current_thread())
+                    return None
+                item = self._take_item()
+                if item is not None:
+                    return item
+                self._wakeup.wait()
+
+    def _take_item(self) -> Optional[DownloadItem]:
+        """Pop the next runnable item without blocking; caller holds self._wakeup"""
+        if self.paused or (self.pipeline is not None and self.pipeline.saturated):
+            return None
+        while True:
+            item = self.download_queue.pop()
+            if item is None or not self.breakers.unavailable:
+                return item
+            if self.breakers.allow(item.host, item.url):
+                return item
+            # The host is down: park the item instead of tying up a worker on it
+            self.download_queue.done(item.url)
+            self.waiting_downloads[item.url] = item
+            self._deferred.setdefault(item.host, {})[item.url] = item
+            self._set_status(item, "deferred")
+
+    def _requeue(self, item: DownloadItem):
+        """Put a waiting item back on the queue; caller holds self._wakeup"""
+        item.next_attempt = None
+        item.queued_at = time.monotonic()
+        self.download_queue.push(item.id, item.url, item.priority, item)
+        self._set_status(item, "queued")
+        self._notify_workers()
+
+    def _withdraw(self, item: DownloadItem) -> bool:
+        """Take a queued or waiting item off dispatch; caller holds self._wakeup"""
+        if self.download_queue.remove(item.id):
+            return True
+        if self.waiting_downloads.pop(item.url, None) is None:
+            return False
+        item.next_attempt = None
+        deferred = self._deferred.get(item.host)
+        if deferred is not None:
+            deferred.pop(item.url, None)
+        return True
+
+    def _retry_due(self, item: DownloadItem):
+        """Scheduler callback: a retry's backoff has elapsed"""
+        with self._wakeup:
+            # Paused, cancelled or retried by hand in the meantime, or a
+            # timer left over from an earlier failure of the same item
+            if self.waiting_downloads.get(item.url) is not item or item.status != 'retrying':
+                return
+            if item.next_attempt - time.time() > 0.5:
+                return
+            del self.waiting_downloads[item.url]
+            self.metrics.inc('download_retries_total')
+            self._requeue(item)
+
+    def _probe_host(self, host: str):
+        """Scheduler callback: a host's open period is over, send one deferred item as the probe"""
+        with self._wakeup:
+            if not self.breakers.half_open(host):
+                return
+            main_logger.info(f"Probing {host} again")
+            self._release_deferred(host, probe=True)
+
+    def _release_deferred(self, host: str, probe: bool = False):
+        """Queue a host's deferred items again, only the most urgent one for a probe; caller holds self._wakeup"""
+        deferred = self._deferred.get(host)
+        if not deferred:
+            self._deferred.pop(host, None)
+            return
+        items = [min(deferred.values(), key=lambda i: i.priority)] if probe else list(deferred.values())
+        for item in items:
+            del deferred[item.url]
+            del self.waiting_downloads[item.url]
+            self._requeue(item)
+        if not deferred:
+            del self._deferred[host]
+        if len(items) > 1:
+            self._notify_workers(all=True)
+
+    def _host_succeeded(self, host: str):
+        """The host answered: reset its failure count and reopen it to dispatch"""
+        if host not in self.breakers:
+            return
+        with self._wakeup:
+            if self.breakers.record_success(host):
+                main_logger.info(f"{host} is reachable again, resuming its downloads")
+                self._release_deferred(host)
+
+    def _host_failed(self, host: str, retry_after: Optional[float]):
+        """Count a transient failure against the host; caller holds self._wakeup"""
+        timeout = self.breakers.record_failure(host, retry_after)
+        if timeout is not None:
+            self.metrics.inc('circuit_breaker_trips_total', labels=(('host', host),))
+            self.scheduler.call_later(timeout, self._probe_host, host)
+            main_logger.warning(f"{host} keeps failing, holding its downloads for {timeout:.0f}s")
+
+    def _finish_item(self, item: DownloadItem):
+        """After a transfer ends: free its host connection and settle an unresolved probe"""
+        with self._wakeup:
+            self.download_queue.done(item.url)
+            if len(self.download_queue):
+                self._notify_workers()
+        # A per-download limit holds across retries and is dropped once the item is done
+        if item.status in FINISHED_STATUSES:
+            self.rate_limiter.set_item_limit(item.url, 0)
+        self._release_probe(item)
+
+    def _release_probe(self, item: DownloadItem):
+        """After a transfer ends: a probe that reached no verdict hands over to another item"""
+        if item.url not in self.breakers.probes:
+            return
+        with self._wakeup:
+            if self.breakers.release(item.host, item.url):
+                self._release_deferred(item.host, probe=True)
+
+    def _pipeline_event(self, job: dict):
+        """Publish a post-processing update; validators follow a file that stages moved or replaced"""
+        if job['finished'] is not None and job['path'] != job['source'] and self.store is not None:
+            try:
+                self.store.move_validator(job['url'], job['source'], job['path'],
+                                          os.path.getsize(job['path']), os.path.isfile(job['path']))
+            except OSError:
+                pass
+        self.events.publish('pipeline', job)
+
+    def _pipeline_drained(self):
+        """The post-processing backlog fell below its limit: transfers may start again"""
+        with self._wakeup:
+            self._notify_workers(all=True)
+
+    def _notify_workers(self, all: bool = False):
+        """Wake waiting workers after a state change; caller holds self._wakeup"""
+        if all:
+            self._wakeup.notify_all()
+        else:
+            self._wakeup.notify()
+
+    def _checkpoint(self, item: DownloadItem):
+        """Called between chunks: wait while paused, abort when cancelled"""
+        if self.paused or item.paused:
+            with self._wakeup:
+                if (self.paused or item.paused) and not item.cancelled:
+                    self._set_status(item, "paused")
+                while (self.paused or item.paused) and not item.cancelled:
+                    self._wakeup.wait()
+            if not item.cancelled:
+                self._set_status(item, "downloading")
+        if item.cancelled:
+            raise DownloadCancelled(f"Download cancelled: {item.url}")
+
+    def describe_item(self, item: DownloadItem) -> dict:
+        """Public view of an item, as sent to the API and event streams"""
+        return {
+            'id': item.id,
+            'url': item.url,
+            'caption': item.caption,
+            'priority': item.priority,
+            'status': item.status,
+            'progress': item.progress,
+            'error': item.error,
+            'started': _isoformat(item.start_time),
+            'finished': _isoformat(item.end_time),
+            'expected_digest': item.expected_digest,
+            'expected_size': item.expected_size,
+            'digest': item.digest,
+            'filename': item.filename,
+            'attempts': item.attempts,
+            'next_attempt': _isoformat(item.next_attempt)
+        }
+
+    def _set_status(self, item: DownloadItem, status: str):
+        """Change an item's status and publish the transition"""
+        item.status = status
+        if status in FINISHED_STATUSES:
+            self.metrics.inc('downloads_finished_total', labels=(('status', status),))
+            self.history.add(item)
+        self.events.publish('state', self.describe_item(item))
+        if status == 'completed' and self.pipeline is not None and item.filename:
+            self.pipeline.submit(item.id, item.url, item.filename)
+
+    def _set_progress(self, item: DownloadItem, progress: float):
+        """Update progress; subscribers receive merged, rate-limited ticks"""
+        item.progress = progress
+        if self.events.has_subscribers:
+            self.events.progress(item.id, {'id': item.id, 'url': item.url, 'progress': progress})
+
+    def _report_written(self, item: DownloadItem, journal: TransferJournal, written: int):
+        """Hand the finished prefix of a transfer to the notifier, which may upload it early"""
+        if self.notifications is not None and journal.total_size:
+            self.notifications.on_written(item.id, item.filename, journal.part_path, written, journal.total_size)
+
+    def _persist(self, event_type: str, data: dict):
+        """Event listener that mirrors state changes into the store"""
+        if event_type == 'state':
+            self.store.record(data)
+        elif event_type == 'removed':
+            self.store.delete(data['id'])
+
+    def restore_from_store(self) -> int:
+        """Rebuild the queue, paused and failed downloads from the store"""
+        entries = []
+        for row in self.store.load(PENDING_STATUSES):
+            item = self._item_from_row(row)
+            if row['status'] == 'paused':
+                item.paused = True
+                self.paused_downloads[item.url] = item
+            elif self.download_queue.get_by_url(item.url) is None:
+                # Transfers interrupted mid-flight go back to the queue
+                item.status = 'queued'
+                entries.append((item.id, item.url, item.priority, item))
+        self.download_queue.push_many(entries)
+        # Only the newest failures come back into memory, the rest are read on demand
+        failed = self.store.history('failed', limit=self.history.size)
+        self.history.restore([self._item_from_row(row) for row in reversed(failed)],
+                             {'failed': self.store.count_by_status().get('failed', 0) - len(failed)})
+        restored = len(entries) + len(self.paused_downloads)
+        if restored:
+            main_logger.info(f"Restored {restored} pending downloads from the store")
+        return restored
+
+    @staticmethod
+    def _item_from_row(row: dict) -> DownloadItem:
+        return DownloadItem(
+            url=row['url'],
+            caption=row['caption'] or "",
+            priority=row['priority'],
+            status=row['status'],
+            progress=row['progress'],
+            error=row['error'],
+            start_time=_timestamp(row['started']),
+            end_time=_timestamp(row['finished']),
+            expected_digest=row['expected_digest'],
+            expected_size=row['expected_size'],
+            digest=row['digest'],
+            filename=row['filename'],
+            attempts=row['attempts'] or 0,
+            id=row['id']
+        )
+
+    def _after_chunk(self, item: DownloadItem, host: Optional[str], nbytes: int):
+        """Account for, throttle and check control state after each chunk"""
+        self.metrics.inc('download_bytes_total', nbytes, (('host', host),))
+        self.rate_limiter.throttle(nbytes, host, item.url)
+        self._checkpoint(item)
 
     def _process_download(self, item: DownloadItem):
         """Process a single download"""
+        if self._serve_from_cache(item):
+            return
+        journal = None
+        hasher = None
         try:
-            item.start_time = datetime.now()
-            item.status = "downloading"
-            self.active_downloads[item.url] = item
+            validator = self._load_validator(item)
+            filename, journal = self._begin_transfer(item, validator)
 
-            response = requests.get(item.url, stream=True)
+            started = time.perf_counter()
+            response = self.http.get(
+                item.url, stream=True,
+                headers=self._request_headers(journal, validator)
+            )
+            self.metrics.observe('download_ttfb_seconds', time.perf_counter() - started)
+            if response.status_code == 304:
+                response.close()
+                if self._skip_unchanged(item, validator):
+                    return
+                # The cached copy was evicted since it was checked: fetch the file after all
+                response = self.http.get(item.url, stream=True)
             response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
 
-            filename = os.path.join('temp_downloads', os.path.basename(item.url))
-            os.makedirs('temp_downloads', exist_ok=True)
+            journal, resumed = self._resolve_journal(item, journal, filename, response, response.status_code)
+            hasher = self._start_hasher(item, journal)
+            resume_offset = journal.offset if resumed and len(journal.segments) == 1 else 0
 
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        if total_size:
-                            item.progress = (downloaded_size / total_size) * 100
+            if (resumed and len(journal.segments) > 1) or \
+                    (not resumed and self._should_segment(response, journal.total_size)):
+                response.close()
+                self._download_segmented(item, journal, resumed, hasher)
+            else:
+                self._download_single(item, response, journal, resumed, hasher)
 
-            item.status = "completed"
-            item.end_time = datetime.now()
-            del self.active_downloads[item.url]
+            self._verify_transfer(item, journal, hasher, resume_offset)
+            self._complete_transfer(item, journal, filename)
 
+        except DownloadCancelled:
+            self._cancel_transfer(item, journal)
+        except IntegrityError as e:
+            # Known-bad data must not be resumed from
+            self._discard_part(journal)
+            self._fail_transfer(item, None, e)
         except Exception as e:
-            item.status = "failed"
-            item.error = str(e)
-            self.failed_downloads.append(item)
-            if item.url in self.active_downloads:
-                del self.active_downloads[item.url]
-            main_logger.error(f"Download failed for {item.url}: {str(e)}")
-
-    def add_download(self, url: str, caption: str = "", priority: int = 5):
-        """Add a new download to the queue"""
-        item = DownloadItem(url=url, caption=caption, priority=priority)
-        self.download_queue.put((priority, item))
+            self._fail_transfer(item, journal, e)
+        finally:
+            if hasher is not None:
+                hasher.cancel()
+
+    def _serve_from_cache(self, item: DownloadItem) -> bool:
+        """Complete an item with an expected digest from the content cache, without any network I/O.
+
+        A URL alone says nothing about what the server holds now, so those
+        items are revalidated with a conditional request instead.
+        """
+        if self.cache is None or not item.expected_digest:
+            return False
+        found = self.cache.lookup(item.expected_digest)
+        if found is None:
+            return False
+        digest, size = found
+        if item.expected_size is not None and size != item.expected_size:
+            return False
+        os.makedirs(Config.DOWNLOAD_DIR, exist_ok=True)
+        blob = self.cache.blob_path(digest)
+        filename = self._claim_path(item, blob)
+        try:
+            if not self.cache.materialize(digest, filename):
+                return False
+        finally:
+            self._release_path(filename)
+        item.digest = digest
+        item.progress = 100
+        item.start_time = item.end_time = time.time()
+        self._set_status(item, "completed")
+        main_logger.info(f"Served {item.url} from cache ({digest})")
+        return True
+
+    def _claim_path(self, item: DownloadItem, content: Optional[str] = None) -> str:
+        """Pick the item's download path and reserve it while the transfer runs.
+
+        The URL's basename is used unless another URL holds it: an active
+        transfer, a finished file or another URL's journal. Then a short hash
+        of the URL is appended, so names stay stable for the same URL. An
+        existing file that is already a link to `content` is not a conflict.
+        """
+        with self.lock:
+            path = item.filename
+            if path is None:
+                name = os.path.basename(urlparse(item.url).path) or 'download'
+                path = os.path.join(Config.DOWNLOAD_DIR, name)
+                stem, ext = os.path.splitext(name)
+                url_hash = hashlib.sha1(item.url.encode()).hexdigest()[:8]
+                alternate = os.path.join(Config.DOWNLOAD_DIR, f"{stem}-{url_hash}{ext}")
+                if os.path.exists(alternate + '.part') or self._path_taken(path, item.url, content):
+                    path = alternate
+            item.filename = path
+            self._claimed_paths[path] = item.url
+            return path
+
+    def _path_taken(self, path: str, url: str, content: Optional[str] = None) -> bool:
+        owner = self._claimed_paths.get(path)
+        if owner is not None:
+            return owner != url
+        if os.path.exists(path):
+            return not (content and os.path.exists(content) and os.path.samefile(path, content))
+        journal = TransferJournal.load(path + '.part')
+        return journal is not None and journal.url != url
+
+    def _release_path(self, path: Optional[str]):
+        with self.lock:
+            self._claimed_paths.pop(path, None)
+
+    def _load_validator(self, item: DownloadItem) -> Optional[dict]:
+        """Stored validators for the item's URL, if the file they describe is intact or cached"""
+        if self.store is None:
+            return None
+        validator = self.store.get_validator(item.url)
+        if validator is None or not (validator['etag'] or validator['last_modified']):
+            return None
+        if not self._file_intact(validator) and self._cached_copy(validator) is None:
+            return None
+        if item.expected_digest and validator['digest'] != item.expected_digest:
+            return None
+        return validator
+
+    @staticmethod
+    def _file_intact(validator: dict) -> bool:
+        try:
+            return os.path.getsize(validator['path']) == validator['size']
+        except OSError:
+            return False
+
+    def _cached_copy(self, validator: dict) -> Optional[str]:
+        """Digest of a cached blob holding the content a validator describes"""
+        if self.cache is None or not validator['digest']:
+            return None
+        found = self.cache.lookup(validator['digest'])
+        if found is None or found[1] != validator['size']:
+            return None
+        return found[0]
+
+    @staticmethod
+    def _request_headers(journal: Optional[TransferJournal], validator: Optional[dict]) -> Optional[dict]:
+        """Range headers to resume a partial file, or conditional headers to revalidate a finished one"""
+        if journal is not None:
+            return journal.resume_headers()
+        if validator is None:
+            return None
+        headers = {}
+        if validator['etag']:
+            headers['If-None-Match'] = validator['etag']
+        if validator['last_modified']:
+            headers['If-Modified-Since'] = validator['last_modified']
+        return headers
+
+    def _skip_unchanged(self, item: DownloadItem, validator: dict) -> bool:
+        """Complete an item whose server answered 304, keeping the existing file.
+
+        The file is the one the validators describe, which post-processing
+        may have moved. If it was removed or changed since, the cached copy
+        of the unchanged content is linked in its place; False if that has
+        gone too.
+        """
+        if not self._file_intact(validator):
+            digest = self._cached_copy(validator)
+            if digest is None or not self.cache.materialize(digest, validator['path']):
+                return False
+        self._release_path(item.filename)
+        item.filename = validator['path']
+        item.digest = validator['digest']
+        item.progress = 100
+        item.end_time = time.time()
+        self.active_downloads.pop(item.url, None)
+        with self._stats_lock:
+            self.skipped_unchanged += 1
+        self.store.record_validator(dict(validator, checked=time.time()))
+        self._host_succeeded(item.host)
+        self._set_status(item, "skipped_unchanged")
+        main_logger.info(f"Not modified, keeping {item.filename}: {item.url}")
+        return True
+
+    def _record_validator(self, item: DownloadItem, journal: TransferJournal, filename: str):
+        """Remember a finished file's validators for conditional re-fetches"""
+        if self.store is None or not (journal.etag or journal.last_modified):
+            return
+        self.store.record_validator({
+            'url': item.url,
+            'etag': journal.etag,
+            'last_modified': journal.last_modified,
+            'size': os.path.getsize(filename),
+            'path': filename,
+            'digest': item.digest,
+            'checked': time.time()
+        })
+
+    def _start_hasher(self, item: DownloadItem, journal: TransferJournal) -> Optional[StreamHasher]:
+        """Start hashing the part file alongside the transfer, if a digest is wanted"""
+        if item.expected_digest:
+            algorithm = parse_digest(item.expected_digest)[0]
+        elif Config.HASH_DOWNLOADS:
+            algorithm = Config.DIGEST_ALGORITHM
+        else:
+            return None
+        return StreamHasher(journal.part_path, algorithm)
+
+    def _verify_transfer(self, item: DownloadItem, journal: TransferJournal,
+                         hasher: Optional[StreamHasher], resume_offset: int = 0):
+        """Check the finished part file against the item's expected size and digest.
+
+        If the digest is wrong and the transfer continued bytes left by an
+        earlier attempt, those bytes are the suspect range: they are fetched
+        again and the file rehashed once before the item is failed.
+        """
+        size = os.path.getsize(journal.part_path)
+        if item.expected_size is not None and size != item.expected_size:
+            raise IntegrityError(
+                f"Size mismatch for {item.url}: expected {item.expected_size} bytes, got {size}"
+            )
+        if hasher is None:
+            return
+        digest = hasher.finish(size)
+        if item.expected_digest:
+            algorithm, expected = parse_digest(item.expected_digest)
+            if digest != expected and resume_offset:
+                main_logger.warning(
+                    f"Digest mismatch for {item.url}, refetching the first {resume_offset} bytes "
+                    f"kept from an earlier attempt"
+                )
+                self._fetch_range(item, journal, 0, resume_offset)
+                digest = StreamHasher(journal.part_path, algorithm).finish(size)
+            if digest != expected:
+                raise IntegrityError(
+                    f"Digest mismatch for {item.url}: expected {algorithm}:{expected}, "
+                    f"got {algorithm}:{digest}"
+                )
+        item.digest = format_digest(hasher.algorithm, digest)
+        main_logger.info(f"Verified {item.url}: {item.digest}")
+
+    def _fetch_range(self, item: DownloadItem, journal: TransferJournal, start: int, end: int) -> int:
+        """Fetch bytes [start, end) of an item into its part file and return the count"""
+        headers = {'Range': f'bytes={start}-{end - 1}'}
+        if journal.validator:
+            headers['If-Range'] = journal.validator
+        host = item.host
+        self.metrics.inc('download_range_refetches_total')
+        written = 0
+        with self.http.get(item.url, stream=True, headers=headers) as response:
+            if response.status_code != 206:
+                raise IOError(
+                    f"Server did not honour range {headers['Range']} for {item.url} "
+                    f"(HTTP {response.status_code})"
+                )
+            reader = ResponseReader(response)
+            buffer = get_buffer(Config.DOWNLOAD_MAX_CHUNK_SIZE)
+            with open(journal.part_path, 'r+b', buffering=0) as f:
+                f.seek(start)
+                while start + written < end:
+                    n = reader.readinto(buffer[:min(len(buffer), end - start - written)])
+                    if not n:
+                        break
+                    write_all(f, buffer[:n])
+                    written += n
+                    self._after_chunk(item, host, n)
+        if start + written < end:
+            raise TruncatedTransfer(f"Range {headers['Range']} for {item.url} ended after {written} bytes")
+        return written
+
+    def _begin_transfer(self, item: DownloadItem,
+                        validator: Optional[dict] = None) -> Tuple[str, Optional[TransferJournal]]:
+        """Mark an item active and load any resumable journal for it.
+
+        The file a validator describes does not count as a conflict for the
+        download path, so a re-fetch replaces the URL's own earlier download.
+        """
+        item.start_time = time.time()
+        item.attempts += 1
+        self.active_downloads[item.url] = item
+        self._set_status(item, "downloading")
+
+        os.makedirs(Config.DOWNLOAD_DIR, exist_ok=True)
+        filename = self._claim_path(item, validator['path'] if validator else None)
+
+        journal = TransferJournal.load(filename + '.part')
+        if journal and (journal.url != item.url or not journal.is_resumable()):
+            journal.delete()
+            journal = None
+        return filename, journal
+
+    def _resolve_journal(self, item: DownloadItem, journal: Optional[TransferJournal],
+                         filename: str, response, status: int) -> Tuple[TransferJournal, bool]:
+        """Keep the journal if the server honoured If-Range, otherwise start a new one"""
+        resumed = journal is not None and status == 206
+        if resumed:
+            main_logger.info(f"Resuming {item.url} at {journal.downloaded} of {journal.total_size} bytes")
+            return journal, True
+        if journal:
+            main_logger.info(f"Validator changed for {item.url}, refetching from the start")
+        journal = TransferJournal.from_response(
+            filename + '.part', item.url, response, item.caption, item.priority
+        )
+        return journal, False
+
+    def _complete_transfer(self, item: DownloadItem, journal: TransferJournal, filename: str):
+        """Move the finished part file into place and mark the item completed"""
+        os.replace(journal.part_path, filename)
+        journal.delete()
+        self._release_path(filename)
+        self._record_validator(item, journal, filename)
+
+        if self.cache is not None and item.digest:
+            try:
+                self.cache.insert(filename, item.digest)
+            except OSError as e:
+                main_logger.warning(f"Could not add {item.url} to the download cache: {str(e)}")
+
+        item.end_time = time.time()
+        self._observe_completed(item, os.path.getsize(filename))
+        self.active_downloads.pop(item.url, None)
+        self._host_succeeded(item.host)
+        self._set_status(item, "completed")
+
+    def _observe_completed(self, item: DownloadItem, size: int):
+        if item.start_time is None:
+            return
+        duration = item.end_time - item.start_time
+        self.metrics.observe('download_duration_seconds', duration)
+        if duration > 0:
+            self.metrics.observe('download_throughput_bytes_per_second', size / duration)
+
+    def _cancel_transfer(self, item: DownloadItem, journal: Optional[TransferJournal]):
+        """Discard partial data for a cancelled item"""
+        item.end_time = time.time()
+        self.active_downloads.pop(item.url, None)
+        self._set_status(item, "cancelled")
+        self._discard_part(journal)
+        self._release_path(item.filename)
+        main_logger.info(f"Download cancelled: {item.url}")
+
+    @staticmethod
+    def _discard_part(journal: Optional[TransferJournal]):
+        """Delete a transfer's journal and partial data"""
+        if journal is not None:
+            journal.delete()
+            if os.path.exists(journal.part_path):
+                os.remove(journal.part_path)
+
+    def _fail_transfer(self, item: DownloadItem, journal: Optional[TransferJournal], error: Exception):
+        """Record a failure, keeping the journal so a retry can resume"""
+        if journal is not None and journal.validator:
+            journal.save()
+        item.error = str(error)
+        item.end_time = time.time()
+        self._release_path(item.filename)
+        retryable, retry_after = self.retry_policy.classify(error)
+        self._settle_failure(item, type(error).__name__, retryable, retry_after)
+
+    def _settle_failure(self, item: DownloadItem, error_class: str, retryable: bool,
+                        retry_after: Optional[float]):
+        """Schedule a retry of a failed transfer or mark it failed; item.error holds the message.
+
+        Transient errors count against the host's circuit breaker and, while
+        the item has attempts left, schedule a retry after a backoff; the
+        item waits off the queue, not in a worker. Anything else is final
+        until retried by hand.
+        """
+        self.metrics.inc('download_failures_total', labels=(('error', error_class),))
+        if not retryable:
+            self._host_succeeded(item.host)
+        with self._wakeup:
+            self.active_downloads.pop(item.url, None)
+            if retryable:
+                self._host_failed(item.host, retry_after)
+            if retryable and not item.cancelled and self.retry_policy.should_retry(item.attempts):
+                delay = self.retry_policy.delay(item.attempts, retry_after)
+                item.next_attempt = time.time() + delay
+                self.waiting_downloads[item.url] = item
+                self.scheduler.call_later(delay, self._retry_due, item)
+                self._set_status(item, "retrying")
+                main_logger.warning(
+                    f"Download attempt {item.attempts} failed for {item.url}: {item.error}; "
+                    f"retrying in {delay:.1f}s"
+                )
+                return
+            self._set_status(item, "failed")
+        main_logger.error(f"Download failed for {item.url}: {item.error}")
+
+    def _should_segment(self, response: requests.Response, total_size: int) -> bool:
+        """Decide whether a response is worth fetching as parallel ranges"""
+        return (
+            Config.SEGMENTED_DOWNLOADS
+            and Config.SEGMENT_COUNT > 1
+            and total_size >= 2 * Config.SEGMENT_MIN_SIZE
+            and supports_ranges(response)
+        )
+
+    def _download_single(self, item: DownloadItem, response: requests.Response,
+                         journal: TransferJournal, resumed: bool,
+                         hasher: Optional[StreamHasher] = None):
+        """Stream a response body to disk over one connection"""
+        total_size = journal.total_size
+        host = item.host
+        downloaded_size = journal.offset if resumed else 0
+        segment = [0, downloaded_size, total_size]
+        journal.segments = [segment]
+
+        reader = ResponseReader(response)
+        chunks = AdaptiveChunkSize(Config.DOWNLOAD_CHUNK_SIZE, Config.DOWNLOAD_MAX_CHUNK_SIZE)
+        buffer = get_buffer(chunks.maximum)
+        progress = ProgressThrottle(Config.PROGRESS_INTERVAL)
+
+        with response, open(journal.part_path, 'r+b' if resumed else 'wb', buffering=0) as f:
+            f.seek(downloaded_size)
+            f.truncate()
+            preallocate(f, total_size)
+            size = chunks.size
+            while True:
+                n = reader.readinto(buffer[:size])
+                if not n:
+                    break
+                write_all(f, buffer[:n])
+                downloaded_size += n
+                segment[1] = downloaded_size
+                if hasher is not None:
+                    hasher.advance(downloaded_size)
+                if total_size and progress.due():
+                    self._set_progress(item, (downloaded_size / total_size) * 100)
+                    self._report_written(item, journal, downloaded_size)
+                if journal.validator and journal.flush_due():
+                    journal.save()
+                self._after_chunk(item, host, n)
+                size = chunks.next()
+            segment[1] = downloaded_size
+
+        if total_size and downloaded_size < total_size and journal.validator and supports_ranges(response):
+            main_logger.warning(
+                f"Connection closed after {downloaded_size} of {total_size} bytes for {item.url}, "
+                f"fetching the rest"
+            )
+            downloaded_size += self._fetch_range(item, journal, downloaded_size, total_size)
+            segment[1] = downloaded_size
+        if total_size and downloaded_size != total_size:
+            raise TruncatedTransfer(f"Connection closed after {downloaded_size} of {total_size} bytes")
+        if total_size:
+            self._set_progress(item, 100)
+
+    def _download_segmented(self, item: DownloadItem, journal: TransferJournal, resumed: bool,
+                            hasher: Optional[StreamHasher] = None):
+        """Fetch a file as parallel byte ranges"""
+        total_size = journal.total_size
+        host = item.host
+        download = None
+
+        def on_progress(downloaded: int):
+            if progress.due():
+                self._set_progress(item, (downloaded / total_size) * 100)
+                if hasher is not None or self.notifications is not None:
+                    prefix = contiguous_prefix(download.segment_map())
+                    if hasher is not None:
+                        hasher.advance(prefix)
+                    self._report_written(item, journal, prefix)
+            if journal.flush_due():
+                journal.segments = download.segment_map()
+                journal.save(force=False)
+
+        def on_chunk(nbytes: int):
+            self._after_chunk(item, host, nbytes)
+
+        progress = ProgressThrottle(Config.PROGRESS_INTERVAL)
+
+        # Extra segments count against the host's connection cap
+        extra = self.download_queue.acquire(host, Config.SEGMENT_COUNT - 1)
+        main_logger.info(f"Downloading {item.url} over {1 + extra} connections")
+        download = SegmentedDownload(
+            item.url, journal.part_path, total_size,
+            segments=1 + extra,
+            connections=1 + extra,
+            min_split=Config.SEGMENT_MIN_SIZE,
+            chunk_size=Config.DOWNLOAD_CHUNK_SIZE,
+            max_chunk_size=Config.DOWNLOAD_MAX_CHUNK_SIZE,
+            on_progress=on_progress,
+            resume=journal.segments if resumed else None,
+            on_chunk=on_chunk,
+            session=self.http
+        )
+        try:
+            download.run()
+        finally:
+            journal.segments = download.segment_map()
+            self.download_queue.release(host, extra)
+        self._set_progress(item, 100)
+
+    def resume_incomplete(self) -> int:
+        """Re-queue transfers left behind in the download directory by a previous run"""
+        # Failed downloads keep their journal and stay failed until retried
+        journals = [journal for journal in find_journals(Config.DOWNLOAD_DIR)
+                    if self.history.get(journal.url, 'failed') is None]
+        for journal in journals:
+            self.add_download(journal.url, journal.caption, journal.priority)
+        if journals:
+            main_logger.info(f"Re-queued {len(journals)} incomplete downloads")
+        return len(journals)
+
+    def add_download(self, url: str, caption: str = "", priority: int = 5,
+                     expected_digest: Optional[str] = None, expected_size: Optional[int] = None):
+        """Add a new download to the queue, optionally with a digest and size to verify"""
+        if expected_digest:
+            expected_digest = format_digest(*parse_digest(expected_digest))
+        item = DownloadItem(url=url, caption=caption, priority=priority,
+                            expected_digest=expected_digest or None, expected_size=expected_size)
+        # A cached copy of the expected digest completes here, without taking a queue entry or a worker
+        if self.download_queue.key_for_url(url) is None and self._serve_from_cache(item):
+            return
+        with self._wakeup:
+            if url in self.waiting_downloads:
+                return
+            queued = self.download_queue.get_by_url(url)
+            if queued is not None:
+                # Already queued: keep one entry, at the more urgent priority
+                if priority < queued.priority:
+                    queued.priority = priority
+                    self.download_queue.reprioritize(queued.id, priority)
+                    self.events.publish('state', self.describe_item(queued))
+                return
+            self.download_queue.push(item.id, url, priority, item)
+            self._notify_workers()
+        self.events.publish('state', self.describe_item(item))
         main_logger.info(f"Added download: {url} with priority {priority}")
 
+    def import_downloads(self, rows: Iterable[ImportRow], batch_size: Optional[int] = None,
+                         refresh: bool = False) -> dict:
+        """Enqueue parsed import rows in batches, skipping URLs already known.
+
+        `rows` is consumed lazily, so an import never holds more than one
+        batch in memory. URLs that are queued, paused, active or already
+        completed count as deduped; None rows (failed validation) as rejected.
+        With `refresh`, completed URLs are queued again so they are
+        revalidated with conditional requests.
+        """
+        batch_size = batch_size or Config.IMPORT_BATCH_SIZE
+        counts = {'accepted': 0, 'deduped': 0, 'rejected': 0}
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            valid = {}
+            for row in batch:
+                if row is None:
+                    counts['rejected'] += 1
+                elif row[0] in valid:
+                    counts['deduped'] += 1
+                else:
+                    valid[row[0]] = row
+            completed = set()
+            if self.store and not refresh:
+                completed = self.store.find_urls(list(valid), ('completed', 'skipped_unchanged'))
+
+            items = []
+            queued_at = time.monotonic()  # one float shared by the batch
+            with self._wakeup:
+                for url, caption, priority, digest, size in valid.values():
+                    if (url in completed or url in self.active_downloads
+                            or url in self.paused_downloads or url in self.waiting_downloads
+                            or self.download_queue.key_for_url(url) is not None):
+                        counts['deduped'] += 1
+                        continue
+                    items.append(DownloadItem(url=url, caption=caption, priority=priority,
+                                              expected_digest=digest, expected_size=size, queued_at=queued_at))
+                # Bulk rows skip per-item events; dashboards pick them up from the
+                # counters. Recorded before the push so a worker's first state
+                # change always lands in the store after the queued row.
+                if self.store and items:
+                    self.store.record_many([self.describe_item(item) for item in items])
+                self.download_queue.push_many((item.id, item.url, item.priority, item) for item in items)
+                self._notify_workers(all=True)
+            counts['accepted'] += len(items)
+        main_logger.info(
+            f"Imported {counts['accepted']} downloads "
+            f"({counts['deduped']} duplicates, {counts['rejected']} rejected)"
+        )
+        return counts
+
+    def import_file(self, path: str, fmt: Optional[str] = None, refresh: bool = False) -> dict:
+        """Stream a CSV or JSONL URL list from disk into the queue"""
+        fmt = fmt or detect_format(path)
+        with open(path, encoding='utf-8', newline='') as f:
+            return self.import_downloads(iter_rows(f, fmt), refresh=refresh)
+
     def pause(self):
         """Pause all downloads"""
-        self.paused = True
+        with self._wakeup:
+            self.paused = True
         main_logger.info("Downloads paused")
 
     def resume(self):
         """Resume all downloads"""
-        self.paused = False
+        with self._wakeup:
+            self.paused = False
+            self._notify_workers(all=True)
         main_logger.info("Downloads resumed")
 
+    def is_paused(self) -> bool:
+        """Check whether all downloads are paused"""
+        return self.paused
+
+    def _find_item(self, url: str) -> Optional[DownloadItem]:
+        return (self.active_downloads.get(url)
+                or self.download_queue.get_by_url(url)
+                or self.waiting_downloads.get(url)
+                or self.paused_downloads.get(url))
+
+    def get_download(self, id_or_url: str) -> Optional[DownloadItem]:
+        """Look up a queued, waiting, paused or active item by ID or URL"""
+        item = self.download_queue.get(id_or_url) or self._find_item(id_or_url)
+        if item is None:
+            item = next((i for i in self.active_downloads.values() if i.id == id_or_url), None)
+        return item
+
+    def pause_download(self, url: str) -> bool:
+        """Pause a single queued or active download"""
+        with self._wakeup:
+            item = self._find_item(url)
+            if item is None:
+                return False
+            item.paused = True
+            if url not in self.active_downloads and self._withdraw(item):
+                self.paused_downloads[url] = item
+                self._set_status(item, "paused")
+        main_logger.info(f"Download paused: {url}")
+        return True
+
+    def resume_download(self, url: str) -> bool:
+        """Resume a single paused download"""
+        with self._wakeup:
+            item = self._find_item(url)
+            if item is None:
+                return False
+            item.paused = False
+            if self.paused_downloads.pop(url, None) is not None:
+                item.queued_at = time.monotonic()
+                self.download_queue.push(item.id, url, item.priority, item)
+                self._set_status(item, "queued")
+            self._notify_workers(all=True)
+        main_logger.info(f"Download resumed: {url}")
+        return True
+
+    def cancel_download(self, url: str) -> bool:
+        """Cancel a queued, paused or active download"""
+        with self._wakeup:
+            item = self._find_item(url)
+            if item is None:
+                return False
+            item.cancelled = True
+            if url not in self.active_downloads:
+                self._withdraw(item)
+                self.paused_downloads.pop(url, None)
+                self._set_status(item, "cancelled")
+                self.rate_limiter.set_item_limit(url, 0)
+            self._notify_workers(all=True)
+        main_logger.info(f"Download cancelled: {url}")
+        return True
+
+    def set_priority(self, url: str, priority: int) -> bool:
+        """Change the priority of a queued or paused download"""
+        with self._wakeup:
+            item = self.download_queue.get_by_url(url) or self.paused_downloads.get(url)
+            if item is None:
+                return False
+            item.priority = priority
+            self.download_queue.reprioritize(item.id, priority)
+        self.events.publish('state', self.describe_item(item))
+        main_logger.info(f"Priority for {url} set to {priority}")
+        return True
+
+    def remove_download(self, url: str) -> bool:
+        """Drop a queued, waiting or paused download entirely, including its stored record"""
+        with self._wakeup:
+            item = (self.download_queue.get_by_url(url) or self.waiting_downloads.get(url)
+                    or self.paused_downloads.get(url))
+            if item is None:
+                return False
+            item.cancelled = True
+            self._withdraw(item)
+            self.paused_downloads.pop(url, None)
+        self.rate_limiter.set_item_limit(url, 0)
+        self.events.publish('removed', self.describe_item(item))
+        main_logger.info(f"Download removed: {url}")
+        return True
+
+    def update_queue(self, entries: List[dict]) -> dict:
+        """Apply an edited queue listing, touching only the entries that changed.
+
+        Queued or paused URLs missing from `entries` are removed, new URLs are
+        added and existing ones get their caption and priority updated.
+        Active and failed downloads are left alone.
+        """
+        counts = {'added': 0, 'updated': 0, 'removed': 0}
+        wanted = {}
+        for entry in entries:
+            url = (entry.get('url') or '').strip()
+            if url:
+                wanted[url] = entry
+
+        for item in self.download_queue.snapshot() + list(self.paused_downloads.values()):
+            if item.url not in wanted and self.remove_download(item.url):
+                counts['removed'] += 1
+
+        for url, entry in wanted.items():
+            caption = entry.get('caption') or ""
+            priority = int(entry.get('priority') or 5)
+            with self._wakeup:
+                item = self.download_queue.get_by_url(url) or self.paused_downloads.get(url)
+                known = (item is not None or url in self.active_downloads or url in self.waiting_downloads
+                         or self.history.get(url, 'failed') is not None)
+                changed = item is not None and (item.caption != caption or item.priority != priority)
+                if changed:
+                    item.caption = caption
+                    if item.priority != priority:
+                        item.priority = priority
+                        self.download_queue.reprioritize(item.id, priority)
+            if changed:
+                self.events.publish('state', self.describe_item(item))
+                counts['updated'] += 1
+            elif not known:
+                self.add_download(url, caption, priority)
+                counts['added'] += 1
+        return counts
+
+    def get_history(self, status: Optional[str] = None, host: Optional[str] = None,
+                    offset: int = 0, limit: int = 100) -> List[dict]:
+        """Page through stored downloads, most recently updated first"""
+        if self.store is None:
+            return self.history.page(status, host, offset, limit)
+        return self.store.history(status, host, offset, limit)
+
+    def set_max_workers(self, max_workers: int):
+        """Grow or shrink the worker pool; busy workers retire after their current download"""
+        max_workers = max(1, int(max_workers))
+        with self._wakeup:
+            self.max_workers = max_workers
+            self._notify_workers(all=True)
+        self._start_workers()
+        main_logger.info(f"Worker pool resized to {max_workers}")
+
+    def close(self):
+        """Stop background threads before exiting; transfers still running are abandoned"""
+        self.scheduler.stop()
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+        if self.notifications is not None:
+            self.notifications.close()
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if self.store is not None:
+            self.store.close()
+
+    def get_cache_stats(self) -> Optional[dict]:
+        """Get content cache size and hit counters"""
+        return self.cache.get_stats() if self.cache else None
+
+    def get_notification_stats(self) -> Optional[dict]:
+        """Get Telegram dispatch queue and flood-wait counters"""
+        return self.notifications.get_stats() if self.notifications else None
+
+    def get_pipeline_stats(self, limit: int = 100) -> Optional[dict]:
+        """Get post-processing stage totals and recent jobs"""
+        return self.pipeline.get_stats(limit) if self.pipeline is not None else None
+
+    def get_connection_stats(self) -> dict:
+        """Get connection pool hit/miss and DNS cache counters"""
+        return self.http.get_stats()
+
+    def get_worker_stats(self) -> dict:
+        """Get worker pool size and utilisation"""
+        return {
+            'engine': 'threaded',
+            'max_workers': self.max_workers,
+            'workers': len(self.workers),
+            'busy_workers': self.busy_workers,
+            'autoscale': self.autoscaler is not None
+        }
+
+    def enable_autoscaling(self, min_workers: Optional[int] = None, max_workers: Optional[int] = None):
+        """Start resizing the pool from measured throughput"""
+        if self.autoscaler is None:
+            self.autoscaler = PoolAutoscaler(
+                self,
+                min_workers=min_workers or Config.AUTOSCALE_MIN_WORKERS,
+                max_workers=max_workers or Config.AUTOSCALE_MAX_WORKERS,
+                interval=Config.AUTOSCALE_INTERVAL
+            )
+            self.autoscaler.start()
+
+    def disable_autoscaling(self):
+        """Stop resizing the pool automatically"""
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+            self.autoscaler = None
+
+    def get_counters(self) -> dict:
+        """Get the summary counters shown on the dashboard"""
+        return {
+            'queue_size': self.get_queue_size(),
+            'active_downloads': self.get_active_downloads_count(),
+            'failed_downloads': self.get_failed_downloads_count(),
+            'waiting_downloads': self.get_waiting_downloads_count(),
+            'skipped_unchanged': self.skipped_unchanged,
+            'paused': self.is_paused(),
+            'bandwidth_limit': self.get_bandwidth_limit()
+        }
+
+    def render_metrics(self) -> str:
+        """Prometheus text exposition of the engine's metrics"""
+        return self.metrics.render([
+            ('download_queue_size', 'Items waiting in the queue', self.get_queue_size()),
+            ('downloads_active', 'Transfers in progress', self.get_active_downloads_count()),
+            ('downloads_failed', 'Failed items awaiting a manual retry', self.get_failed_downloads_count()),
+            ('downloads_waiting', 'Items waiting for a scheduled retry or for their host to recover',
+             self.get_waiting_downloads_count()),
+            ('hosts_unavailable', 'Hosts whose circuit breaker is open or half-open', len(self.breakers.unavailable)),
+            ('workers', 'Size of the worker pool', self.max_workers),
+            ('workers_busy', 'Workers running a transfer', self.busy_workers),
+            ('downloads_paused', 'Whether the whole queue is paused', int(self.is_paused())),
+            ('pipeline_pending', 'Completed files waiting in or running through post-processing',
+             len(self.pipeline) if self.pipeline is not None else 0),
+        ])
+
     def get_queue_size(self) -> int:
         """Get current queue size"""
-        return self.download_queue.qsize()
+        return len(self.download_queue)
 
     def get_active_downloads_count(self) -> int:
         """Get number of active downloads"""
@@ -113,7 +1315,42 @@ class DownloadManager:
 
     def get_failed_downloads_count(self) -> int:
         """Get number of failed downloads"""
-        return len(self.failed_downloads)
+        return self.history.count('failed')
+
+    def get_waiting_downloads_count(self) -> int:
+        """Get number of downloads waiting for a retry or for their host"""
+        return len(self.waiting_downloads)
+
+    def get_waiting_downloads(self) -> List[DownloadItem]:
+        """Get downloads waiting for a retry or for their host, soonest retry first"""
+        return sorted(self.waiting_downloads.values(),
+                      key=lambda item: (item.next_attempt or float('inf'), item.priority))
+
+    def get_host_stats(self) -> Dict[str, dict]:
+        """Get queue depth, open connections, limits and breaker state per host"""
+        hosts = self.download_queue.host_stats()
+        with self._wakeup:
+            breakers = self.breakers.snapshot()
+            deferred = {host: len(items) for host, items in self._deferred.items()}
+        for host in set(breakers) | set(deferred):
+            hosts.setdefault(host, {'queued': 0, 'active': 0,
+                                    'max_connections': Config.HOST_MAX_CONNECTIONS, 'weight': 1.0})
+        for host, stats in hosts.items():
+            stats['deferred'] = deferred.get(host, 0)
+            stats['breaker'] = breakers[host]['state'] if host in breakers else 'closed'
+        return hosts
+
+    def set_host_limits(self, host: str, max_connections: Optional[int] = None, weight: Optional[float] = None):
+        """Set one host's connection cap (0 = unlimited) and/or dispatch weight"""
+        with self._wakeup:
+            self.download_queue.set_host_limits(host, max_connections, weight)
+            self._notify_workers(all=True)
+        main_logger.info(f"Limits for {host} set to max_connections={max_connections}, weight={weight}")
+
+    def get_breaker_stats(self) -> Dict[str, dict]:
+        """Get circuit breaker state of every host with recent failures"""
+        with self._wakeup:
+            return self.breakers.snapshot()
 
     def get_active_downloads(self) -> Dict[str, dict]:
         """Get active downloads status"""
@@ -121,26 +1358,91 @@ class DownloadManager:
             'progress': item.progress,
             'status': item.status,
             'caption': item.caption
-        } for url, item in self.active_downloads.items()}
+        } for url, item in list(self.active_downloads.items())}
 
-    def get_failed_downloads(self) -> List[dict]:
-        """Get failed downloads"""
+    def get_failed_downloads(self, limit: Optional[int] = None) -> List[dict]:
+        """Get failed downloads still held in memory, most recent first"""
         return [{
             'url': item.url,
             'error': item.error,
             'caption': item.caption
-        } for item in self.failed_downloads]
+        } for item in self.history.recent('failed', limit)]
+
+    def get_queued_downloads(self, offset: int = 0, limit: Optional[int] = None) -> List[DownloadItem]:
+        """Get queued items in dispatch order without disturbing the queue"""
+        snapshot = self.download_queue.snapshot()
+        end = None if limit is None else offset + limit
+        return snapshot[offset:end]
 
     def retry_failed(self, url: str):
-        """Retry a failed download"""
-        for item in self.failed_downloads[:]:
-            if item.url == url:
-                self.failed_downloads.remove(item)
-                self.add_download(item.url, item.caption, item.priority)
-                main_logger.info(f"Retrying download: {url}")
-                break
+        """Retry a failed download, or one waiting for its next attempt, now"""
+        with self._wakeup:
+            item = self.history.pop(url, 'failed')
+            if item is None:
+                item = self.waiting_downloads.get(url)
+                if item is None or item.status != 'retrying':
+                    return
+                self._withdraw(item)
+            requeue = self.download_queue.get_by_url(url) is None
+            if requeue:
+                # Requeue the same item so its stored record is updated, not duplicated
+                item.error = None
+                item.progress = 0
+                item.end_time = None
+                item.next_attempt = None
+                item.attempts = 0
+                item.queued_at = time.monotonic()
+                self.download_queue.push(item.id, url, item.priority, item)
+                self._notify_workers()
+                self.metrics.inc('download_retries_total')
+        if requeue:
+            self._set_status(item, "queued")
+        else:
+            self.events.publish('removed', self.describe_item(item))
+        main_logger.info(f"Retrying download: {url}")
 
     def set_bandwidth_limit(self, limit: int):
         """Set bandwidth limit in bytes/second"""
         self.bandwidth_limit = limit
-        main_logger.info(f"Bandwidth limit set to {limit} bytes/second") 
\ No newline at end of file
+        self.rate_limiter.set_global_limit(limit)
+        main_logger.info(f"Bandwidth limit set to {limit} bytes/second")
+
+    def get_bandwidth_limit(self) -> int:
+        """Get global bandwidth limit in bytes/second (0 means unlimited)"""
+        return self.bandwidth_limit
+
+    def set_host_bandwidth_limit(self, host: str, limit: int):
+        """Set bandwidth limit for one host in bytes/second (0 removes it)"""
+        self.rate_limiter.set_host_limit(host, limit)
+        main_logger.info(f"Bandwidth limit for {host} set to {limit} bytes/second")
+
+    def set_download_bandwidth_limit(self, url: str, limit: int):
+        """Set bandwidth limit for one download in bytes/second (0 removes it)"""
+        self.rate_limiter.set_item_limit(url, limit)
+        main_logger.info(f"Bandwidth limit for {url} set to {limit} bytes/second")
+
+    def get_bandwidth_limits(self) -> dict:
+        """Get all configured bandwidth limits"""
+        return {
+            'global': self.bandwidth_limit,
+            'hosts': self.rate_limiter.get_host_limits(),
+            'downloads': self.rate_limiter.get_item_limits()
+        } 
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def create_download_manager(engine: str = 'threaded', **kwargs) -> DownloadManager:
+    """Build the download manager for the configured engine"""
+    if engine == 'asyncio':
+        from app.core.async_engine import AsyncDownloadManager
+        return AsyncDownloadManager(**kwargs)
+    if engine == 'distributed':
+        from app.core.coordinator import CoordinatorManager
+        return CoordinatorManager(**kwargs)
+    return DownloadManager(**kwargs)
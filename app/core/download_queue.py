@@ -0,0 +1,296 @@
+import itertools
+import sys
+import threading
+import time
+from heapq import heapify, heappop, heappush
+from typing import Callable, Dict, Generic, List, Optional, TypeVar
+from urllib.parse import urlparse
+
+T = TypeVar('T')
+
+
+def url_host(url: str) -> str:
+    """Hostname of a URL, interned so every item of a host shares one string"""
+    return sys.intern(urlparse(url).hostname or '')
+
+
+# Entry layout: [rank, sequence, key, url, item, priority, host]; item is None once removed
+_RANK, _SEQ, _KEY, _URL, _ITEM, _LEVEL, _HOST = range(7)
+
+
+class _Host:
+    __slots__ = ('name', 'heap', 'queued', 'active', 'max_connections', 'weight', 'version')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.heap: List[list] = []  # this host's entries, dead ones included
+        self.queued = 0
+        self.active = 0  # connections open: one per transfer plus extra segments
+        self.max_connections: Optional[int] = None  # None: the queue's default
+        self.weight = 1.0
+        self.version = 0
+
+
+class FairQueue(Generic[T]):
+    """Per-host sub-queues with connection caps and fair dispatch across hosts.
+
+    Items are looked up by key or URL in O(1). Every host has its own sub-queue,
+    ranked by priority minus one level per `aging` seconds spent queued, so
+    old low-priority work eventually overtakes newer urgent work. `pop()`
+    serves the host whose best item ranks lowest after adding `share /
+    weight` levels for each connection the host already has open, skipping
+    hosts at their connection cap. A host with 50k queued items therefore
+    gets about its share of workers while other hosts have work of similar
+    priority, yet a clearly more urgent item still goes first.
+
+    Hosts are kept in a heap keyed that way; an entry is superseded (and
+    dropped lazily) whenever the host's best item or connection count
+    changes, so dispatch is O(log hosts). Callers report finished transfers
+    with `done()`, and extra connections (segments) with `acquire()` and
+    `release()`.
+
+    Each queued item costs one list, indexed by key and by URL, which sits
+    in its host's heap. Removal and reprioritisation mark the old entry dead
+    instead of searching the heap; dead entries are dropped lazily and a
+    host's heap is compacted when they outnumber its live ones.
+
+    `snapshot()` copies the index under the lock and sorts outside it, and
+    the sorted result is cached until the queue changes, so listing a large
+    queue does not hold up workers popping from it.
+    """
+
+    def __init__(self, max_per_host: int = 0, aging: float = 0, share: float = 1.0,
+                 host_of: Callable[[str], str] = url_host):
+        self.max_per_host = max_per_host
+        self.aging = aging
+        self.share = share
+        self.host_of = host_of
+        self._hosts: Dict[str, _Host] = {}
+        self._heap: List[tuple] = []
+        self._entries: Dict[str, list] = {}
+        self._by_url: Dict[str, list] = {}
+        self._seq = itertools.count()
+        self._epoch = time.monotonic()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot_version = -1
+        self._snapshot: List[T] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def qsize(self) -> int:
+        return len(self._entries)
+
+    def empty(self) -> bool:
+        return not self._entries
+
+    def _rank(self, priority: int, enqueued: float) -> float:
+        if not self.aging:
+            return priority
+        return priority - (enqueued - self._epoch) / self.aging
+
+    def _host(self, name: str) -> _Host:
+        host = self._hosts.get(name)
+        if host is None:
+            host = self._hosts[name] = _Host(name)
+        return host
+
+    def _cap(self, host: _Host) -> int:
+        return self.max_per_host if host.max_connections is None else host.max_connections
+
+    @staticmethod
+    def _head(host: _Host) -> Optional[list]:
+        """A host's best live entry, dropping dead ones from the top of its heap"""
+        heap = host.heap
+        while heap and heap[0][_ITEM] is None:
+            heappop(heap)
+        return heap[0] if heap else None
+
+    def _refresh(self, host: _Host):
+        """Supersede a host's heap entry after its best item or connection count changed"""
+        # Versions come from one counter so a re-created host never matches stale entries
+        host.version = next(self._seq)
+        cap = self._cap(host)
+        head = self._head(host)
+        if head is not None and (not cap or host.active < cap):
+            key = head[_RANK] + host.active * self.share / host.weight
+            heappush(self._heap, (key, next(self._seq), host.name, host.version))
+            if len(self._heap) > 64 and len(self._heap) > 4 * len(self._hosts):
+                self._heap = [entry for entry in self._heap if entry[2] in self._hosts
+                              and self._hosts[entry[2]].version == entry[3]]
+                heapify(self._heap)
+        elif head is None and not host.active and host.max_connections is None and host.weight == 1.0:
+            del self._hosts[host.name]
+
+    def _add(self, key: str, url: str, priority: int, item: T, rank: float):
+        self._remove(key)
+        host = self._host(self.host_of(url))
+        entry = [rank, next(self._seq), key, url, item, priority, host.name]
+        self._entries[key] = entry
+        self._by_url[url] = entry
+        heappush(host.heap, entry)
+        host.queued += 1
+        self._refresh(host)
+
+    def push(self, key: str, url: str, priority: int, item: T):
+        """Add an item, replacing any queued item with the same key"""
+        with self._lock:
+            self._add(key, url, priority, item, self._rank(priority, time.monotonic()))
+            self._version += 1
+
+    def push_many(self, entries):
+        """Add (key, url, priority, item) tuples under one lock acquisition"""
+        now = time.monotonic()
+        ranks = {}  # entries of a batch share their rank objects
+        with self._lock:
+            for key, url, priority, item in entries:
+                rank = ranks.get(priority)
+                if rank is None:
+                    rank = ranks[priority] = self._rank(priority, now)
+                self._add(key, url, priority, item, rank)
+            self._version += 1
+
+    def pop(self) -> Optional[T]:
+        """Take the next item from a host below its cap and count a connection for it"""
+        with self._lock:
+            while self._heap:
+                _, _, name, version = heappop(self._heap)
+                host = self._hosts.get(name)
+                if host is None or host.version != version or self._head(host) is None:
+                    continue
+                entry = heappop(host.heap)
+                host.queued -= 1
+                self._forget(entry)
+                host.active += 1
+                self._refresh(host)
+                self._version += 1
+                return entry[_ITEM]
+            return None
+
+    def done(self, url: str, connections: int = 1):
+        """A transfer popped for `url` has finished; free its connection"""
+        self.release(self.host_of(url), connections)
+
+    def acquire(self, host: str, wanted: int) -> int:
+        """Reserve up to `wanted` extra connections to a host; returns how many were granted"""
+        with self._lock:
+            entry = self._host(host)
+            cap = self._cap(entry)
+            granted = max(0, min(wanted, cap - entry.active)) if cap else max(0, wanted)
+            if granted:
+                entry.active += granted
+                self._refresh(entry)
+            return granted
+
+    def release(self, host: str, connections: int):
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None or not connections:
+                return
+            entry.active = max(0, entry.active - connections)
+            self._refresh(entry)
+
+    def set_host_limits(self, host: str, max_connections: Optional[int] = None, weight: Optional[float] = None):
+        """Override the connection cap (0 = unlimited) or dispatch weight of one host"""
+        with self._lock:
+            entry = self._host(host)
+            if max_connections is not None:
+                entry.max_connections = max_connections
+            if weight is not None:
+                entry.weight = max(weight, 0.01)
+            self._refresh(entry)
+
+    def host_stats(self) -> Dict[str, dict]:
+        """Queued items, open connections, cap and weight per known host"""
+        with self._lock:
+            return {name: {
+                'queued': host.queued,
+                'active': host.active,
+                'max_connections': self._cap(host),
+                'weight': host.weight
+            } for name, host in self._hosts.items()}
+
+    def get(self, key: str) -> Optional[T]:
+        entry = self._entries.get(key)
+        return entry[_ITEM] if entry else None
+
+    def get_by_url(self, url: str) -> Optional[T]:
+        entry = self._by_url.get(url)
+        return entry[_ITEM] if entry else None
+
+    def key_for_url(self, url: str) -> Optional[str]:
+        entry = self._by_url.get(url)
+        return entry[_KEY] if entry else None
+
+    def remove(self, key: str) -> Optional[T]:
+        """Remove an item by key and return it"""
+        with self._lock:
+            item = self._remove(key)
+            if item is not None:
+                self._version += 1
+            return item
+
+    def reprioritize(self, key: str, priority: int) -> bool:
+        """Move a queued item to a new priority; its time in the queue still counts"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            host = self._hosts[entry[_HOST]]
+            rank = entry[_RANK] - entry[_LEVEL] + priority
+            new_entry = [rank, next(self._seq), key, entry[_URL], entry[_ITEM], priority, host.name]
+            entry[_ITEM] = None
+            self._entries[key] = new_entry
+            self._by_url[new_entry[_URL]] = new_entry
+            heappush(host.heap, new_entry)
+            self._compact(host)
+            self._refresh(host)
+            self._version += 1
+            return True
+
+    def snapshot(self) -> List[T]:
+        """Queued items by aged priority across hosts; cached until the queue changes"""
+        with self._lock:
+            if self._snapshot_version == self._version:
+                return self._snapshot
+            version = self._version
+            ranked = [(entry[_RANK], entry[_SEQ], entry[_ITEM]) for entry in self._entries.values()]
+        ranked.sort(key=lambda entry: (entry[0], entry[1]))
+        snapshot = [entry[2] for entry in ranked]
+        with self._lock:
+            if version >= self._snapshot_version:
+                self._snapshot = snapshot
+                self._snapshot_version = version
+        return snapshot
+
+    def priority_of(self, key: str) -> Optional[int]:
+        entry = self._entries.get(key)
+        return entry[_LEVEL] if entry else None
+
+    def _remove(self, key: str) -> Optional[T]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        item = entry[_ITEM]
+        self._forget(entry)
+        entry[_ITEM] = None
+        host = self._hosts[entry[_HOST]]
+        host.queued -= 1
+        self._compact(host)
+        self._refresh(host)
+        return item
+
+    def _forget(self, entry: list):
+        del self._entries[entry[_KEY]]
+        if self._by_url.get(entry[_URL]) is entry:
+            del self._by_url[entry[_URL]]
+
+    @staticmethod
+    def _compact(host: _Host):
+        if len(host.heap) > 64 and len(host.heap) > 2 * host.queued:
+            host.heap = [entry for entry in host.heap if entry[_ITEM] is not None]
+            heapify(host.heap)
@@ -0,0 +1,100 @@
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from app.core.logger import main_logger
+
+
+class Subscription:
+    """Pending events for one consumer, typically one SSE stream.
+
+    Progress ticks are merged per download, so a slow reader only ever sees
+    the latest value. State transitions are kept in order and bounded; if
+    a reader falls behind by more than `max_events`, the oldest are dropped
+    and `overflowed` tells it to resynchronise from a full snapshot.
+    """
+
+    def __init__(self, max_events: int = 1000):
+        self._cond = threading.Condition()
+        self._events: Deque[Tuple[str, dict]] = deque()
+        self._progress: Dict[str, dict] = {}
+        self.max_events = max_events
+        self.overflowed = False
+
+    def push_event(self, event_type: str, data: dict):
+        with self._cond:
+            if len(self._events) >= self.max_events:
+                self._events.popleft()
+                self.overflowed = True
+            self._events.append((event_type, data))
+            self._cond.notify()
+
+    def push_progress(self, key: str, data: dict):
+        with self._cond:
+            self._progress[key] = data
+            self._cond.notify()
+
+    def drain(self, timeout: Optional[float] = None) -> Tuple[List[Tuple[str, dict]], List[dict], bool]:
+        """Wait up to `timeout` for pending data, then take all of it"""
+        with self._cond:
+            if not self._events and not self._progress:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            progress = list(self._progress.values())
+            overflowed = self.overflowed
+            self._events.clear()
+            self._progress.clear()
+            self.overflowed = False
+        return events, progress, overflowed
+
+
+class EventBus:
+    """Fan-out of download state changes to subscribers and listeners.
+
+    Subscriptions buffer events for pull-based consumers such as SSE
+    streams. Listeners are called synchronously on the publishing thread
+    for state transitions only (never for progress), so they must hand
+    work off rather than block.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: List[Subscription] = []
+        self._listeners: List[Callable[[str, dict], None]] = []
+
+    def subscribe(self, max_events: int = 1000) -> Subscription:
+        subscription = Subscription(max_events)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscription]
+
+    def add_listener(self, callback: Callable[[str, dict], None]):
+        with self._lock:
+            self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback: Callable[[str, dict], None]):
+        with self._lock:
+            self._listeners = [c for c in self._listeners if c is not callback]
+
+    def publish(self, event_type: str, data: dict):
+        """Deliver a state transition to every subscriber and listener"""
+        # The lists are replaced, never mutated, so they can be read unlocked
+        for subscription in self._subscribers:
+            subscription.push_event(event_type, data)
+        for callback in self._listeners:
+            try:
+                callback(event_type, data)
+            except Exception as e:
+                main_logger.error(f"Event listener error: {str(e)}")
+
+    def progress(self, key: str, data: dict):
+        """Record a progress tick; merged per key until a subscriber drains it"""
+        for subscription in self._subscribers:
+            subscription.push_progress(key, data)
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
@@ -0,0 +1,175 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+_buffers = threading.local()
+
+
+def get_buffer(size: int) -> memoryview:
+    """A reusable buffer of at least `size` bytes owned by the calling thread.
+
+    Workers are long-lived, so each keeps one buffer for every transfer it
+    runs instead of allocating a new bytes object per chunk.
+    """
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _buffers.buffer = memoryview(bytearray(size))
+    return buffer
+
+
+def preallocate(f, size: int):
+    """Reserve `size` bytes for a file up front, keeping existing contents.
+
+    Uses posix_fallocate where the platform and filesystem support it, so
+    the blocks are allocated contiguously, and falls back to extending the
+    file (sparse) elsewhere.
+    """
+    if size <= 0:
+        return
+    fd = f.fileno()
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    if os.fstat(fd).st_size < size:
+        os.ftruncate(fd, size)
+
+
+def write_all(f, view: memoryview):
+    """Write a whole buffer to an unbuffered file, retrying short writes"""
+    written = 0
+    while written < len(view):
+        written += f.write(view[written:])
+
+
+class ResponseReader:
+    """Read a streamed requests response body into caller-owned buffers.
+
+    For bodies without a Content-Encoding this reads from the underlying
+    http.client response, which fills the buffer directly from the socket;
+    compressed bodies go through urllib3 so they are still decoded. Once the
+    body is exhausted the connection goes back to the pool for reuse.
+    """
+
+    def __init__(self, response):
+        self.raw = response.raw
+        encoding = response.headers.get('Content-Encoding', 'identity').lower()
+        fp = getattr(self.raw, '_fp', None)
+        self._direct = fp if encoding in ('', 'identity') and hasattr(fp, 'readinto') else None
+
+    def readinto(self, view: memoryview) -> int:
+        if self._direct is None:
+            return self.raw.readinto(view)
+        n = self._direct.readinto(view)
+        if n == 0:
+            self.raw.release_conn()
+        return n
+
+
+class AdaptiveChunkSize:
+    """Chunk size that tracks throughput so each chunk takes about `target` seconds.
+
+    Doubles while chunks complete in under half the target and halves when
+    they take more than twice as long, so fast links pay the per-chunk
+    Python overhead rarely, while slow or throttled transfers still reach
+    their pause and cancel checks promptly.
+    """
+
+    def __init__(self, minimum: int, maximum: int, target: float = 0.05):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.target = target
+        self.size = minimum
+        self._started = time.monotonic()
+
+    def next(self) -> int:
+        """Adjust from the time taken since the previous call and return the new size"""
+        now = time.monotonic()
+        elapsed, self._started = now - self._started, now
+        if elapsed < self.target / 2 and self.size < self.maximum:
+            self.size = min(self.size * 2, self.maximum)
+        elif elapsed > self.target * 2 and self.size > self.minimum:
+            self.size = max(self.size // 2, self.minimum)
+        return self.size
+
+
+class ProgressThrottle:
+    """Lets at most one progress update through every `interval` seconds"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last = 0.0
+
+    def due(self) -> bool:
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
+
+    def hold(self, seconds: float):
+        """Let nothing through for the next `seconds` (and at least one interval)"""
+        self._last = time.monotonic() + max(0.0, seconds - self.interval)
+
+
+class FileSlice(io.RawIOBase):
+    """Read-only file object over `length` bytes of a descriptor, starting at `offset`.
+
+    Reads go through os.pread, so several slices of one file can be read
+    concurrently without sharing a file position, and nothing is copied to
+    disk to split a file. The slice's digest is computed as it is read front
+    to back; `hexdigest()` hashes whatever was not read that way.
+    """
+
+    def __init__(self, fd: int, offset: int, length: int, name: str, algorithm: str = 'sha256'):
+        super().__init__()
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+        self.name = name
+        self._position = 0
+        self._hash = hashlib.new(algorithm)
+        self._hashed = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, position: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self.length
+        self._position = max(0, position)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), self.length - self._position)
+        if n <= 0:
+            return 0
+        data = os.pread(self.fd, n, self.offset + self._position)
+        buffer[:len(data)] = data
+        if self._position == self._hashed:
+            self._hash.update(data)
+            self._hashed += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def hexdigest(self) -> str:
+        """Digest of the whole slice, reading any part not yet hashed"""
+        while self._hashed < self.length:
+            data = os.pread(self.fd, min(1024 * 1024, self.length - self._hashed), self.offset + self._hashed)
+            if not data:
+                raise IOError(f"{self.name} ended after {self._hashed} of {self.length} bytes")
+            self._hash.update(data)
+            self._hashed += len(data)
+        return self._hash.hexdigest()
@@ -0,0 +1,170 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Generic, List, Optional, Set, TypeVar
+from app.core.store import DownloadStore
+
+T = TypeVar('T')
+
+# Items finished again are matched against older records on disk in batches of this many URLs
+RESOLVE_BATCH = 1000
+
+
+class DownloadHistory(Generic[T]):
+    """Finished downloads by URL, only the most recent `size` kept in memory.
+
+    Items are held in the order they finished; finishing again moves a URL
+    to the newest end. Beyond `size` the oldest item is evicted and counted
+    as on disk, and `get()` and `pop()` read it back from there by URL when
+    asked for. With the persistent store every finished item is on disk
+    already, so eviction just drops it; without one, evicted items are
+    written to a spill database in a temporary directory first.
+
+    A URL that finishes again after its record was evicted replaces that
+    record, so the old status must leave the on-disk counts. Which status
+    it had is only known on disk; such URLs are collected and looked up in
+    batches, at the latest when the counts are read.
+    """
+
+    def __init__(self, size: int, store: Optional[DownloadStore],
+                 describe: Callable[[T], dict], load: Callable[[dict], T]):
+        self.size = max(1, size)
+        self._store = store
+        self._spill = store is None
+        self._describe = describe
+        self._load = load
+        self._items: 'OrderedDict[str, T]' = OrderedDict()
+        self._in_memory: Counter = Counter()  # status -> items held
+        self._on_disk: Counter = Counter()  # status -> items evicted
+        self._refinished: Dict[str, List[str]] = {}  # url -> ids recorded since, which may replace one on disk
+        self._taken: Set[str] = set()  # URLs popped while records were on disk; theirs are accounted for
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, item: T):
+        """Record a finished item, evicting the oldest beyond `size`"""
+        with self._lock:
+            previous = self._items.pop(item.url, None)
+            if previous is not None:
+                self._in_memory[previous.status] -= 1
+            if item.url in self._refinished:
+                self._refinished[item.url].append(item.id)
+            elif previous is None and item.url not in self._taken and +self._on_disk:
+                self._refinished[item.url] = [item.id]
+            self._taken.discard(item.url)
+            self._items[item.url] = item
+            self._in_memory[item.status] += 1
+            while len(self._items) > self.size:
+                _, evicted = self._items.popitem(last=False)
+                self._in_memory[evicted.status] -= 1
+                self._on_disk[evicted.status] += 1
+                if self._spill:
+                    self._spill_store().record(self._describe(evicted))
+            resolve = len(self._refinished) >= RESOLVE_BATCH
+        if resolve:
+            self._resolve()
+
+    def _resolve(self):
+        """Take the records that URLs finished again have replaced out of the on-disk counts"""
+        with self._lock:
+            refinished, self._refinished = self._refinished, {}
+        if not refinished or self._store is None:
+            return
+        self._store.flush()
+        for url, ids in refinished.items():
+            row = self._store.find(url, exclude=ids)
+            if row is None:
+                continue
+            with self._lock:
+                if self._on_disk[row['status']] <= 0:
+                    continue
+                self._on_disk[row['status']] -= 1
+            if self._spill:
+                self._store.delete(row['id'])
+
+    def restore(self, items: List[T], on_disk: Dict[str, int]):
+        """Load items from an earlier run, oldest first, and the counts of those left on disk"""
+        for item in items:
+            self.add(item)
+        with self._lock:
+            self._on_disk.update(on_disk)
+
+    def get(self, url: str, status: Optional[str] = None) -> Optional[T]:
+        """The finished item for a URL, if its latest state has `status`"""
+        with self._lock:
+            item = self._items.get(url)
+            if item is not None:
+                return item if status is None or item.status == status else None
+        row = self._find(url, status)
+        return self._load(row) if row else None
+
+    def pop(self, url: str, status: Optional[str] = None) -> Optional[T]:
+        """Take a finished item out of the history, e.g. to retry it"""
+        with self._lock:
+            item = self._items.get(url)
+            if item is not None:
+                if status is not None and item.status != status:
+                    return None
+                del self._items[url]
+                self._in_memory[item.status] -= 1
+                if +self._on_disk:
+                    self._taken.add(url)
+                return item
+        row = self._find(url, status)
+        if row is None:
+            return None
+        with self._lock:
+            self._on_disk[row['status']] = max(0, self._on_disk[row['status']] - 1)
+            self._taken.add(url)
+        if self._spill:
+            self._store.delete(row['id'])
+        return self._load(row)
+
+    def _find(self, url: str, status: Optional[str]) -> Optional[dict]:
+        if not (self._on_disk[status] if status else sum(self._on_disk.values())) or self._store is None:
+            return None
+        self._store.flush()
+        return self._store.find(url, status)
+
+    def count(self, status: Optional[str] = None) -> int:
+        """Finished items in memory and on disk, optionally of one status"""
+        if self._refinished:
+            self._resolve()
+        with self._lock:
+            if status:
+                return self._in_memory[status] + self._on_disk[status]
+            return sum(self._in_memory.values()) + sum(self._on_disk.values())
+
+    def recent(self, status: Optional[str] = None, limit: Optional[int] = None) -> List[T]:
+        """Items still in memory, most recently finished first"""
+        with self._lock:
+            items = [item for item in reversed(self._items.values()) if status is None or item.status == status]
+        return items[:limit]
+
+    def page(self, status: Optional[str] = None, host: Optional[str] = None,
+             offset: int = 0, limit: int = 100) -> List[dict]:
+        """Like DownloadStore.history(), continuing from memory into the spill database"""
+        with self._lock:
+            items = [item for item in reversed(self._items.values())
+                     if (status is None or item.status == status) and (host is None or item.host == host)]
+        rows = [self._describe(item) for item in items[offset:offset + limit]]
+        if len(rows) < limit and self._spill and self._store is not None:
+            self._store.flush()
+            rows += self._store.history(status, host, max(0, offset - len(items)), limit - len(rows))
+        return rows
+
+    def _spill_store(self) -> DownloadStore:
+        if self._store is None:
+            directory = tempfile.mkdtemp(prefix='download-history-')
+            self._store = DownloadStore(os.path.join(directory, 'history.db'))
+            atexit.register(self._remove_spill, directory)
+        return self._store
+
+    def _remove_spill(self, directory: str):
+        self._store.close()
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import threading
+from typing import Optional, Tuple
+
+# Hex digest length for each algorithm accepted without an explicit prefix
+DIGEST_LENGTHS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+
+class IntegrityError(Exception):
+    """Raised when a finished download does not match its expected size or digest"""
+
+
+def parse_digest(value: str) -> Tuple[str, str]:
+    """Split 'sha256:<hex>' (or a bare hex digest) into (algorithm, hexdigest)"""
+    value = value.strip().lower()
+    if ':' in value:
+        algorithm, hexdigest = value.split(':', 1)
+    else:
+        algorithm, hexdigest = DIGEST_LENGTHS.get(len(value), ''), value
+    if algorithm not in hashlib.algorithms_available:
+        raise ValueError(f"Unsupported digest: {value}")
+    try:
+        int(hexdigest, 16)
+    except ValueError:
+        raise ValueError(f"Digest is not hexadecimal: {value}")
+    if len(hexdigest) != hashlib.new(algorithm).digest_size * 2:
+        raise ValueError(f"Wrong length for a {algorithm} digest: {value}")
+    return algorithm, hexdigest
+
+
+def format_digest(algorithm: str, hexdigest: str) -> str:
+    return f"{algorithm}:{hexdigest}"
+
+
+class StreamHasher:
+    """Hash a file on a background thread while it is still being written.
+
+    The writer only reports how far the file is contiguously complete with
+    `advance()`; the hashing thread reads up to that watermark through its
+    own descriptor (the data is normally still in the page cache) and never
+    blocks the writer. `finish()` waits for the hash to catch up with the
+    final size and returns the hex digest.
+    """
+
+    def __init__(self, path: str, algorithm: str = 'sha256', block_size: int = 1024 * 1024):
+        self.path = path
+        self.algorithm = algorithm
+        self.block_size = block_size
+        self.position = 0
+        self._hash = hashlib.new(algorithm)
+        self._watermark = 0
+        self._closed = False
+        self._error: Optional[Exception] = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='download-hasher')
+        self._thread.start()
+
+    def advance(self, watermark: int):
+        """Mark the file complete up to `watermark` bytes"""
+        if watermark > self._watermark:
+            with self._cond:
+                if watermark > self._watermark:
+                    self._watermark = watermark
+                    self._cond.notify()
+
+    def finish(self, size: int) -> str:
+        """Hash through `size` bytes and return the hex digest"""
+        with self._cond:
+            self._watermark = max(self._watermark, size)
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if self._error:
+            raise self._error
+        if self.position != size:
+            raise IntegrityError(f"Expected {size} bytes to hash, found {self.position}")
+        return self._hash.hexdigest()
+
+    def cancel(self):
+        """Stop hashing without waiting for the rest of the file"""
+        with self._cond:
+            self._watermark = self.position
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        fd = None
+        try:
+            while True:
+                with self._cond:
+                    while self.position >= self._watermark and not self._closed:
+                        self._cond.wait()
+                    target = self._watermark
+                    if self.position >= target:
+                        return
+                if fd is None:
+                    fd = os.open(self.path, os.O_RDONLY)
+                while self.position < target:
+                    data = os.pread(fd, min(self.block_size, target - self.position), self.position)
+                    if not data:
+                        raise IntegrityError(f"{self.path} ended at {self.position} bytes while hashing")
+                    self._hash.update(data)
+                    self.position += len(data)
+        except Exception as e:
+            self._error = e
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+
+def contiguous_prefix(segments) -> int:
+    """Bytes from the start of the file that every segment has written"""
+    prefix = 0
+    for start, written, end in sorted(segments):
+        if start > prefix:
+            break
+        prefix = max(prefix, written)
+        if written < end:
+            break
+    return prefix
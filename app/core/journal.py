@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+from app.core.logger import main_logger
+
+JOURNAL_SUFFIX = '.json'
+
+
+class TransferJournal:
+    """On-disk record of a partially downloaded `.part` file.
+
+    The journal lives next to the part file and stores the validators the
+    server returned (ETag / Last-Modified) together with a segment map of
+    [start, written, end] triples, so a later attempt can ask for only the
+    bytes that are still missing.
+    """
+
+    def __init__(self, part_path: str, url: str, total_size: int = 0,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 segments: Optional[List[List[int]]] = None,
+                 caption: str = "", priority: int = 5):
+        self.part_path = part_path
+        self.url = url
+        self.total_size = total_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.segments = segments or [[0, 0, total_size]]
+        self.caption = caption
+        self.priority = priority
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self.part_path + JOURNAL_SUFFIX
+
+    @classmethod
+    def from_response(cls, part_path: str, url: str, response, caption: str = "",
+                      priority: int = 5) -> 'TransferJournal':
+        """Start a fresh journal from the headers of a full (200) response"""
+        headers = response.headers
+        return cls(
+            part_path, url,
+            total_size=int(headers.get('content-length', 0)),
+            etag=headers.get('etag'),
+            last_modified=headers.get('last-modified'),
+            caption=caption,
+            priority=priority
+        )
+
+    @classmethod
+    def load(cls, part_path: str) -> Optional['TransferJournal']:
+        """Load the journal for a part file, if both exist and are readable"""
+        journal_path = part_path + JOURNAL_SUFFIX
+        if not (os.path.exists(journal_path) and os.path.exists(part_path)):
+            return None
+        try:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(
+                part_path, data['url'],
+                total_size=data.get('total_size', 0),
+                etag=data.get('etag'),
+                last_modified=data.get('last_modified'),
+                segments=data.get('segments'),
+                caption=data.get('caption', ""),
+                priority=data.get('priority', 5)
+            )
+        except (OSError, ValueError, KeyError) as e:
+            main_logger.warning(f"Ignoring unreadable journal {journal_path}: {str(e)}")
+            return None
+
+    @property
+    def validator(self) -> Optional[str]:
+        """Value for If-Range; strong ETags are preferred over Last-Modified"""
+        if self.etag and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+    @property
+    def downloaded(self) -> int:
+        return sum(written - start for start, written, end in self.segments)
+
+    @property
+    def offset(self) -> int:
+        """First byte that has not been written yet"""
+        for start, written, end in sorted(self.segments):
+            if written < end or end <= 0:
+                return written
+        return self.total_size
+
+    def is_resumable(self) -> bool:
+        return bool(self.validator) and self.total_size > 0 and self.downloaded > 0
+
+    def resume_headers(self) -> dict:
+        """Conditional range headers for continuing this transfer"""
+        return {
+            'Range': f'bytes={self.offset}-',
+            'If-Range': self.validator
+        }
+
+    def flush_due(self, interval: float = 1.0) -> bool:
+        """Whether enough time has passed since the last write to save again"""
+        return time.monotonic() - self._last_flush >= interval
+
+    def save(self, force: bool = True, interval: float = 1.0):
+        """Atomically write the journal, at most once per `interval` unless forced"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_flush < interval:
+                return
+            self._last_flush = now
+            self._write()
+
+    def _write(self):
+        data = {
+            'url': self.url,
+            'total_size': self.total_size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'segments': self.segments,
+            'caption': self.caption,
+            'priority': self.priority
+        }
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            main_logger.error(f"Failed to write journal {self.path}: {str(e)}")
+
+    def delete(self):
+        """Remove the journal once the transfer is complete or abandoned"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def find_journals(directory: str) -> List[TransferJournal]:
+    """Return every loadable journal in a download directory"""
+    journals = []
+    if not os.path.isdir(directory):
+        return journals
+    for name in os.listdir(directory):
+        if name.endswith('.part' + JOURNAL_SUFFIX):
+            journal = TransferJournal.load(os.path.join(directory, name[:-len(JOURNAL_SUFFIX)]))
+            if journal:
+                journals.append(journal)
+    return journals
@@ -1,38 +1,182 @@
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+from typing import List
 from app.config import Config
 
+# Log files the API serves, by the type names the dashboard uses; 'debug' is the main log
+LOG_FILES = {
+    'debug': 'main.log',
+    'main': 'main.log',
+    'downloads': 'downloads.log',
+    'web': 'web.log',
+    'error': 'error.log',
+}
+
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any exception"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry)
+
+
+class _QueueHandler(QueueHandler):
+    """Hands records to the log thread with the message rendered and the traceback as text.
+
+    The stock handler folds the traceback into the message, which would
+    put it inside the JSON 'message' field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _file_handler(log_file: str, formatter: logging.Formatter) -> RotatingFileHandler:
+    handler = RotatingFileHandler(
+        os.path.join(Config.LOG_DIR, log_file),
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        delay=True
+    )
+    handler.setFormatter(formatter)
+    return handler
+
+
+# Records from every logger go through one queue; a single background thread
+# formats them and does the file and console I/O, so the threads that log
+# only pay for an enqueue.
+_queue: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+_handlers: List[logging.Handler] = []
+_listener = None
+# The files can be JSON for log shippers; the console stays readable
+_formatter = JsonFormatter() if Config.LOG_JSON else logging.Formatter(Config.LOG_FORMAT)
+
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(logging.Formatter(Config.LOG_FORMAT))
+
+
 def setup_logger(name, log_file):
     """Setup and return a logger instance"""
     logger = logging.getLogger(name)
-    
+
     # Avoid duplicate handlers
     if logger.handlers:
         return logger
-        
+
     logger.setLevel(logging.INFO)
-    
-    # Create formatter
-    formatter = logging.Formatter(Config.LOG_FORMAT)
-    
-    # File handler
-    file_handler = RotatingFileHandler(
-        os.path.join(Config.LOG_DIR, log_file),
-        maxBytes=Config.LOG_MAX_BYTES,
-        backupCount=Config.LOG_BACKUP_COUNT
-    )
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-    
-    # Console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
+    logger.addHandler(_QueueHandler(_queue))
+    # Each file gets its own logger's records; the error log and console get everyone's
+    handler = _file_handler(log_file, _formatter)
+    handler.addFilter(logging.Filter(name))
+    _handlers.append(handler)
     return logger
 
+
+def _start_listener():
+    global _listener
+    error_handler = _file_handler(LOG_FILES['error'], _formatter)
+    error_handler.setLevel(logging.ERROR)
+    _handlers.append(error_handler)
+    _listener = QueueListener(_queue, *_handlers, console_handler, respect_handler_level=True)
+    _listener.start()
+    # Write out whatever is still queued when the interpreter exits
+    atexit.register(_listener.stop)
+
+
+def set_log_suffix(suffix: str):
+    """Write this process's log files as <name>-<suffix>.log.
+
+    Rotation renames files in place, so processes sharing LOG_DIR (the
+    distributed engine's workers) each need files of their own.
+    """
+    for handler in _handlers:
+        root, ext = os.path.splitext(handler.baseFilename)
+        handler.acquire()
+        try:
+            if handler.stream is not None:
+                handler.stream.close()
+                handler.stream = None
+            handler.baseFilename = f"{root}-{suffix}{ext}"
+        finally:
+            handler.release()
+
+
+def log_path(log_type: str) -> str:
+    """Path of the current file for a log type"""
+    if log_type not in LOG_FILES:
+        raise ValueError(f"Unknown log type: {log_type}")
+    return os.path.join(Config.LOG_DIR, LOG_FILES[log_type])
+
+
+def log_files(log_type: str, rotated: bool = False) -> List[str]:
+    """Existing files of a log, oldest first; rotated ones only if asked for"""
+    path = log_path(log_type)
+    paths = [f"{path}.{i}" for i in range(Config.LOG_BACKUP_COUNT, 0, -1)] if rotated else []
+    return [p for p in paths + [path] if os.path.exists(p)]
+
+
+def tail(log_type: str, lines: int = 100) -> List[str]:
+    """The last `lines` lines of a log, oldest first.
+
+    Reads fixed-size blocks backwards from the end of the file, so the cost
+    depends on how much is returned, not on the size of the log. If the
+    current file is shorter than asked for, the newest rotated file is read
+    the same way.
+    """
+    found: List[bytes] = []
+    for path in reversed(log_files(log_type, rotated=True)):
+        found = _tail_file(path, lines - len(found)) + found
+        if len(found) >= lines:
+            break
+    return [line.decode('utf-8', errors='replace') for line in found]
+
+
+def _tail_file(path: str, lines: int) -> List[bytes]:
+    if lines <= 0:
+        return []
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return []
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        data = b''
+        # One extra newline marks the start of the first wanted line
+        while position > 0 and data.count(b'\n') <= lines:
+            step = min(TAIL_BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    found = data.splitlines()
+    return found[-lines:]
+
+
 # Create loggers
 main_logger = setup_logger('main', 'main.log')
 download_logger = setup_logger('download_manager', 'downloads.log')
-web_logger = setup_logger('web', 'web.log') 
\ No newline at end of file
+web_logger = setup_logger('web', 'web.log')
+_start_listener()
@@ -0,0 +1,206 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Label pairs of one series, e.g. (('host', 'example.com'),)
+Labels = Tuple[Tuple[str, str], ...]
+
+# Histogram bucket upper bounds
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+LOCK_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 0.01, 0.1, 1)
+RATE_BUCKETS = (1e4, 1e5, 1e6, 1e7, 5e7, 1e8, 5e8, 1e9)  # bytes per second
+
+
+class _Shard:
+    """The series one thread has recorded; only that thread writes to it"""
+    __slots__ = ('thread', 'counters', 'histograms')
+
+    def __init__(self, thread: Optional[threading.Thread]):
+        self.thread = thread
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # Per series: one count per bucket, the +Inf count, then the sum
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+
+
+class Metrics:
+    """Counters and histograms that are cheap to record from any thread.
+
+    Every thread records into its own shard, so the hot path is a couple
+    of dict operations with no lock. A scrape merges the shards. Shards of
+    threads that have exited (segment threads come and go with each
+    download) are folded into one retired shard when new threads register
+    or a scrape runs, so memory stays bounded by the live threads.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[_Shard] = []
+        self._retired = _Shard(None)
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def counter(self, name: str, help: str):
+        self._meta[name] = ('counter', help)
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = TIME_BUCKETS):
+        self._meta[name] = ('histogram', help)
+        self._buckets[name] = buckets
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._fold_dead()
+                # Replaced, never mutated, so a scrape can iterate it unlocked
+                self._shards = self._shards + [shard]
+        return shard
+
+    def inc(self, name: str, amount: float = 1, labels: Labels = ()):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        counts = histograms.get(key)
+        buckets = self._buckets[name]
+        if counts is None:
+            counts = histograms[key] = [0] * (len(buckets) + 2)
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+    def _fold_dead(self):
+        """Merge shards of exited threads into the retired shard; caller holds self._lock"""
+        live = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                self._merge(self._retired, shard)
+        if len(live) != len(self._shards):
+            self._shards = live
+
+    @staticmethod
+    def _merge(into: _Shard, shard: _Shard):
+        # dict() copies are atomic under the GIL, so the owner may keep writing
+        for key, value in dict(shard.counters).items():
+            into.counters[key] = into.counters.get(key, 0) + value
+        for key, counts in dict(shard.histograms).items():
+            merged = into.histograms.get(key)
+            if merged is None:
+                into.histograms[key] = list(counts)
+            else:
+                for i, value in enumerate(list(counts)):
+                    merged[i] += value
+
+    def collect(self) -> _Shard:
+        """A merged snapshot of every thread's series"""
+        with self._lock:
+            self._fold_dead()
+            total = _Shard(None)
+            self._merge(total, self._retired)
+            for shard in self._shards:
+                self._merge(total, shard)
+        return total
+
+    def total(self, name: str) -> float:
+        """Sum of a counter over all threads and labels"""
+        with self._lock:
+            shards = [self._retired] + self._shards
+        return sum(value for shard in shards
+                   for (series, _), value in list(shard.counters.items()) if series == name)
+
+    def render(self, gauges: Iterable[Tuple[str, str, float]] = ()) -> str:
+        """Prometheus text exposition format, plus (name, help, value) gauges read at scrape time"""
+        snapshot = self.collect()
+        lines = []
+        for name, help, value in gauges:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+        for name, (kind, help) in self._meta.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            if kind == 'counter':
+                for (series, labels), value in sorted(snapshot.counters.items()):
+                    if series == name:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            bounds = [_number(bound) for bound in self._buckets[name]] + ['+Inf']
+            for (series, labels), counts in sorted(snapshot.histograms.items()):
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {_number(cumulative)}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(counts[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {_number(cumulative)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class TimedLock:
+    """A re-entrant lock that records how long it is waited for and held.
+
+    Observations go to `lock_wait_seconds` and `lock_hold_seconds` with a
+    `lock` label. It also implements the hooks threading.Condition uses, so
+    it can back a Condition. Time spent inside Condition.wait() counts as
+    neither waiting for nor holding the lock.
+    """
+
+    def __init__(self, metrics: Metrics, name: str):
+        self._lock = threading.RLock()
+        self._metrics = metrics
+        self._labels: Labels = (('lock', name),)
+        self._depth = 0
+        self._acquired = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        self._depth += 1
+        if self._depth == 1:
+            self._acquired = now = time.perf_counter()
+            self._metrics.observe('lock_wait_seconds', now - start, self._labels)
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth:
+            self._lock.release()
+            return
+        held = time.perf_counter() - self._acquired
+        self._lock.release()
+        self._metrics.observe('lock_hold_seconds', held, self._labels)
+
+    __enter__ = acquire
+
+    def __exit__(self, *args):
+        self.release()
+
+    def _is_owned(self) -> bool:
+        return self._lock._is_owned()
+
+    def _release_save(self):
+        self._metrics.observe('lock_hold_seconds', time.perf_counter() - self._acquired, self._labels)
+        depth, self._depth = self._depth, 0
+        return self._lock._release_save(), depth
+
+    def _acquire_restore(self, state):
+        saved, depth = state
+        self._lock._acquire_restore(saved)
+        self._depth = depth
+        self._acquired = time.perf_counter()
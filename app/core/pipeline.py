@@ -0,0 +1,346 @@
+import bz2
+import gzip
+import hashlib
+import importlib
+import lzma
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from app.config import Config
+from app.core.logger import main_logger
+from app.core.metrics import Metrics
+
+# Finished jobs kept for the API
+RECENT_JOBS = 1000
+
+COPY_BUFFER = 1024 * 1024
+
+# Compressed single files, by extension, and the archive suffixes `extract` handles
+DECOMPRESSORS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open, '.lzma': lzma.open}
+ARCHIVE_SUFFIXES = ('.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.tar', '.zip')
+
+
+# Built-in stages. A stage takes the path of a finished file (or the
+# directory an earlier stage produced) and returns the path later stages
+# should work on, or None to leave it unchanged. Stages write new files
+# rather than changing one in place: completed files may be hard links
+# into the download cache.
+
+def decompress(path: str) -> Optional[str]:
+    """Unpack a .gz, .bz2 or .xz file beside itself and remove the compressed copy"""
+    lower = path.lower()
+    opener = DECOMPRESSORS.get(os.path.splitext(lower)[1])
+    if opener is None or os.path.isdir(path) or lower.endswith(ARCHIVE_SUFFIXES):
+        return None
+    target = os.path.splitext(path)[0]
+    temporary = target + '.decompressing'
+    try:
+        with opener(path, 'rb') as source, open(temporary, 'wb') as dest:
+            shutil.copyfileobj(source, dest, COPY_BUFFER)
+        os.replace(temporary, target)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    os.remove(path)
+    return target
+
+
+def extract(path: str) -> Optional[str]:
+    """Unpack a zip or tar archive into a directory named after it"""
+    suffix = next((s for s in ARCHIVE_SUFFIXES if path.lower().endswith(s)), None)
+    if suffix is None or os.path.isdir(path):
+        return None
+    target = path[:-len(suffix)]
+    temporary = target + '.extracting'
+    shutil.rmtree(temporary, ignore_errors=True)
+    try:
+        if suffix == '.zip':
+            # zipfile drops absolute paths and '..' from member names itself
+            with zipfile.ZipFile(path) as archive:
+                archive.extractall(temporary)
+        else:
+            with tarfile.open(path) as archive:
+                _extract_tar(archive, temporary)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.replace(temporary, target)
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+    return target
+
+
+def _extract_tar(archive: tarfile.TarFile, dest: str):
+    if hasattr(tarfile, 'data_filter'):
+        archive.extractall(dest, filter='data')
+        return
+    root = os.path.realpath(dest)
+    for member in archive.getmembers():
+        path = os.path.realpath(os.path.join(dest, member.name))
+        if not (path == root or path.startswith(root + os.sep)) or member.issym() or member.islnk():
+            raise ValueError(f"Unsafe path in archive: {member.name}")
+    archive.extractall(dest)
+
+
+def checksum(path: str) -> Optional[str]:
+    """Write a `<file>.<algorithm>` sidecar in sha256sum format"""
+    if os.path.isdir(path):
+        return None
+    algorithm = Config.DIGEST_ALGORITHM
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER), b''):
+            digest.update(block)
+    with open(f"{path}.{algorithm}", 'w') as f:
+        f.write(f"{digest.hexdigest()}  {os.path.basename(path)}\n")
+    return None
+
+
+def move(path: str) -> Optional[str]:
+    """Move a file or directory, with its checksum sidecar, into PIPELINE_DEST_DIR"""
+    os.makedirs(Config.PIPELINE_DEST_DIR, exist_ok=True)
+    target = os.path.join(Config.PIPELINE_DEST_DIR, os.path.basename(path))
+    if os.path.isdir(target) and not os.path.samefile(path, target):
+        shutil.rmtree(target)
+    shutil.move(path, target)
+    sidecar = f"{path}.{Config.DIGEST_ALGORITHM}"
+    if os.path.exists(sidecar):
+        shutil.move(sidecar, f"{target}.{Config.DIGEST_ALGORITHM}")
+    return target
+
+
+# name -> (function, where it runs by default)
+BUILTIN_STAGES: Dict[str, Tuple[Callable[[str], Optional[str]], str]] = {
+    'decompress': (decompress, 'cpu'),
+    'extract': (extract, 'cpu'),
+    'checksum': (checksum, 'cpu'),
+    'move': (move, 'io'),
+}
+
+
+class Stage:
+    __slots__ = ('name', 'func', 'kind')
+
+    def __init__(self, name: str, func: Callable[[str], Optional[str]], kind: str):
+        self.name = name
+        self.func = func
+        self.kind = kind
+
+
+def load_stages(spec: str) -> List[Stage]:
+    """Parse PIPELINE_STAGES: built-in names or module:function, each optionally @cpu or @io.
+
+    Functions for CPU stages run in another process, so they must be
+    importable at module level; custom stages run on threads unless
+    marked @cpu.
+    """
+    stages = []
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, kind = entry.partition('@')
+        if name in BUILTIN_STAGES:
+            func, default = BUILTIN_STAGES[name]
+        elif ':' in name:
+            module, _, attribute = name.partition(':')
+            func, default = getattr(importlib.import_module(module), attribute), 'io'
+        else:
+            raise ValueError(f"Unknown pipeline stage: {entry}")
+        kind = kind or default
+        if kind not in ('cpu', 'io'):
+            raise ValueError(f"Pipeline stage {name} must run @cpu or @io, not @{kind}")
+        if func is move and not Config.PIPELINE_DEST_DIR:
+            raise ValueError("The 'move' stage needs PIPELINE_DEST_DIR")
+        stages.append(Stage(name, func, kind))
+    return stages
+
+
+def _timed(func: Callable[[str], Optional[str]], path: str) -> Tuple[Optional[str], float]:
+    """Run a stage and measure it where it runs, so pool queueing is not counted"""
+    started = time.perf_counter()
+    result = func(path)
+    return result, time.perf_counter() - started
+
+
+class PostProcessor:
+    """Runs every completed file through the configured stages, off the download workers.
+
+    CPU stages run on a process pool and I/O stages on a thread pool. A job
+    moves on to its next stage from the done callback of the previous one,
+    so no thread sits waiting on a job. If a stage fails, the rest of that
+    job is skipped; the download itself stays completed.
+
+    At most `max_pending` files are in the pipeline at once. Beyond that
+    `saturated` is true and the manager starts no new transfers until a job
+    finishes, so slow stages hold back the network instead of piling up
+    files on disk. Downloads already running finish and are queued here
+    regardless, so a download worker never waits on the pipeline.
+    """
+
+    def __init__(self, stages: List[Stage], processes: int, threads: int, max_pending: int,
+                 metrics: Metrics, publish: Callable[[dict], None], on_drain: Callable[[], None]):
+        self.stages = stages
+        self.processes = max(1, processes)
+        self.max_pending = max(1, max_pending)
+        self._metrics = metrics
+        self._publish = publish
+        self._on_drain = on_drain
+        self._threads = ThreadPoolExecutor(max(1, threads), thread_name_prefix='pipeline-io')
+        self._processes: Optional[ProcessPoolExecutor] = None  # started with the first CPU stage
+        self._active: Dict[str, dict] = {}  # item id -> job
+        self._recent: Deque[dict] = deque(maxlen=RECENT_JOBS)
+        self._totals = {stage.name: {'runs': 0, 'failures': 0, 'seconds': 0.0} for stage in stages}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @property
+    def saturated(self) -> bool:
+        return len(self._active) >= self.max_pending
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    def submit(self, item_id: str, url: str, path: str):
+        """Queue a completed file for processing; never blocks"""
+        job = {
+            'id': item_id,
+            'url': url,
+            'source': path,
+            'path': path,
+            'status': 'processing',
+            'stage': None,
+            'started': time.time(),
+            'finished': None,
+            'error': None,
+            'stages': [{'name': stage.name, 'status': 'pending', 'seconds': None, 'waited': None}
+                       for stage in self.stages]
+        }
+        with self._cond:
+            if self._closed:
+                return
+            self._active[item_id] = job
+        self._advance(job, 0)
+
+    def _advance(self, job: dict, index: int):
+        if index == len(self.stages):
+            self._finish(job, 'done')
+            return
+        stage = self.stages[index]
+        with self._cond:
+            job['stage'] = stage.name
+            job['stages'][index]['status'] = 'running'
+        self._publish(self._snapshot(job))
+        submitted = time.perf_counter()
+        try:
+            future = self._executor(stage).submit(_timed, stage.func, job['path'])
+        except (RuntimeError, BrokenProcessPool) as e:
+            self._stage_failed(job, index, e)
+            return
+        future.add_done_callback(lambda f: self._stage_done(job, index, submitted, f))
+
+    def _executor(self, stage: Stage) -> Executor:
+        if stage.kind == 'io':
+            return self._threads
+        with self._cond:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(self.processes)
+            return self._processes
+
+    def _stage_done(self, job: dict, index: int, submitted: float, future: Future):
+        stage = self.stages[index]
+        try:
+            result, seconds = future.result()
+        except BaseException as e:
+            if isinstance(e, BrokenProcessPool):
+                # A stage crashed its worker process; start a fresh pool for later jobs
+                with self._cond:
+                    self._processes = None
+            self._stage_failed(job, index, e)
+            return
+        waited = max(0.0, time.perf_counter() - submitted - seconds)
+        self._metrics.observe('pipeline_stage_seconds', seconds, (('stage', stage.name),))
+        with self._cond:
+            totals = self._totals[stage.name]
+            totals['runs'] += 1
+            totals['seconds'] += seconds
+            job['stages'][index].update(status='done', seconds=round(seconds, 3), waited=round(waited, 3))
+            if result:
+                job['path'] = result
+        self._advance(job, index + 1)
+
+    def _stage_failed(self, job: dict, index: int, error: BaseException):
+        stage = self.stages[index]
+        self._metrics.inc('pipeline_stage_failures_total', labels=(('stage', stage.name),))
+        with self._cond:
+            self._totals[stage.name]['failures'] += 1
+            job['stages'][index]['status'] = 'failed'
+            for later in job['stages'][index + 1:]:
+                later['status'] = 'skipped'
+            job['error'] = f"{stage.name}: {str(error) or type(error).__name__}"
+        main_logger.warning(f"Post-processing stage {stage.name} failed for {job['url']}: {str(error)}")
+        self._finish(job, 'failed')
+
+    def _finish(self, job: dict, status: str):
+        with self._cond:
+            was_saturated = self.saturated
+            job['status'] = status
+            job['stage'] = None
+            job['finished'] = time.time()
+            if self._active.get(job['id']) is job:
+                del self._active[job['id']]
+            self._recent.append(job)
+            drained = was_saturated and not self.saturated
+            self._cond.notify_all()
+        self._publish(self._snapshot(job))
+        if drained:
+            self._on_drain()
+
+    def _snapshot(self, job: dict) -> dict:
+        with self._cond:
+            return dict(job, stages=[dict(stage) for stage in job['stages']])
+
+    def get(self, item_id: str) -> Optional[dict]:
+        """The running or most recent job for an item"""
+        with self._cond:
+            job = self._active.get(item_id) or next(
+                (job for job in reversed(self._recent) if job['id'] == item_id), None)
+        return self._snapshot(job) if job else None
+
+    def get_stats(self, limit: int = 100) -> dict:
+        """Stage totals, jobs in flight and the most recently finished ones"""
+        with self._cond:
+            active = list(self._active.values())
+            recent = list(self._recent)[-limit:]
+            failed = sum(1 for job in self._recent if job['status'] == 'failed')
+            stages = [dict(name=stage.name, kind=stage.kind, **self._totals[stage.name])
+                      for stage in self.stages]
+        for stage in stages:
+            stage['seconds'] = round(stage['seconds'], 3)
+        return {
+            'stages': stages,
+            'pending': len(active),
+            'max_pending': self.max_pending,
+            'saturated': len(active) >= self.max_pending,
+            'failed': failed,
+            'active': [self._snapshot(job) for job in active],
+            'recent': [self._snapshot(job) for job in reversed(recent)]
+        }
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted file has been processed"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._active, timeout)
+
+    def close(self):
+        """Stop taking jobs and drop queued stages; stages running in worker processes finish first"""
+        with self._cond:
+            self._closed = True
+            processes = self._processes
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if processes is not None:
+            # Leaving the process pool running makes its exit handler fail at interpreter shutdown
+            processes.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,130 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class TokenBucket:
+    """Token bucket measured in bytes.
+
+    Callers take the bytes they have just read, which may drive the balance
+    negative, and then wait until it is paid back. A transfer can therefore
+    keep using large reads: it sleeps once per read instead of once per
+    small chunk. A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: int = 0, burst: Optional[float] = None):
+        self.rate = 0
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.burst = burst
+        self.set_rate(rate)
+
+    def set_rate(self, rate: int):
+        """Change the rate; the new value applies to bytes already owed"""
+        self._refill()
+        self.rate = max(0, int(rate))
+        self.capacity = float(self.burst if self.burst is not None else self.rate)
+        if self.rate == 0:
+            self.tokens = 0.0
+        else:
+            self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, nbytes: int):
+        """Debit bytes that have already been transferred"""
+        if self.rate:
+            self._refill()
+            self.tokens -= nbytes
+
+    def delay(self) -> float:
+        """Seconds until the balance is no longer negative"""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimiter:
+    """Bandwidth limits shared by every download thread.
+
+    A transfer is throttled by the global bucket, the bucket of its host and
+    its own bucket, whichever is slowest. Limits can be changed while
+    transfers are running; waiting threads are woken and re-check their
+    debt against the new rate.
+    """
+
+    def __init__(self, global_limit: int = 0):
+        self._cond = threading.Condition()
+        self.global_bucket = TokenBucket(global_limit)
+        self.host_buckets: Dict[str, TokenBucket] = {}
+        self.item_buckets: Dict[str, TokenBucket] = {}
+
+    def set_global_limit(self, limit: int):
+        with self._cond:
+            self.global_bucket.set_rate(limit)
+            self._cond.notify_all()
+
+    def get_global_limit(self) -> int:
+        return self.global_bucket.rate
+
+    def set_host_limit(self, host: str, limit: int):
+        """Set a per-host limit in bytes/second; 0 removes it"""
+        self._set_limit(self.host_buckets, host, limit)
+
+    def set_item_limit(self, key: str, limit: int):
+        """Set a per-download limit in bytes/second; 0 removes it"""
+        self._set_limit(self.item_buckets, key, limit)
+
+    def _set_limit(self, buckets: Dict[str, TokenBucket], key: str, limit: int):
+        with self._cond:
+            if limit > 0:
+                if key in buckets:
+                    buckets[key].set_rate(limit)
+                else:
+                    buckets[key] = TokenBucket(limit)
+            else:
+                buckets.pop(key, None)
+            self._cond.notify_all()
+
+    def get_host_limits(self) -> Dict[str, int]:
+        with self._cond:
+            return {host: bucket.rate for host, bucket in self.host_buckets.items()}
+
+    def get_item_limits(self) -> Dict[str, int]:
+        with self._cond:
+            return {key: bucket.rate for key, bucket in self.item_buckets.items()}
+
+    def _buckets(self, host: Optional[str], key: Optional[str]) -> List[TokenBucket]:
+        buckets = [self.global_bucket]
+        if host in self.host_buckets:
+            buckets.append(self.host_buckets[host])
+        if key in self.item_buckets:
+            buckets.append(self.item_buckets[key])
+        return buckets
+
+    def reserve(self, nbytes: int, host: Optional[str] = None, key: Optional[str] = None) -> float:
+        """Debit bytes and return how long the caller should wait, without blocking"""
+        with self._cond:
+            buckets = self._buckets(host, key)
+            for bucket in buckets:
+                bucket.take(nbytes)
+            return max(bucket.delay() for bucket in buckets)
+
+    def pending_delay(self, host: Optional[str] = None, key: Optional[str] = None) -> float:
+        """Current wait for a transfer that has already reserved its bytes"""
+        with self._cond:
+            return max(bucket.delay() for bucket in self._buckets(host, key))
+
+    def throttle(self, nbytes: int, host: Optional[str] = None, key: Optional[str] = None):
+        """Debit bytes and block until every applicable bucket allows more"""
+        with self._cond:
+            delay = self.reserve(nbytes, host, key)
+            while delay > 0:
+                self._cond.wait(delay)
+                delay = self.pending_delay(host, key)
@@ -0,0 +1,255 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Set, Tuple
+import requests
+from app.core.logger import main_logger
+from app.core.segments import SegmentError
+
+
+class TruncatedTransfer(IOError):
+    """Raised when a response body ends before its Content-Length"""
+
+
+# Exceptions that say nothing about the request itself: the network or the
+# origin had a problem, so the same request may well succeed later.
+TRANSIENT_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    ConnectionError,
+    TimeoutError,
+    TruncatedTransfer,
+    SegmentError,
+)
+
+
+def retryable_status(status: int) -> bool:
+    """Timeouts, throttling and server errors; other 4xx will not change on retry"""
+    return status in (408, 429) or (status >= 500 and status not in (501, 505))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def http_status(error: Exception) -> Tuple[Optional[int], Optional[str]]:
+    """Status code and Retry-After of an HTTP error from requests or aiohttp"""
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code, response.headers.get('Retry-After')
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        # aiohttp.ClientResponseError carries the status and headers itself
+        headers = getattr(error, 'headers', None) or {}
+        return status, headers.get('Retry-After')
+    return None, None
+
+
+class RetryPolicy:
+    """Decides whether a failed transfer is tried again, and after how long.
+
+    The backoff doubles from `base_delay` per attempt up to `max_delay`, and
+    the actual delay is drawn between half and all of it, so items that
+    failed together do not all come back at the same moment. A Retry-After
+    header raises the delay to what the server asked for (within max_delay).
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 300.0,
+                 transient: Tuple[type, ...] = TRANSIENT_ERRORS):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.transient = transient
+
+    def classify(self, error: Exception) -> Tuple[bool, Optional[float]]:
+        """Whether an error is worth retrying, and the server's Retry-After in seconds"""
+        status, retry_after = http_status(error)
+        if status is not None:
+            return retryable_status(status), parse_retry_after(retry_after)
+        return isinstance(error, self.transient), None
+
+    def should_retry(self, attempts: int) -> bool:
+        return attempts < self.max_attempts
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before attempt number `attempt + 1`"""
+        backoff = min(self.max_delay, self.base_delay * 2 ** max(0, attempt - 1))
+        delay = random.uniform(backoff / 2, backoff)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class _Breaker:
+    __slots__ = ('state', 'failures', 'timeout', 'reopen_at', 'due', 'probe', 'trips')
+
+    def __init__(self):
+        self.state = CircuitBreakers.CLOSED
+        self.failures = 0
+        self.timeout = 0.0
+        self.reopen_at = 0.0  # wall clock, for display
+        self.due = 0.0  # monotonic end of the open period
+        self.probe: Optional[str] = None  # URL of the transfer testing a half-open host
+        self.trips = 0
+
+
+class CircuitBreakers:
+    """Per-host circuit breakers.
+
+    `threshold` consecutive transient failures open a host's breaker and
+    nothing more is dispatched to it. After `reset_timeout` seconds it goes
+    half-open and lets one probe transfer through: success closes it, a
+    failure opens it again for twice as long (up to `max_reset_timeout`).
+    Only hosts with recent failures are tracked. Callers serialise access;
+    the manager holds its queue lock.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0, max_reset_timeout: float = 600.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._hosts: Dict[str, _Breaker] = {}
+        # Hosts whose breaker is not closed, and URLs of in-flight probes;
+        # read without the lock on the dispatch path.
+        self.unavailable: Set[str] = set()
+        self.probes: Set[str] = set()
+
+    def __contains__(self, host: str) -> bool:
+        return host in self._hosts
+
+    def allow(self, host: str, url: str) -> bool:
+        """Whether a transfer of `url` may start now; it becomes the probe of a half-open host"""
+        if host not in self.unavailable:
+            return True
+        breaker = self._hosts[host]
+        if breaker.state == self.HALF_OPEN and breaker.probe is None:
+            breaker.probe = url
+            self.probes.add(url)
+            return True
+        return False
+
+    def record_success(self, host: str) -> bool:
+        """Forget a host's failures; True when this closed an open or half-open breaker"""
+        breaker = self._hosts.pop(host, None)
+        if breaker is None:
+            return False
+        self._end_probe(breaker)
+        self.unavailable.discard(host)
+        return breaker.state != self.CLOSED
+
+    def record_failure(self, host: str, retry_after: Optional[float] = None) -> Optional[float]:
+        """Count a transient failure; returns seconds until the probe if this opened the breaker"""
+        if self.threshold <= 0:
+            return None
+        breaker = self._hosts.get(host)
+        if breaker is None:
+            breaker = self._hosts[host] = _Breaker()
+        breaker.failures += 1
+        if breaker.state == self.OPEN:
+            return None
+        if breaker.state == self.CLOSED and breaker.failures < self.threshold:
+            return None
+        # Tripped, or the half-open probe failed: back off further each time
+        breaker.timeout = min(self.max_reset_timeout, breaker.timeout * 2 or self.reset_timeout)
+        timeout = max(breaker.timeout, retry_after or 0)
+        breaker.state = self.OPEN
+        breaker.reopen_at = time.time() + timeout
+        breaker.due = time.monotonic() + timeout
+        breaker.trips += 1
+        self._end_probe(breaker)
+        self.unavailable.add(host)
+        return timeout
+
+    def half_open(self, host: str) -> bool:
+        """End an open period; the next transfer to the host is its probe"""
+        breaker = self._hosts.get(host)
+        # A timer left over from an earlier open period must not cut this one short
+        if breaker is None or breaker.state != self.OPEN or time.monotonic() < breaker.due:
+            return False
+        breaker.state = self.HALF_OPEN
+        return True
+
+    def release(self, host: str, url: str) -> bool:
+        """A probe ended without a verdict (cancelled, served from cache); True if the host needs a new one"""
+        breaker = self._hosts.get(host)
+        if breaker is None or breaker.probe != url:
+            return False
+        self._end_probe(breaker)
+        return breaker.state == self.HALF_OPEN
+
+    def _end_probe(self, breaker: _Breaker):
+        if breaker.probe is not None:
+            self.probes.discard(breaker.probe)
+            breaker.probe = None
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {host: {
+            'state': breaker.state,
+            'failures': breaker.failures,
+            'trips': breaker.trips,
+            'reopen_at': breaker.reopen_at if breaker.state == self.OPEN else None
+        } for host, breaker in list(self._hosts.items())}
+
+
+class Scheduler:
+    """Runs callbacks after a delay on one background thread.
+
+    Used for retry backoff and breaker probes, so waiting never holds a
+    download worker. The thread starts with the first scheduled call.
+    """
+
+    def __init__(self, name: str = 'retry-scheduler'):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def call_later(self, delay: float, callback: Callable, *args):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), callback, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+                self._thread.start()
+            self._cond.notify()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                if self._stopped:
+                    return
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                main_logger.error(f"Scheduled callback {getattr(callback, '__name__', callback)} failed: {str(e)}",
+                                  exc_info=True)
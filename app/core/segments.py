@@ -0,0 +1,195 @@
+import os
+import threading
+from typing import Callable, List, Optional, Sequence
+import requests
+from app.core.logger import main_logger
+from app.core.fileio import AdaptiveChunkSize, ResponseReader, get_buffer, preallocate, write_all
+
+
+class SegmentError(Exception):
+    """Raised when a byte range cannot be fetched as requested"""
+
+
+class Segment:
+    """A half-open byte range [start, end) of the output file"""
+    __slots__ = ('start', 'position', 'written', 'end')
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.position = start  # next byte claimed for download
+        self.written = start   # bytes before this offset are on disk
+        self.end = end
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.position
+
+    def __repr__(self):
+        return f"Segment({self.start}, {self.written}, {self.end})"
+
+
+def supports_ranges(response: requests.Response) -> bool:
+    """Check whether a response advertises byte-range support for its body"""
+    headers = response.headers
+    if headers.get('accept-ranges', '').lower() != 'bytes':
+        return False
+    if headers.get('content-encoding', 'identity').lower() != 'identity':
+        return False
+    return int(headers.get('content-length', 0)) > 0
+
+
+class SegmentedDownload:
+    """Fetch a file as parallel HTTP byte ranges into one preallocated file.
+
+    Each segment runs in its own thread, up to `connections` at once (the
+    rest wait for a free thread). When a segment finishes, its thread takes
+    a waiting segment or splits the largest remaining one in half and takes
+    over the upper part, so fast connections keep working until the whole
+    file is done.
+    `on_chunk` is called after every write and may block (throttling,
+    pause) or raise (cancel); an exception stops all segments.
+    """
+
+    def __init__(self, url: str, path: str, total_size: int, segments: int = 4,
+                 min_split: int = 1024 * 1024, chunk_size: int = 8192,
+                 max_chunk_size: Optional[int] = None,
+                 on_progress: Optional[Callable[[int], None]] = None,
+                 resume: Optional[Sequence[Sequence[int]]] = None,
+                 on_chunk: Optional[Callable[[int], None]] = None,
+                 session=requests, connections: Optional[int] = None):
+        self.url = url
+        self.path = path
+        self.total_size = total_size
+        self.min_split = min_split
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size or chunk_size
+        self.on_progress = on_progress
+        self.on_chunk = on_chunk
+        self.session = session
+        self.connections = connections
+        self.lock = threading.Lock()
+        self._waiting: List[Segment] = []
+        self.segments: List[Segment] = (
+            [self._restore(*entry) for entry in resume] if resume
+            else self._split(total_size, max(1, segments))
+        )
+        self.downloaded = sum(s.written - s.start for s in self.segments)
+        self.error: Optional[Exception] = None
+
+    def _split(self, total_size: int, count: int) -> List[Segment]:
+        """Divide the file into `count` roughly equal segments"""
+        count = min(count, max(1, total_size // self.min_split))
+        size = total_size // count
+        bounds = [i * size for i in range(count)] + [total_size]
+        return [Segment(bounds[i], bounds[i + 1]) for i in range(count)]
+
+    @staticmethod
+    def _restore(start: int, written: int, end: int) -> Segment:
+        """Rebuild a segment from a saved [start, written, end] entry"""
+        segment = Segment(start, end)
+        segment.position = segment.written = written
+        return segment
+
+    def segment_map(self) -> List[List[int]]:
+        """Snapshot of [start, written, end] for every segment"""
+        with self.lock:
+            return [[s.start, s.written, s.end] for s in self.segments]
+
+    def run(self):
+        """Download all segments and block until the file is complete"""
+        mode = 'r+b' if os.path.exists(self.path) else 'wb'
+        with open(self.path, mode) as f:
+            f.truncate(self.total_size)
+            preallocate(f, self.total_size)
+
+        with self.lock:
+            self._waiting = [s for s in self.segments if s.remaining > 0]
+            count = min(len(self._waiting), self.connections or len(self._waiting))
+        threads = [threading.Thread(target=self._segment_worker, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.error:
+            raise self.error
+        main_logger.info(f"Segmented download finished for {self.url} ({len(self.segments)} segments)")
+
+    def _segment_worker(self):
+        """Fetch waiting segments, then keep stealing work until none is left"""
+        segment = self._next_segment()
+        while segment is not None and self.error is None:
+            try:
+                self._fetch(segment)
+            except Exception as e:
+                with self.lock:
+                    if self.error is None:
+                        self.error = e
+                return
+            segment = self._next_segment()
+
+    def _next_segment(self) -> Optional[Segment]:
+        with self.lock:
+            if self._waiting:
+                return self._waiting.pop(0)
+        return self._steal()
+
+    def _fetch(self, segment: Segment):
+        """Fetch the unclaimed part of a segment"""
+        if segment.remaining <= 0:
+            return
+        headers = {'Range': f'bytes={segment.position}-{segment.end - 1}'}
+        with self.session.get(self.url, headers=headers, stream=True) as response:
+            if response.status_code != 206:
+                raise SegmentError(
+                    f"Expected 206 for range {headers['Range']}, got {response.status_code}"
+                )
+            reader = ResponseReader(response)
+            chunks = AdaptiveChunkSize(self.chunk_size, self.max_chunk_size)
+            buffer = get_buffer(chunks.maximum)
+            size = chunks.size
+            with open(self.path, 'r+b', buffering=0) as f:
+                while True:
+                    # Never read past the segment end; a split may have moved it
+                    n = reader.readinto(buffer[:max(1, min(size, segment.remaining))])
+                    if self.error is not None:
+                        return
+                    if not n:
+                        break
+                    # Claim bytes before writing so a concurrent split never
+                    # hands the same range to another thread.
+                    with self.lock:
+                        offset = segment.position
+                        take = min(n, segment.end - offset)
+                        segment.position += take
+                    if take <= 0:
+                        return
+                    f.seek(offset)
+                    write_all(f, buffer[:take])
+                    with self.lock:
+                        segment.written = offset + take
+                        self.downloaded += take
+                        downloaded = self.downloaded
+                    if self.on_progress:
+                        self.on_progress(downloaded)
+                    if self.on_chunk:
+                        self.on_chunk(take)
+                    if segment.remaining <= 0:
+                        return
+                    size = chunks.next()
+        if segment.remaining > 0:
+            raise SegmentError(f"Connection closed early for range {headers['Range']}")
+
+    def _steal(self) -> Optional[Segment]:
+        """Split the slowest segment and return its upper half"""
+        with self.lock:
+            victim = max(self.segments, key=lambda s: s.remaining)
+            remaining = victim.remaining
+            if remaining < 2 * self.min_split:
+                return None
+            split = victim.position + remaining // 2
+            segment = Segment(split, victim.end)
+            victim.end = split
+            self.segments.append(segment)
+        main_logger.debug(f"Split segment for {self.url} at byte {split}")
+        return segment
@@ -0,0 +1,298 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+from urllib.parse import urlparse
+from app.core.logger import main_logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    host TEXT,
+    caption TEXT,
+    priority INTEGER NOT NULL DEFAULT 5,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    started TEXT,
+    finished TEXT,
+    expected_digest TEXT,
+    expected_size INTEGER,
+    digest TEXT,
+    filename TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_downloads_status ON downloads (status, updated);
+CREATE INDEX IF NOT EXISTS idx_downloads_priority ON downloads (status, priority, created);
+CREATE INDEX IF NOT EXISTS idx_downloads_host ON downloads (host, status);
+CREATE INDEX IF NOT EXISTS idx_downloads_url ON downloads (url);
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER,
+    path TEXT NOT NULL,
+    digest TEXT,
+    checked REAL NOT NULL
+);
+"""
+
+UPSERT_VALIDATOR = """
+INSERT OR REPLACE INTO validators (url, etag, last_modified, size, path, digest, checked)
+VALUES (:url, :etag, :last_modified, :size, :path, :digest, :checked)
+"""
+
+# A finished file moved by post-processing; the digest only stays for a file of the same size
+MOVE_VALIDATOR = """
+UPDATE validators SET path = :path, size = :size,
+    digest = CASE WHEN :is_file AND size = :size THEN digest END
+WHERE url = :url AND path = :old_path
+"""
+
+UPSERT = """
+INSERT INTO downloads (id, url, host, caption, priority, status, progress, error,
+                       started, finished, expected_digest, expected_size, digest,
+                       filename, attempts, created, updated)
+VALUES (:id, :url, :host, :caption, :priority, :status, :progress, :error,
+        :started, :finished, :expected_digest, :expected_size, :digest,
+        :filename, :attempts, :updated, :updated)
+ON CONFLICT (id) DO UPDATE SET
+    url = excluded.url, host = excluded.host, caption = excluded.caption,
+    priority = excluded.priority, status = excluded.status, progress = excluded.progress,
+    error = excluded.error, started = excluded.started, finished = excluded.finished,
+    expected_digest = excluded.expected_digest, expected_size = excluded.expected_size,
+    digest = excluded.digest, filename = excluded.filename, attempts = excluded.attempts,
+    updated = excluded.updated
+"""
+
+# Columns added after the first release, created on older databases at startup
+MIGRATIONS = {
+    'expected_digest': 'TEXT',
+    'expected_size': 'INTEGER',
+    'digest': 'TEXT',
+    'filename': 'TEXT',
+    'attempts': 'INTEGER NOT NULL DEFAULT 0',
+}
+
+# Statuses a restarted manager has to pick up again
+PENDING_STATUSES = ('queued', 'downloading', 'paused', 'retrying', 'deferred')
+
+
+class DownloadStore:
+    """SQLite (WAL mode) record of every download the manager has seen.
+
+    Writes never happen on the caller's thread: `record()` and `delete()`
+    enqueue the change and a single writer thread commits whatever has
+    accumulated as one transaction, keeping only the latest state per
+    download. Reads use a connection per thread, which WAL lets run
+    alongside the writer.
+    """
+
+    def __init__(self, path: str, batch_interval: float = 0.2, batch_size: int = 1000):
+        self.path = path
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        self._pending: queue.Queue = queue.Queue()
+        self._closed = False
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name='download-store')
+        self._writer.start()
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(downloads)')}
+        for column, kind in MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE downloads ADD COLUMN {column} {kind}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def record(self, data: dict):
+        """Queue an insert-or-update of one download's state"""
+        self._pending.put(('upsert', data))
+
+    def record_many(self, rows: List[dict]):
+        """Queue several upserts as one operation"""
+        self._pending.put(('upsert_many', rows))
+
+    def record_validator(self, data: dict):
+        """Queue an update of a URL's cache validators (ETag, Last-Modified, size, path)"""
+        self._pending.put(('validator', data))
+
+    def move_validator(self, url: str, old_path: str, path: str, size: int, is_file: bool):
+        """Queue a change of the file a URL's validators describe, if they still describe `old_path`"""
+        self._pending.put(('move_validator', {
+            'url': url, 'old_path': old_path, 'path': path, 'size': size, 'is_file': is_file
+        }))
+
+    def get_validator(self, url: str) -> Optional[dict]:
+        row = self._connect().execute('SELECT * FROM validators WHERE url = ?', (url,)).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, download_id: str):
+        """Queue removal of one download"""
+        self._pending.put(('delete', download_id))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything recorded so far has been committed"""
+        done = threading.Event()
+        self._pending.put(('flush', done))
+        return done.wait(timeout)
+
+    def close(self):
+        """Commit outstanding changes and stop the writer"""
+        if not self._closed:
+            self._closed = True
+            self._pending.put(('stop', None))
+            self._writer.join()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            ops = [self._pending.get()]
+            deadline = time.monotonic() + self.batch_interval
+            while len(ops) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or ops[-1][0] in ('flush', 'stop'):
+                    break
+                try:
+                    ops.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._apply(conn, ops)
+            except sqlite3.Error as e:
+                conn.rollback()
+                main_logger.error(f"Download store write failed: {str(e)}")
+            for op, arg in ops:
+                if op == 'flush':
+                    arg.set()
+                elif op == 'stop':
+                    conn.close()
+                    return
+
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, ops: list):
+        """Commit one batch, keeping only the last change per download"""
+        changes: Dict[str, Optional[dict]] = {}
+        validators: Dict[str, dict] = {}
+        moves: List[dict] = []
+        for op, arg in ops:
+            if op == 'upsert':
+                changes[arg['id']] = arg
+            elif op == 'upsert_many':
+                for data in arg:
+                    changes[data['id']] = data
+            elif op == 'delete':
+                changes[arg] = None
+            elif op == 'validator':
+                validators[arg['url']] = arg
+            elif op == 'move_validator':
+                pending = validators.get(arg['url'])
+                if pending is None:
+                    moves.append(arg)
+                elif pending['path'] == arg['old_path']:
+                    same = arg['is_file'] and pending['size'] == arg['size']
+                    validators[arg['url']] = dict(pending, path=arg['path'], size=arg['size'],
+                                                  digest=pending['digest'] if same else None)
+        if not changes and not validators and not moves:
+            return
+        now = time.time()
+        upserts = []
+        deletes = []
+        for download_id, data in changes.items():
+            if data is None:
+                deletes.append((download_id,))
+                continue
+            row = dict(data)
+            row['host'] = urlparse(row['url']).hostname
+            row['updated'] = now
+            upserts.append(row)
+        with conn:
+            if upserts:
+                conn.executemany(UPSERT, upserts)
+            if deletes:
+                conn.executemany('DELETE FROM downloads WHERE id = ?', deletes)
+            # Moves apply to earlier batches, so validators recorded in this one replace them
+            if moves:
+                conn.executemany(MOVE_VALIDATOR, moves)
+            if validators:
+                conn.executemany(UPSERT_VALIDATOR, validators.values())
+
+    def load(self, statuses) -> List[dict]:
+        """Rows with the given statuses in dispatch order (priority, then age)"""
+        placeholders = ','.join('?' * len(statuses))
+        rows = self._connect().execute(
+            f"SELECT * FROM downloads WHERE status IN ({placeholders}) "
+            f"ORDER BY priority, created",
+            tuple(statuses)
+        )
+        return [dict(row) for row in rows]
+
+    def history(self, status: Optional[str] = None, host: Optional[str] = None,
+                offset: int = 0, limit: int = 100) -> List[dict]:
+        """Most recently updated downloads, one page at a time"""
+        clauses = []
+        params: list = []
+        if status:
+            clauses.append('status = ?')
+            params.append(status)
+        if host:
+            clauses.append('host = ?')
+            params.append(host)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ''
+        rows = self._connect().execute(
+            f"SELECT * FROM downloads {where}ORDER BY updated DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset)
+        )
+        return [dict(row) for row in rows]
+
+    def find_urls(self, urls: List[str], statuses) -> Set[str]:
+        """Which of `urls` have a record in one of `statuses`"""
+        if not urls:
+            return set()
+        url_marks = ','.join('?' * len(urls))
+        status_marks = ','.join('?' * len(statuses))
+        rows = self._connect().execute(
+            f"SELECT url FROM downloads WHERE url IN ({url_marks}) AND status IN ({status_marks})",
+            (*urls, *statuses)
+        )
+        return {row[0] for row in rows}
+
+    def find(self, url: str, status: Optional[str] = None, exclude: Iterable[str] = ()) -> Optional[dict]:
+        """The most recently updated record of a URL, optionally only in one status or not one of `exclude` ids"""
+        query = 'SELECT * FROM downloads WHERE url = ?'
+        params: list = [url]
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        exclude = list(exclude)
+        if exclude:
+            query += f" AND id NOT IN ({','.join('?' * len(exclude))})"
+            params += exclude
+        row = self._connect().execute(f"{query} ORDER BY updated DESC LIMIT 1", params).fetchone()
+        return dict(row) if row else None
+
+    def count_by_status(self) -> Dict[str, int]:
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM downloads GROUP BY status')
+        return {status: count for status, count in rows}
@@ -1,17 +1,46 @@
 import os
 from typing import Optional, Callable
-from pyrogram import Client, errors
-from pyrogram.types import Message
-from pyrogram.errors import RPCError, UnknownError, AuthKeyUnregistered, SessionPasswordNeeded
-from pyrogram.enums import ParseMode
+from app.core.fileio import ProgressThrottle
 from app.core.logger import main_logger
 from app.config import Config
 
+# Largest document Telegram accepts from a user account
+MAX_UPLOAD_SIZE = 2000 * 1024 * 1024
+
+
+def load_backend(name: str):
+    """Client class, errors module and HTML parse mode for a client backend.
+
+    pyrogram is imported on first use so the rest of the application (and
+    the 'stub' backend used offline) runs without it installed.
+    """
+    if name == 'stub':
+        from app.core import telegram_stub
+        return telegram_stub.Client, telegram_stub, 'html'
+    from pyrogram import Client, errors
+    from pyrogram.enums import ParseMode
+    return Client, errors, ParseMode.HTML
+
+
+def flood_wait(error: Exception) -> Optional[float]:
+    """Seconds Telegram asked us to wait if `error` is a flood limit (420), else None"""
+    value = getattr(error, 'value', None)
+    if getattr(error, 'CODE', None) == 420 and isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+
 class TelegramNotifier:
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None):
         self.enabled = Config.TELEGRAM_ENABLED
+        self.backend = backend or Config.TELEGRAM_CLIENT
+        self.client = None
+        # Exception types resolve against the stub until a real backend loads
+        from app.core import telegram_stub as errors
+        self.errors = errors
         if self.enabled:
             try:
+                Client, self.errors, self.parse_mode = load_backend(self.backend)
                 session_file = os.path.join(Config.SESSION_DIR, Config.TELEGRAM_SESSION_NAME)
                 self.client = Client(
                     name=session_file,
@@ -21,13 +50,12 @@ class TelegramNotifier:
                     workdir=Config.SESSION_DIR
                 )
                 self.chat_id = Config.TELEGRAM_CHAT_ID
-                main_logger.info("Telegram notifications enabled")
+                main_logger.info(f"Telegram notifications enabled ({self.backend} client)")
             except Exception as e:
                 self.enabled = False
                 self.client = None
                 main_logger.error(f"Failed to initialize Telegram client: {str(e)}")
         else:
-            self.client = None
             main_logger.info("Telegram notifications disabled")
 
     async def start(self):
@@ -43,18 +71,18 @@ class TelegramNotifier:
             # Verify chat_id is valid
             try:
                 await self.client.get_chat(self.chat_id)
-            except RPCError as e:
+            except self.errors.RPCError as e:
                 main_logger.error(f"Invalid chat_id {self.chat_id}: {str(e)}")
                 self.enabled = False
                 await self.stop()
                 return False
                 
             return True
-        except SessionPasswordNeeded:
+        except self.errors.SessionPasswordNeeded:
             main_logger.error("Two-factor authentication required. Please disable it or use session string.")
             self.enabled = False
             return False
-        except AuthKeyUnregistered:
+        except self.errors.AuthKeyUnregistered:
             main_logger.error("Session expired. Please remove the session file and restart.")
             self.enabled = False
             return False
@@ -73,7 +101,7 @@ class TelegramNotifier:
                 main_logger.error(f"Error stopping Telegram client: {str(e)}")
 
     async def send_message(self, message: str, reply_to: Optional[int] = None) -> Optional[int]:
-        """Send a message via telegram"""
+        """Send a message via telegram; flood limits are raised for the caller to wait out"""
         if not self.enabled or not self.client:
             return None
             
@@ -81,12 +109,14 @@ class TelegramNotifier:
             msg = await self.client.send_message(
                 chat_id=self.chat_id,
                 text=message,
-                parse_mode=ParseMode.HTML,
+                parse_mode=self.parse_mode,
                 reply_to_message_id=reply_to,
                 disable_web_page_preview=True
             )
             return msg.id
-        except RPCError as e:
+        except self.errors.RPCError as e:
+            if flood_wait(e) is not None:
+                raise
             main_logger.error(f"Failed to send telegram message: {str(e)}")
             return None
 
@@ -97,8 +127,8 @@ class TelegramNotifier:
             message += f"\n<b>Caption:</b> {caption}"
         return await self.send_message(message)
 
-    async def notify_download_completed(self, url: str, caption: str = "", file_path: str = None, reply_to: Optional[int] = None) -> None:
-        """Notify when a download completes and optionally send the file"""
+    async def notify_download_completed(self, url: str, caption: str = "", file_path: str = None, reply_to: Optional[int] = None) -> Optional[int]:
+        """Notify when a download completes and optionally send the file; returns the message id"""
         message = f"✅ Download Completed\n<b>URL:</b> {url}"
         if caption:
             message += f"\n<b>Caption:</b> {caption}"
@@ -111,46 +141,65 @@ class TelegramNotifier:
             try:
                 # Calculate file size
                 file_size = os.path.getsize(file_path)
-                if file_size > 2000 * 1024 * 1024:  # 2GB limit for Telegram
+                if file_size > MAX_UPLOAD_SIZE:
                     await self.send_message(
                         f"⚠️ File too large to send via Telegram ({file_size/(1024*1024*1024):.1f} GB)",
                         msg_id
                     )
-                    return
+                    return msg_id
 
                 progress_message = await self.send_message("📤 Uploading file to Telegram...")
+                throttle = ProgressThrottle(Config.TELEGRAM_EDIT_INTERVAL)
                 
                 async def progress(current: int, total: int):
-                    if total > 0:
+                    if total > 0 and progress_message and throttle.due():
                         percentage = (current * 100) / total
                         try:
-                            await self.client.edit_message_text(
-                                chat_id=self.chat_id,
-                                message_id=progress_message,
-                                text=f"📤 Uploading: {percentage:.1f}% ({current/(1024*1024):.1f}/{total/(1024*1024):.1f} MB)"
+                            await self.edit_message(
+                                progress_message,
+                                f"📤 Uploading: {percentage:.1f}% ({current/(1024*1024):.1f}/{total/(1024*1024):.1f} MB)"
                             )
-                        except RPCError:
-                            pass  # Ignore errors from too many edits
-
-                await self.client.send_document(
-                    chat_id=self.chat_id,
-                    document=file_path,
-                    caption=caption or url,
-                    progress=progress,
-                    reply_to_message_id=msg_id,
-                    force_document=True  # Always send as file, not media
-                )
+                        except self.errors.RPCError as e:
+                            # Flood limited: skip edits until the wait is over
+                            throttle.hold(flood_wait(e) or 0)
+
+                await self.send_file(file_path, caption or url, msg_id, progress)
                 
                 # Delete the progress message
-                try:
-                    await self.client.delete_messages(self.chat_id, progress_message)
-                except RPCError:
-                    pass
+                if progress_message:
+                    await self.delete_message(progress_message)
                 
-            except RPCError as e:
+            except self.errors.RPCError as e:
                 error_msg = f"Failed to send file via Telegram: {str(e)}"
                 main_logger.error(error_msg)
                 await self.send_message(f"❌ {error_msg}", msg_id)
+        return msg_id
+
+    async def send_file(self, file_path, caption: str, reply_to: Optional[int] = None,
+                        progress: Optional[Callable] = None, file_name: Optional[str] = None) -> Optional[int]:
+        """Upload a path or binary file object as a document; errors, including flood limits, are raised"""
+        if not self.enabled or not self.client:
+            return None
+        msg = await self.client.send_document(
+            chat_id=self.chat_id,
+            document=file_path,
+            caption=caption,
+            file_name=file_name,
+            progress=progress,
+            reply_to_message_id=reply_to,
+            force_document=True  # Always send as file, not media
+        )
+        return msg.id
+
+    async def delete_message(self, message_id: int) -> bool:
+        """Delete a message, ignoring failures"""
+        if not self.enabled or not self.client:
+            return False
+        try:
+            await self.client.delete_messages(self.chat_id, message_id)
+            return True
+        except self.errors.RPCError:
+            return False
 
     async def notify_download_failed(self, url: str, error: str, caption: str = "", reply_to: Optional[int] = None) -> None:
         """Notify when a download fails"""
@@ -160,7 +209,7 @@ class TelegramNotifier:
         await self.send_message(message, reply_to)
 
     async def edit_message(self, message_id: int, new_text: str) -> bool:
-        """Edit an existing message"""
+        """Edit an existing message; flood limits are raised for the caller to wait out"""
         if not self.enabled or not self.client:
             return False
             
@@ -169,17 +218,16 @@ class TelegramNotifier:
                 chat_id=self.chat_id,
                 message_id=message_id,
                 text=new_text,
-                parse_mode=ParseMode.HTML,
+                parse_mode=self.parse_mode,
                 disable_web_page_preview=True
             )
             return True
-        except RPCError as e:
+        except self.errors.RPCError as e:
+            if flood_wait(e) is not None:
+                raise
             main_logger.error(f"Failed to edit telegram message: {str(e)}")
             return False
 
     def is_enabled(self) -> bool:
         """Check if notifications are enabled and client is ready"""
         return self.enabled and self.client is not None
-
-# Create a global instance
-notifier = TelegramNotifier() 
\ No newline at end of file
@@ -0,0 +1,441 @@
+import asyncio
+import html
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Set
+from app.core.fileio import FileSlice, ProgressThrottle
+from app.core.logger import main_logger
+from app.core.telegram import MAX_UPLOAD_SIZE, TelegramNotifier, flood_wait
+
+# Item statuses that produce a notification, with their digest headings
+NOTIFY_STATUSES = {'downloading': '📥 Started', 'completed': '✅ Completed', 'failed': '❌ Failed'}
+
+# Telegram rejects longer messages
+MAX_MESSAGE_LENGTH = 4096
+
+# Upper bound for the extra wait added after repeated flood limits
+MAX_BACKOFF = 60.0
+
+
+def pack_lines(lines: List[str], limit: int = MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    """Join lines into as few messages as fit within Telegram's length limit"""
+    message: List[str] = []
+    length = 0
+    for line in lines:
+        if message and length + len(line) + 1 > limit:
+            yield '\n'.join(message)
+            message, length = [], 0
+        message.append(line)
+        length += len(line) + 1
+    if message:
+        yield '\n'.join(message)
+
+
+class SplitUpload:
+    """A file uploaded as numbered parts, read in place through one descriptor.
+
+    Part `i` covers bytes [i * part_size, (i + 1) * part_size) and is named
+    `<name>.001`, `<name>.002`, ... so the parts concatenate back in order.
+    `early` holds the parts that were started before the download finished.
+    """
+
+    def __init__(self, fd: int, name: str, size: int, part_size: int):
+        self.fd = fd
+        self.name = name
+        self.size = size
+        self.part_size = part_size
+        self.count = math.ceil(size / part_size)
+        self.tasks: Dict[int, asyncio.Future] = {}
+        self.early: Set[int] = set()
+
+    def part(self, index: int, algorithm: str) -> FileSlice:
+        offset = index * self.part_size
+        return FileSlice(self.fd, offset, min(self.part_size, self.size - offset),
+                         f"{self.name}.{index + 1:03d}", algorithm)
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        os.close(self.fd)
+
+
+class TelegramDispatcher:
+    """Deliver download notifications to Telegram without blocking workers.
+
+    `on_event` is an EventBus listener: on the worker's thread it only
+    appends to a bounded deque. A dedicated thread runs an asyncio loop that
+    owns the Telegram client and sends at most one API call per
+    `message_interval`. Events that pile up meanwhile go out as one digest
+    once more than `digest_threshold` are waiting. A FloodWait pauses all
+    calls for the requested time plus an exponential backoff before the call
+    is retried. Upload progress edits are limited to one per `edit_interval`
+    and skipped while a flood wait is in effect.
+
+    Up to `upload_concurrency` uploads run at once. Files larger than
+    `part_size` are sent as parts straight from the file, followed by a
+    manifest of part checksums. `on_written` lets the parts a large download
+    has already finished start uploading while it fetches the rest.
+    """
+
+    def __init__(self, notifier_factory: Callable[[], TelegramNotifier] = TelegramNotifier,
+                 message_interval: float = 1.0, edit_interval: float = 5.0,
+                 digest_threshold: int = 5, max_pending: int = 10000,
+                 send_files: bool = True, progress_min_size: int = 0, max_retries: int = 5,
+                 split_uploads: bool = True, part_size: int = MAX_UPLOAD_SIZE,
+                 upload_concurrency: int = 2, algorithm: str = 'sha256'):
+        self.message_interval = message_interval
+        self.edit_interval = edit_interval
+        self.digest_threshold = digest_threshold
+        self.max_pending = max_pending
+        self.send_files = send_files
+        self.progress_min_size = progress_min_size
+        self.max_retries = max_retries
+        self.split_uploads = split_uploads
+        self.part_size = min(part_size, MAX_UPLOAD_SIZE)
+        self.upload_concurrency = max(1, upload_concurrency)
+        self.algorithm = algorithm
+        self.notifier: Optional[TelegramNotifier] = None
+        self.calls = 0
+        self.digests = 0
+        self.flood_waits = 0
+        self.dropped = 0
+        self._notifier_factory = notifier_factory
+        self._pending: deque = deque()
+        self._signalled = False
+        self._closed = False
+        # Message id of each in-flight download's start notification, for replies
+        self._threads: Dict[str, int] = {}
+        self._last_status: Dict[str, str] = {}
+        self._next_call = 0.0
+        self._flood_until = 0.0
+        self._backoff = 0.0
+        self._editing = False
+        # Parts of each large transfer known to be on disk (written by worker threads)
+        self._ready_parts: Dict[str, int] = {}
+        self._splits: Dict[str, SplitUpload] = {}
+        self._loop = asyncio.new_event_loop()
+        self._wake = asyncio.Event()
+        self._uploads: asyncio.Queue = asyncio.Queue()
+        self._upload_slots = asyncio.Semaphore(self.upload_concurrency)
+        self._thread = threading.Thread(target=self._run, daemon=True, name='telegram-dispatch')
+        self._thread.start()
+
+    def on_event(self, event_type: str, data: dict):
+        """EventBus listener; never blocks the publishing thread"""
+        if event_type != 'state' or self._closed:
+            return
+        if data['status'] not in NOTIFY_STATUSES:
+            if data['status'] == 'cancelled' and data['id'] in self._ready_parts:
+                self._loop.call_soon_threadsafe(self._abandon, data['id'])
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(data)
+        if not self._signalled:
+            self._signalled = True
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def on_written(self, item_id: str, filename: str, path: str, written: int, size: int):
+        """Progress hook: `path` is final up to `written` bytes of `size`, destined for `filename`.
+
+        Parts of a file that will be split are queued for upload as soon as
+        they are complete, rather than after the whole download.
+        """
+        if not (self.split_uploads and self.send_files) or size <= self.part_size or self._closed:
+            return
+        ready = written // self.part_size
+        if ready > self._ready_parts.get(item_id, 0):
+            self._ready_parts[item_id] = ready
+            self._loop.call_soon_threadsafe(self._start_parts, item_id, filename, path, size, ready)
+
+    def close(self, timeout: float = 5.0):
+        """Send what is already pending (within `timeout`) and stop the client"""
+        if not self._closed:
+            self._closed = True
+            self._loop.call_soon_threadsafe(self._wake.set)
+            self._thread.join(timeout)
+
+    def get_stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'uploads': self._uploads.qsize(),
+            'split_uploads': len(self._splits),
+            'calls': self.calls,
+            'digests': self.digests,
+            'flood_waits': self.flood_waits,
+            'dropped': self.dropped
+        }
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        # The client is created here so it belongs to this thread's loop
+        self.notifier = self._notifier_factory()
+        if not await self.notifier.start():
+            main_logger.warning("Telegram dispatcher not started: client unavailable")
+            self._closed = True
+            return
+        uploaders = [asyncio.ensure_future(self._upload_loop()) for _ in range(self.upload_concurrency)]
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            self._signalled = False
+            batch = self._take_pending()
+            if batch:
+                try:
+                    await self._deliver(batch)
+                except Exception as e:
+                    main_logger.error(f"Telegram dispatch failed: {str(e)}", exc_info=True)
+            if self._closed:
+                break
+        for uploader in uploaders:
+            uploader.cancel()
+        for item_id in list(self._splits):
+            self._abandon(item_id)
+        await self.notifier.stop()
+
+    def _take_pending(self) -> List[dict]:
+        """Drain the event deque, dropping repeats of an item's current status"""
+        batch = []
+        while self._pending:
+            data = self._pending.popleft()
+            if self._last_status.get(data['id']) == data['status']:
+                continue
+            if data['status'] == 'downloading':
+                self._last_status[data['id']] = data['status']
+            else:
+                self._last_status.pop(data['id'], None)
+            if data['status'] == 'failed':
+                self._abandon(data['id'])
+            batch.append(data)
+        return batch
+
+    async def _deliver(self, batch: List[dict]):
+        if len(batch) > self.digest_threshold:
+            await self._send_digest(batch)
+            return
+        for data in batch:
+            await self._send_one(data)
+
+    async def _send_one(self, data: dict):
+        url, caption = data['url'], data['caption'] or ''
+        if data['status'] == 'downloading':
+            msg_id = await self._call(self.notifier.notify_download_started, url, caption)
+            if msg_id:
+                self._threads[data['id']] = msg_id
+            return
+        reply_to = self._threads.pop(data['id'], None)
+        if data['status'] == 'completed':
+            msg_id = await self._call(self.notifier.notify_download_completed, url, caption, None, reply_to)
+            self._queue_upload(data, msg_id)
+        else:
+            await self._call(self.notifier.notify_download_failed, url, data['error'] or 'Unknown error',
+                             caption, reply_to)
+
+    async def _send_digest(self, batch: List[dict]):
+        """One message summarising a burst of events, latest status per download"""
+        latest = {data['id']: data for data in batch}
+        groups: Dict[str, List[dict]] = {status: [] for status in NOTIFY_STATUSES}
+        for data in latest.values():
+            groups[data['status']].append(data)
+            if data['status'] != 'downloading':
+                self._threads.pop(data['id'], None)
+        summary = ', '.join(f"{len(items)} {status}" for status, items in groups.items() if items)
+        lines = [f"📦 <b>Download digest</b>: {summary}"]
+        # Leave room for the headings and "and N more" lines of every group
+        budget = MAX_MESSAGE_LENGTH - len(lines[0]) - 80 * len(groups)
+        for status, items in groups.items():
+            if not items:
+                continue
+            lines.append(f"\n<b>{NOTIFY_STATUSES[status]} ({len(items)})</b>")
+            for shown, data in enumerate(items):
+                line = f"• {html.escape(data['caption'] or data['url'])}"
+                if status == 'failed' and data['error']:
+                    line += f" — {html.escape(data['error'][:100])}"
+                if len(line) + 1 > budget:
+                    lines.append(f"… and {len(items) - shown} more")
+                    break
+                lines.append(line)
+                budget -= len(line) + 1
+        msg_id = await self._call(self.notifier.send_message, '\n'.join(lines))
+        self.digests += 1
+        for data in groups['completed']:
+            self._queue_upload(data, msg_id)
+
+    async def _call(self, method, *args):
+        """Await one notifier call, paced to message_interval and retried after a FloodWait"""
+        for _ in range(self.max_retries + 1):
+            now = time.monotonic()
+            slot = max(now, self._next_call)
+            self._next_call = slot + self.message_interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            try:
+                result = await method(*args)
+            except Exception as e:
+                wait = flood_wait(e)
+                if wait is None:
+                    raise
+                self._flood(wait)
+                continue
+            self._backoff = 0.0
+            self.calls += 1
+            return result
+        main_logger.error(f"Telegram {method.__name__} dropped after {self.max_retries} flood waits")
+        return None
+
+    def _flood(self, wait: float):
+        """Hold every call for Telegram's wait plus a backoff that doubles while floods repeat"""
+        self.flood_waits += 1
+        self._backoff = min(max(self._backoff * 2, 1.0), MAX_BACKOFF)
+        self._flood_until = time.monotonic() + wait + self._backoff
+        self._next_call = max(self._next_call, self._flood_until)
+        main_logger.warning(f"Telegram flood limit: pausing notifications for {wait + self._backoff:.0f}s")
+
+    def _queue_upload(self, data: dict, reply_to: Optional[int]):
+        path = data.get('filename')
+        if self.send_files and path and os.path.exists(path):
+            self._uploads.put_nowait((data, reply_to))
+
+    async def _upload_loop(self):
+        while True:
+            data, reply_to = await self._uploads.get()
+            try:
+                await self._upload(data, reply_to)
+            except Exception as e:
+                main_logger.error(f"Telegram upload failed for {data['url']}: {str(e)}")
+                await self._call(self.notifier.send_message,
+                                 f"❌ Failed to send file via Telegram: {html.escape(str(e))}", reply_to)
+
+    async def _upload(self, data: dict, reply_to: Optional[int]):
+        path = data['filename']
+        size = os.path.getsize(path)
+        if size > self.part_size and self.split_uploads:
+            await self._upload_split(data, size, reply_to)
+            return
+        if size > MAX_UPLOAD_SIZE:
+            await self._call(self.notifier.send_message,
+                             f"⚠️ File too large to send via Telegram ({size/(1024*1024*1024):.1f} GB)", reply_to)
+            return
+        progress_message = None
+        if size >= self.progress_min_size:
+            progress_message = await self._call(self.notifier.send_message, "📤 Uploading file to Telegram...")
+        progress = self._progress_editor(progress_message) if progress_message else None
+        async with self._upload_slots:
+            await self._call(self.notifier.send_file, path, data['caption'] or data['url'], reply_to, progress)
+        if progress_message:
+            await self._call(self.notifier.delete_message, progress_message)
+
+    def _start_parts(self, item_id: str, filename: str, path: str, size: int, ready: int):
+        """Start uploading the first `ready` parts of a transfer that is still running"""
+        split = self._splits.get(item_id)
+        if split is None:
+            try:
+                # The descriptor stays valid when the .part file is renamed into place
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                return
+            split = self._splits[item_id] = SplitUpload(fd, os.path.basename(filename), size, self.part_size)
+        for index in range(min(ready, split.count)):
+            if index not in split.tasks:
+                split.early.add(index)
+                split.tasks[index] = asyncio.ensure_future(
+                    self._upload_part(split, index, self._threads.get(item_id))
+                )
+
+    def _abandon(self, item_id: str):
+        """Stop early part uploads of a transfer that failed or was cancelled"""
+        self._ready_parts.pop(item_id, None)
+        split = self._splits.pop(item_id, None)
+        if split is not None:
+            split.close()
+
+    async def _upload_part(self, split: SplitUpload, index: int, reply_to: Optional[int]) -> str:
+        """Upload one part and return its checksum, computed while it was read"""
+        part = split.part(index, self.algorithm)
+        async with self._upload_slots:
+            msg_id = await self._call(self.notifier.send_file, part, f"{part.name} ({index + 1}/{split.count})",
+                                      reply_to, None, part.name)
+        if msg_id is None:
+            raise IOError(f"{part.name} was not uploaded")
+        return part.hexdigest()
+
+    async def _upload_split(self, data: dict, size: int, reply_to: Optional[int]):
+        """Upload a large file as parts (reusing any started early), then its manifest"""
+        self._ready_parts.pop(data['id'], None)
+        split = self._splits.pop(data['id'], None)
+        if split is not None and split.size != size:
+            split.close()
+            split = None
+        if split is None:
+            split = SplitUpload(os.open(data['filename'], os.O_RDONLY),
+                                os.path.basename(data['filename']), size, self.part_size)
+        try:
+            for index in range(split.count):
+                if index not in split.tasks:
+                    split.tasks[index] = asyncio.ensure_future(self._upload_part(split, index, reply_to))
+            checksums = await asyncio.gather(*(split.tasks[index] for index in range(split.count)))
+            # Parts sent before the download finished are checked against the final file,
+            # in case a range was fetched again after they went out
+            for index in sorted(split.early):
+                final = await self._loop.run_in_executor(None, split.part(index, self.algorithm).hexdigest)
+                if final != checksums[index]:
+                    main_logger.warning(f"Part {index + 1} of {split.name} changed after upload, sending it again")
+                    checksums[index] = await self._upload_part(split, index, reply_to)
+            await self._send_manifest(data, split, checksums, reply_to)
+        finally:
+            split.close()
+
+    async def _send_manifest(self, data: dict, split: SplitUpload, checksums: List[str],
+                             reply_to: Optional[int]):
+        name = html.escape(split.name)
+        lines = [
+            f"🧩 <b>{name}</b>: {split.size/(1024*1024):.1f} MB in {split.count} parts",
+            f"<b>URL:</b> {html.escape(data['url'])}"
+        ]
+        if data.get('digest'):
+            lines.append(f"<b>Digest:</b> <code>{data['digest']}</code>")
+        for index, checksum in enumerate(checksums):
+            part = split.part(index, self.algorithm)
+            lines.append(f"• <code>{html.escape(part.name)}</code> {part.length/(1024*1024):.1f} MB "
+                         f"{self.algorithm}:<code>{checksum}</code>")
+        lines.append(f"Join with: <code>cat {name}.[0-9][0-9][0-9] &gt; {name}</code>")
+        for text in pack_lines(lines):
+            await self._call(self.notifier.send_message, text, reply_to)
+
+    def _progress_editor(self, message_id: int):
+        """Upload progress callback that edits `message_id` at most once per edit_interval"""
+        throttle = ProgressThrottle(self.edit_interval)
+        throttle.due()
+
+        async def progress(current: int, total: int):
+            if total <= 0 or self._editing or time.monotonic() < self._flood_until or not throttle.due():
+                return
+            text = f"📤 Uploading: {current * 100 / total:.1f}% ({current/(1024*1024):.1f}/{total/(1024*1024):.1f} MB)"
+            # Edit in the background so the upload itself never waits on it
+            self._editing = True
+            asyncio.ensure_future(self._edit(message_id, text))
+
+        return progress
+
+    async def _edit(self, message_id: int, text: str):
+        try:
+            await self.notifier.edit_message(message_id, text)
+            self.calls += 1
+        except Exception as e:
+            wait = flood_wait(e)
+            if wait is None:
+                main_logger.debug(f"Progress edit failed: {str(e)}")
+            else:
+                self._flood(wait)
+        finally:
+            self._editing = False
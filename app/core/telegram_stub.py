@@ -0,0 +1,99 @@
+import asyncio
+import inspect
+import itertools
+import os
+from collections import deque
+from types import SimpleNamespace
+from app.core.logger import main_logger
+
+
+class RPCError(Exception):
+    CODE = None
+
+
+class FloodWait(RPCError):
+    CODE = 420
+
+    def __init__(self, value: int):
+        self.value = value
+        super().__init__(f"FLOOD_WAIT_X: A wait of {value} seconds is required")
+
+
+class AuthKeyUnregistered(RPCError):
+    CODE = 401
+
+
+class SessionPasswordNeeded(RPCError):
+    CODE = 401
+
+
+class Client:
+    """Offline stand-in for the parts of pyrogram's Client the notifier uses.
+
+    Every successful call is appended to `calls` as (method, kwargs) instead
+    of reaching Telegram. Values pushed onto `flood_waits` are raised as
+    FloodWait from the next calls, `latency` adds a delay per call and
+    `upload_delay` one per uploaded chunk.
+    """
+
+    def __init__(self, name=None, api_id=None, api_hash=None, phone_number=None, workdir=None, **kwargs):
+        self.name = name
+        self.calls = []
+        self.flood_waits = deque()
+        self.latency = 0.0
+        self.upload_delay = 0.0
+        self.upload_chunk = 512 * 1024
+        self._ids = itertools.count(1)
+
+    async def _api(self, method: str, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_waits:
+            raise FloodWait(self.flood_waits.popleft())
+        self.calls.append((method, kwargs))
+        main_logger.debug(f"Telegram stub: {method} {kwargs}")
+        return SimpleNamespace(id=next(self._ids))
+
+    async def start(self):
+        return self
+
+    async def stop(self):
+        return self
+
+    async def get_me(self):
+        return SimpleNamespace(id=0, first_name='stub')
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(id=chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._api('send_message', chat_id=chat_id, text=text, **kwargs)
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        return await self._api('edit_message_text', chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        return await self._api('delete_messages', chat_id=chat_id, message_ids=message_ids, **kwargs)
+
+    async def send_document(self, chat_id, document, progress=None, **kwargs):
+        """Reads the whole document, as an upload would, reporting progress per chunk"""
+        if isinstance(document, str):
+            with open(document, 'rb') as f:
+                return await self._upload(chat_id, document, f, progress, **kwargs)
+        return await self._upload(chat_id, document, document, progress, **kwargs)
+
+    async def _upload(self, chat_id, document, f, progress, **kwargs):
+        total = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        current = 0
+        while True:
+            chunk = f.read(self.upload_chunk)
+            if not chunk:
+                break
+            current += len(chunk)
+            if progress:
+                result = progress(current, total)
+                if inspect.isawaitable(result):
+                    await result
+            await asyncio.sleep(self.upload_delay)
+        return await self._api('send_document', chat_id=chat_id, document=document, size=current, **kwargs)
@@ -0,0 +1,237 @@
+"""Download worker for the distributed engine.
+
+Leases queued items from a coordinator (DOWNLOAD_ENGINE=distributed) and
+runs them with the threaded engine's transfer code, reporting progress in
+heartbeats and each outcome when it ends. Start as many as wanted, here or
+on other hosts sharing the coordinator's TCP address:
+
+    python -m app.core.worker --coordinator tcp://10.0.0.5:7070 --concurrency 8
+"""
+import argparse
+import os
+import re
+import socket
+import threading
+from typing import Dict, Optional, Tuple
+from app.config import Config
+from app.core.logger import main_logger, set_log_suffix
+from app.core.coordinator import CoordinatorClient, CoordinatorError
+from app.core.download_manager import DownloadManager, DownloadItem
+
+# Outcomes reported as they are; anything else was a failure the engine did not classify
+REPORTED_STATUSES = ('completed', 'skipped_unchanged', 'cancelled', 'failed')
+
+
+class _LeaseValidators:
+    """Stands in for the store: validators arrive with a lease and go back with its result"""
+
+    def __init__(self):
+        self.leased: Dict[str, dict] = {}
+        self.recorded: Dict[str, dict] = {}
+
+    def get_validator(self, url: str) -> Optional[dict]:
+        return self.leased.get(url)
+
+    def record_validator(self, validator: dict):
+        self.recorded[validator['url']] = validator
+
+
+class _WorkerEngine(DownloadManager):
+    """The threaded engine's transfer code with queueing and retry decisions left to the coordinator"""
+
+    def __init__(self, concurrency: int, bandwidth_limit: int):
+        super().__init__(max_workers=concurrency, bandwidth_limit=bandwidth_limit)
+        self.store = _LeaseValidators()
+        self.outcomes: Dict[str, Tuple[str, bool, Optional[float]]] = {}
+        self._received: Dict[str, int] = {}  # item id -> bytes not yet reported
+        self._received_lock = threading.Lock()
+
+    def _start_workers(self):
+        """Transfers run on the RemoteWorker's lease threads"""
+
+    def _after_chunk(self, item: DownloadItem, host: Optional[str], nbytes: int):
+        with self._received_lock:
+            self._received[item.id] = self._received.get(item.id, 0) + nbytes
+        super()._after_chunk(item, host, nbytes)
+
+    def take_received(self, item_id: str) -> int:
+        """Bytes received for an item since the last call"""
+        with self._received_lock:
+            return self._received.pop(item_id, 0)
+
+    def _settle_failure(self, item: DownloadItem, error_class: str, retryable: bool,
+                        retry_after: Optional[float]):
+        """Keep the classification for the coordinator, which decides on retries"""
+        self.outcomes[item.id] = (error_class, retryable, retry_after)
+        self.active_downloads.pop(item.url, None)
+        self._set_status(item, "failed")
+
+
+class RemoteWorker:
+    """Runs `concurrency` transfers at a time for a coordinator.
+
+    Each lease thread keeps its own connection and long-polls for work; a
+    single heartbeat thread renews every lease it holds and applies the
+    pause and cancel requests that come back. If the coordinator drops a
+    lease (it expired while this worker was unreachable), the transfer is
+    cancelled, since the item has been handed to someone else.
+    """
+
+    def __init__(self, address: str, name: str, concurrency: int, token: Optional[str] = None):
+        self.address = address
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.token = token
+        self.engine = _WorkerEngine(self.concurrency, Config.DEFAULT_BANDWIDTH_LIMIT)
+        self._leases: Dict[str, DownloadItem] = {}  # lease id -> item
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self):
+        """Serve the coordinator until stop() is called"""
+        main_logger.info(f"Worker {self.name} serving {self.address} with {self.concurrency} transfers")
+        threads = [threading.Thread(target=self._lease_loop, daemon=True, name=f'lease-{i + 1}')
+                   for i in range(self.concurrency)]
+        threads.append(threading.Thread(target=self._heartbeat_loop, daemon=True, name='heartbeat'))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        self._stop.set()
+
+    def _client(self) -> CoordinatorClient:
+        return CoordinatorClient(self.address, self.token, timeout=Config.LEASE_TIMEOUT + 30)
+
+    def _lease_loop(self):
+        client = self._client()
+        delay = 1.0
+        while not self._stop.is_set():
+            try:
+                reply = client.call('lease', worker=self.name, wait=Config.LEASE_TIMEOUT / 2)
+                delay = 1.0
+                if reply['lease'] is None:
+                    continue
+                outcome = self._run(reply['lease'], reply['item'], reply.get('validator'), reply.get('limits'))
+                client.call('result', lease=reply['lease'], **outcome)
+            except (OSError, ValueError, CoordinatorError) as e:
+                main_logger.warning(f"Coordinator {self.address} unavailable: {str(e)}; retrying in {delay:.0f}s")
+                client.close()
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30)
+        client.close()
+
+    def _run(self, lease_id: str, fields: dict, validator: Optional[dict], limits: Optional[dict]) -> dict:
+        """Run one leased transfer and describe how it ended"""
+        engine = self.engine
+        item = DownloadItem(fields['url'], fields['caption'], fields['priority'],
+                            expected_digest=fields['expected_digest'],
+                            expected_size=fields['expected_size'],
+                            attempts=fields['attempts'] - 1, id=fields['id'])
+        if validator is not None:
+            engine.store.leased[item.url] = validator
+        self._apply_limits(item, limits)
+        with self._lock:
+            self._leases[lease_id] = item
+        try:
+            engine._process_download(item)
+        except Exception as e:
+            main_logger.error(f"Worker {self.name} error on {item.url}: {str(e)}", exc_info=True)
+            item.error = str(e)
+        finally:
+            with self._lock:
+                self._leases.pop(lease_id, None)
+            engine.active_downloads.pop(item.url, None)
+            engine.store.leased.pop(item.url, None)
+            engine.rate_limiter.set_item_limit(item.url, 0)
+            engine.history.pop(item.url)
+        outcome = {
+            'status': item.status,
+            'filename': item.filename,
+            'digest': item.digest,
+            'bytes': engine.take_received(item.id),
+            'validator': engine.store.recorded.pop(item.url, None)
+        }
+        if item.status == 'completed' and item.filename and os.path.exists(item.filename):
+            outcome['size'] = os.path.getsize(item.filename)
+        if item.status not in REPORTED_STATUSES:
+            outcome['status'] = 'failed'
+            engine.outcomes[item.id] = ('WorkerError', True, None)
+        if outcome['status'] == 'failed':
+            error_class, retryable, retry_after = engine.outcomes.pop(item.id, ('WorkerError', True, None))
+            outcome.update(error=item.error, error_class=error_class,
+                           retryable=retryable, retry_after=retry_after)
+        return outcome
+
+    def _apply_limits(self, item: DownloadItem, limits: Optional[dict]):
+        """Adopt the coordinator's bandwidth limits as they stand for a leased transfer"""
+        if not limits:
+            return
+        limiter = self.engine.rate_limiter
+        if limits['global'] != limiter.get_global_limit():
+            self.engine.set_bandwidth_limit(limits['global'])
+        limiter.set_host_limit(item.host, limits['host'])
+        limiter.set_item_limit(item.url, limits['download'])
+
+    def _heartbeat_loop(self):
+        client = self._client()
+        engine = self.engine
+        while not self._stop.wait(Config.HEARTBEAT_INTERVAL):
+            with self._lock:
+                leases = list(self._leases.items())
+            for lease_id, item in leases:
+                try:
+                    reply = client.call('heartbeat', lease=lease_id, progress=item.progress,
+                                        status=item.status, bytes=engine.take_received(item.id))
+                except (OSError, ValueError, CoordinatorError) as e:
+                    # The lease may still be renewed in time; the transfer carries on meanwhile
+                    main_logger.warning(f"Heartbeat for {item.url} failed: {str(e)}")
+                    client.close()
+                    break
+                if reply['lease'] is None:
+                    main_logger.warning(f"Lease on {item.url} was lost, abandoning the transfer")
+                    engine.cancel_download(item.url)
+                elif reply['cancelled']:
+                    engine.cancel_download(item.url)
+                elif reply['paused'] != item.paused:
+                    (engine.pause_download if reply['paused'] else engine.resume_download)(item.url)
+                with self._lock:
+                    # A transfer that just ended has cleared its limits; don't bring them back
+                    if reply['lease'] is not None and lease_id in self._leases:
+                        self._apply_limits(item, reply.get('limits'))
+        client.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--coordinator', default=Config.COORDINATOR_ADDRESS,
+                        help='unix:/path or tcp://host:port (default: COORDINATOR_ADDRESS)')
+    parser.add_argument('--name', default=f"{socket.gethostname()}-{os.getpid()}",
+                        help='name shown in the coordinator\'s worker stats')
+    parser.add_argument('--concurrency', type=int, default=Config.MAX_WORKERS,
+                        help='transfers to run at once (default: MAX_WORKERS)')
+    parser.add_argument('--download-dir', help='where to save files (default: DOWNLOAD_DIR)')
+    args = parser.parse_args(argv)
+
+    if args.download_dir:
+        Config.DOWNLOAD_DIR = args.download_dir
+    # State, retries, notifications, pool sizing and dedupe belong to the coordinator
+    Config.PERSIST_DOWNLOADS = False
+    Config.RESUME_ON_STARTUP = False
+    Config.TELEGRAM_ENABLED = False
+    Config.AUTOSCALE_WORKERS = False
+    Config.CACHE_ENABLED = False  # the coordinator's cache index is not shared between processes
+    Config.PIPELINE_STAGES = ''  # post-processing runs on the coordinator, like every completion
+    # Local workers share the coordinator's LOG_DIR; each rotates files of its own
+    set_log_suffix(re.sub(r'[^\w.-]', '_', args.name))
+    worker = RemoteWorker(args.coordinator, args.name, args.concurrency, Config.COORDINATOR_TOKEN)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
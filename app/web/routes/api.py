@@ -1,11 +1,27 @@
-from flask import Blueprint, jsonify, request
-from app.core.logger import web_logger
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app.core.logger import web_logger, log_files, tail
 from app.config import Config
-import csv
+from app.core.bulk_import import detect_format, iter_rows
+import io
+import json
+import os
+import time
+from datetime import datetime
 
 # Create blueprint
 api = Blueprint('api', __name__)
 
+
+def resolve_import_path(path: str):
+    """Real path of an import file under IMPORT_DIR, or None if imports from disk are off or it lies outside"""
+    if not Config.IMPORT_DIR:
+        return None
+    root = os.path.realpath(Config.IMPORT_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root or resolved == root:
+        return None
+    return resolved
+
 def init_api(download_manager):
     """Initialize API routes with download manager instance"""
     
@@ -15,21 +31,20 @@ def init_api(download_manager):
             # Get all items (queue + active + failed)
             queue_items = []
             
-            # Add items from queue
-            queue_size = download_manager.get_queue_size()
-            while queue_size > 0:
-                priority, item = download_manager.download_queue.get()
+            # Add items from queue (a cached snapshot, the queue is not drained)
+            offset = request.args.get('offset', 0, type=int)
+            limit = request.args.get('limit', type=int)
+            for item in download_manager.get_queued_downloads(offset, limit):
                 queue_items.append({
+                    'id': item.id,
                     'url': item.url,
                     'caption': item.caption,
-                    'priority': priority,
+                    'priority': item.priority,
                     'status': item.status
                 })
-                download_manager.download_queue.put((priority, item))
-                queue_size -= 1
             
             # Add active downloads
-            for url, item in download_manager.active_downloads.items():
+            for url, item in list(download_manager.active_downloads.items()):
                 queue_items.append({
                     'url': item.url,
                     'caption': item.caption,
@@ -38,8 +53,20 @@ def init_api(download_manager):
                     'progress': item.progress
                 })
             
-            # Add failed downloads
-            for item in download_manager.failed_downloads:
+            # Add downloads waiting for a retry or for their host to recover
+            for item in download_manager.get_waiting_downloads():
+                queue_items.append({
+                    'url': item.url,
+                    'caption': item.caption,
+                    'priority': item.priority,
+                    'status': item.status,
+                    'error': item.error,
+                    'attempts': item.attempts,
+                    'next_attempt': datetime.fromtimestamp(item.next_attempt).isoformat() if item.next_attempt else None
+                })
+            
+            # Add failed downloads (older ones stay on disk until retried by URL)
+            for item in download_manager.history.recent('failed'):
                 queue_items.append({
                     'url': item.url,
                     'caption': item.caption,
@@ -53,37 +80,175 @@ def init_api(download_manager):
             web_logger.error(f"Error getting queue data: {e}", exc_info=True)
             return jsonify({'error': str(e)}), 500
 
+    @api.route('/queue/priority', methods=['POST'])
+    def set_queue_priority():
+        try:
+            data = request.json
+            url = data.get('url')
+            if not url or 'priority' not in data:
+                return jsonify({'error': 'URL and priority are required'}), 400
+            if not download_manager.set_priority(url, int(data['priority'])):
+                return jsonify({'error': 'Download not queued'}), 404
+            return jsonify({'message': 'Priority updated'})
+        except Exception as e:
+            web_logger.error(f"Error updating priority: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
     @api.route('/queue/data', methods=['POST'])
     def save_queue_data():
         try:
             data = request.json
+            if not isinstance(data, list):
+                return jsonify({'error': 'Expected a list of queue entries'}), 400
             
-            # Save to CSV file for persistence
-            fieldnames = ['url', 'caption', 'priority']
-            with open(Config.CSV_FILE, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(data)
+            # Only the entries that differ from the current queue are applied
+            counts = download_manager.update_queue(data)
+            web_logger.info(f"Queue updated: {counts}")
             
-            # Update download manager queue
-            download_manager.update_queue_from_csv(Config.CSV_FILE)
-            web_logger.info("Queue data saved and updated")
-            
-            return jsonify({'message': 'Queue updated successfully'})
+            return jsonify({'message': 'Queue updated successfully', **counts})
         except Exception as e:
             web_logger.error(f"Error saving queue data: {e}", exc_info=True)
             return jsonify({'error': str(e)}), 500
 
+    @api.route('/queue/import', methods=['POST'])
+    def import_queue():
+        """Stream a CSV or JSONL URL list into the queue.
+
+        Accepts a multipart `file` upload, a `path` (query string or JSON
+        body) relative to IMPORT_DIR, or the raw request body. `format`
+        overrides detection; `refresh=1` re-queues completed URLs so they are
+        revalidated.
+        """
+        try:
+            fmt = request.args.get('format')
+            refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+            upload = request.files.get('file')
+            path = request.args.get('path')
+            if path is None and request.is_json:
+                path = (request.get_json(silent=True) or {}).get('path')
+
+            if upload is not None:
+                stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+                counts = download_manager.import_downloads(
+                    iter_rows(stream, fmt or detect_format(upload.filename, upload.mimetype)),
+                    refresh=refresh
+                )
+            elif path:
+                resolved = resolve_import_path(path)
+                if resolved is None:
+                    return jsonify({'error': 'path must name a file under IMPORT_DIR'}), 403
+                if not os.path.isfile(resolved):
+                    return jsonify({'error': f'File not found: {path}'}), 404
+                counts = download_manager.import_file(resolved, fmt, refresh)
+            else:
+                stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+                counts = download_manager.import_downloads(
+                    iter_rows(stream, fmt or detect_format(content_type=request.mimetype)),
+                    refresh=refresh
+                )
+
+            web_logger.info(f"Bulk import finished: {counts}")
+            return jsonify(counts)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            web_logger.error(f"Error importing queue: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
+    @api.route('/history')
+    def get_history():
+        try:
+            return jsonify(download_manager.get_history(
+                status=request.args.get('status'),
+                host=request.args.get('host'),
+                offset=request.args.get('offset', 0, type=int),
+                limit=min(request.args.get('limit', 100, type=int), 1000)
+            ))
+        except Exception as e:
+            web_logger.error(f"Error getting history: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
     @api.route('/status')
     def get_status():
         return jsonify({
             'queue_size': download_manager.get_queue_size(),
             'active_downloads': download_manager.get_active_downloads_count(),
             'failed_downloads': download_manager.get_failed_downloads_count(),
+            'waiting_downloads': download_manager.get_waiting_downloads_count(),
+            'skipped_unchanged': download_manager.skipped_unchanged,
             'paused': download_manager.is_paused(),
-            'bandwidth_limit': download_manager.get_bandwidth_limit()
+            'bandwidth_limit': download_manager.get_bandwidth_limit(),
+            'bandwidth_limits': download_manager.get_bandwidth_limits(),
+            'connections': download_manager.get_connection_stats(),
+            'cache': download_manager.get_cache_stats(),
+            'notifications': download_manager.get_notification_stats(),
+            'circuit_breakers': download_manager.get_breaker_stats()
         })
 
+    @api.route('/metrics')
+    def get_metrics():
+        """Prometheus text-format metrics: latencies, throughput, worker time, lock contention"""
+        try:
+            return Response(download_manager.render_metrics(), mimetype='text/plain; version=0.0.4')
+        except Exception as e:
+            web_logger.error(f"Error rendering metrics: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
+    @api.route('/events')
+    def stream_events():
+        """Server-Sent Events: one snapshot, then merged deltas at a bounded rate"""
+        subscription = download_manager.events.subscribe()
+        interval = 1.0 / Config.SSE_MAX_RATE
+
+        def format_event(event_type, data):
+            return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+        def snapshot():
+            return format_event('snapshot', {
+                'counters': download_manager.get_counters(),
+                'active': [download_manager.describe_item(item)
+                           for item in list(download_manager.active_downloads.values())],
+                'failed': [download_manager.describe_item(item)
+                           for item in download_manager.history.recent('failed')]
+            })
+
+        def stream():
+            try:
+                yield f"retry: {Config.SSE_RETRY_MS}\n\n"
+                yield snapshot()
+                counters = download_manager.get_counters()
+                while True:
+                    started = time.monotonic()
+                    events, progress, overflowed = subscription.drain(timeout=Config.SSE_KEEPALIVE)
+                    sent = False
+                    if overflowed:
+                        yield snapshot()
+                        sent = True
+                    else:
+                        for event_type, data in events:
+                            yield format_event(event_type, data)
+                            sent = True
+                    if progress:
+                        yield format_event('progress', progress)
+                        sent = True
+                    latest = download_manager.get_counters()
+                    if latest != counters:
+                        counters = latest
+                        yield format_event('counters', counters)
+                        sent = True
+                    if not sent:
+                        yield ": keepalive\n\n"
+                    # Bound the update rate; progress keeps merging meanwhile
+                    time.sleep(max(0.0, interval - (time.monotonic() - started)))
+            finally:
+                download_manager.events.unsubscribe(subscription)
+
+        return Response(
+            stream_with_context(stream()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     @api.route('/downloads')
     def get_downloads():
         return jsonify({
@@ -94,14 +259,21 @@ def init_api(download_manager):
     @api.route('/download/start', methods=['POST'])
     def start_download():
         try:
-            url = request.json.get('url')
+            data = request.json
+            url = data.get('url')
             if not url:
                 return jsonify({'error': 'URL is required'}), 400
                 
             # Add to queue with high priority to start immediately
-            download_manager.add_download(url, priority=1)
+            download_manager.add_download(
+                url, priority=1,
+                expected_digest=data.get('digest'),
+                expected_size=int(data['size']) if data.get('size') is not None else None
+            )
             web_logger.info(f"Started download for URL: {url}")
             return jsonify({'message': 'Download started'})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             web_logger.error(f"Error starting download: {e}", exc_info=True)
             return jsonify({'error': str(e)}), 500
@@ -123,6 +295,12 @@ def init_api(download_manager):
     @api.route('/download/pause', methods=['POST'])
     def pause_downloads():
         try:
+            url = (request.get_json(silent=True) or {}).get('url')
+            if url:
+                if not download_manager.pause_download(url):
+                    return jsonify({'error': 'Download not found'}), 404
+                web_logger.info(f"Download paused: {url}")
+                return jsonify({'message': 'Download paused'})
             download_manager.pause()
             web_logger.info("Downloads paused")
             return jsonify({'message': 'Downloads paused'})
@@ -133,6 +311,12 @@ def init_api(download_manager):
     @api.route('/download/resume', methods=['POST'])
     def resume_downloads():
         try:
+            url = (request.get_json(silent=True) or {}).get('url')
+            if url:
+                if not download_manager.resume_download(url):
+                    return jsonify({'error': 'Download not found'}), 404
+                web_logger.info(f"Download resumed: {url}")
+                return jsonify({'message': 'Download resumed'})
             download_manager.resume()
             web_logger.info("Downloads resumed")
             return jsonify({'message': 'Downloads resumed'})
@@ -140,6 +324,85 @@ def init_api(download_manager):
             web_logger.error(f"Error resuming downloads: {e}", exc_info=True)
             return jsonify({'error': str(e)}), 500
 
+    @api.route('/download/cancel', methods=['POST'])
+    def cancel_download():
+        try:
+            url = request.json.get('url')
+            if not url:
+                return jsonify({'error': 'URL is required'}), 400
+            if not download_manager.cancel_download(url):
+                return jsonify({'error': 'Download not found'}), 404
+            web_logger.info(f"Download cancelled: {url}")
+            return jsonify({'message': 'Download cancelled'})
+        except Exception as e:
+            web_logger.error(f"Error cancelling download: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
+    @api.route('/workers', methods=['GET'])
+    def get_workers():
+        return jsonify(download_manager.get_worker_stats())
+
+    @api.route('/workers', methods=['POST'])
+    def update_workers():
+        try:
+            data = request.json
+            if 'max_workers' in data:
+                download_manager.set_max_workers(int(data['max_workers']))
+                web_logger.info(f"Worker pool resized to: {data['max_workers']}")
+            if 'autoscale' in data:
+                if data['autoscale']:
+                    download_manager.enable_autoscaling()
+                else:
+                    download_manager.disable_autoscaling()
+            return jsonify(download_manager.get_worker_stats())
+        except Exception as e:
+            web_logger.error(f"Error updating workers: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
+    @api.route('/pipeline')
+    def get_pipeline():
+        """Post-processing stages with run counts and timing, jobs in flight and recent results"""
+        try:
+            item_id = request.args.get('id')
+            if item_id:
+                job = download_manager.pipeline.get(item_id) if download_manager.pipeline is not None else None
+                if job is None:
+                    return jsonify({'error': 'No post-processing job for this download'}), 404
+                return jsonify(job)
+            stats = download_manager.get_pipeline_stats(min(request.args.get('limit', 100, type=int), 1000))
+            return jsonify(stats or {'stages': [], 'pending': 0})
+        except Exception as e:
+            web_logger.error(f"Error getting pipeline stats: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
+    @api.route('/hosts', methods=['GET'])
+    def get_hosts():
+        """Queue depth, open connections, limits and circuit breaker state per host"""
+        try:
+            return jsonify(download_manager.get_host_stats())
+        except Exception as e:
+            web_logger.error(f"Error getting host stats: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
+    @api.route('/hosts', methods=['POST'])
+    def update_hosts():
+        """Set per-host connection caps and dispatch weights: {"example.com": {"max_connections": 2, "weight": 2}}"""
+        try:
+            for host, limits in (request.json or {}).items():
+                max_connections = limits.get('max_connections')
+                weight = limits.get('weight')
+                download_manager.set_host_limits(
+                    host,
+                    int(max_connections) if max_connections is not None else None,
+                    float(weight) if weight is not None else None
+                )
+            return jsonify(download_manager.get_host_stats())
+        except (ValueError, AttributeError) as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            web_logger.error(f"Error updating host limits: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
     @api.route('/settings', methods=['POST'])
     def update_settings():
         try:
@@ -148,9 +411,55 @@ def init_api(download_manager):
                 limit = int(data['bandwidth_limit'])
                 download_manager.set_bandwidth_limit(limit)
                 web_logger.info(f"Bandwidth limit updated to: {limit} bytes/s")
+            for host, limit in data.get('host_bandwidth_limits', {}).items():
+                download_manager.set_host_bandwidth_limit(host, int(limit))
+            for url, limit in data.get('download_bandwidth_limits', {}).items():
+                download_manager.set_download_bandwidth_limit(url, int(limit))
             return jsonify({'message': 'Settings updated'})
         except Exception as e:
             web_logger.error(f"Error updating settings: {e}", exc_info=True)
             return jsonify({'error': str(e)}), 500
 
+    @api.route('/logs')
+    def get_logs():
+        """Last lines of a log: type=all gives the main and error logs together"""
+        try:
+            log_type = request.args.get('type', 'all')
+            lines = min(max(request.args.get('lines', 100, type=int), 0), Config.LOG_TAIL_MAX_LINES)
+            if log_type == 'all':
+                return jsonify({'debug': tail('debug', lines), 'error': tail('error', lines)})
+            return jsonify({'type': log_type, 'logs': tail(log_type, lines)})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            web_logger.error(f"Error reading logs: {e}", exc_info=True)
+            return jsonify({'error': str(e)}), 500
+
+    @api.route('/logs/download')
+    def download_logs():
+        """Stream a log file; rotated=1 prepends its rotated files, oldest first"""
+        log_type = request.args.get('type', 'debug')
+        if log_type == 'all':
+            log_type = 'debug'
+        try:
+            paths = log_files(log_type, rotated=request.args.get('rotated', '0') == '1')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        def stream():
+            for path in paths:
+                try:
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    continue  # rotated away since the listing
+                with f:
+                    while chunk := f.read(64 * 1024):
+                        yield chunk
+
+        return Response(
+            stream(),
+            mimetype='text/plain',
+            headers={'Content-Disposition': f'attachment; filename={log_type}.log'}
+        )
+
     return api 
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""Local HTTP server serving synthetic files for benchmarks.
+
+Every file is described by its URL, so scenarios need no fixtures on disk:
+
+    /files/<name>?size=1048576&latency=0.05&rate=1000000&ranges=1&fail=0.1&truncate=0.1&seed=0
+
+size      body length in bytes
+latency   seconds to wait before sending the response headers
+rate      bytes per second for this response (0 = unshaped)
+ranges    1 (default) to honour Range/If-Range, 0 to always send the whole body
+fail      probability of answering 503 instead
+truncate  probability of closing the connection halfway through the body
+seed      selects the content; the same size and seed always give the same bytes
+"""
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Bodies repeat a 1MB block generated from the seed
+BLOCK_SIZE = 1024 * 1024
+WRITE_SIZE = 64 * 1024
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def content_block(seed: int) -> bytes:
+    with _blocks_lock:
+        block = _blocks.get(seed)
+        if block is None:
+            block = _blocks[seed] = random.Random(seed).randbytes(BLOCK_SIZE)
+        return block
+
+
+def content(size: int, seed: int = 0, start: int = 0, end: Optional[int] = None) -> bytes:
+    """Bytes [start, end) of the synthetic file of `size` bytes"""
+    end = size if end is None else min(end, size)
+    block = content_block(seed)
+    parts = []
+    position = start
+    while position < end:
+        offset = position % BLOCK_SIZE
+        take = min(BLOCK_SIZE - offset, end - position)
+        parts.append(block[offset:offset + take])
+        position += take
+    return b''.join(parts)
+
+
+def digest(size: int, seed: int = 0) -> str:
+    """sha256 digest of a synthetic file, as accepted by DownloadManager.add_download"""
+    h = hashlib.sha256()
+    for start in range(0, size, BLOCK_SIZE):
+        h.update(content(size, seed, start, start + BLOCK_SIZE))
+    return f"sha256:{h.hexdigest()}"
+
+
+def file_url(base_url: str, name: str, **params) -> str:
+    query = '&'.join(f"{key}={value}" for key, value in params.items())
+    return f"{base_url}/files/{name}" + (f"?{query}" if query else '')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        size = int(params.get('size', BLOCK_SIZE))
+        seed = int(params.get('seed', 0))
+        rate = float(params.get('rate', 0))
+        latency = float(params.get('latency', 0))
+        if latency:
+            time.sleep(latency)
+        if random.random() < float(params.get('fail', 0)):
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = f'"{size}-{seed}"'
+        start, end = 0, size
+        byte_range = self._range(size, etag) if params.get('ranges', '1') == '1' else None
+        if byte_range:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        if params.get('ranges', '1') == '1':
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+
+        stop = end
+        if random.random() < float(params.get('truncate', 0)):
+            stop = start + (end - start) // 2
+            self.close_connection = True
+        started = time.monotonic()
+        sent = 0
+        try:
+            for position in range(start, stop, WRITE_SIZE):
+                chunk = content(size, seed, position, min(position + WRITE_SIZE, stop))
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate:
+                    ahead = sent / rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _range(self, size: int, etag: str) -> Optional[Tuple[int, int]]:
+        header = self.headers.get('Range')
+        if not header or not header.startswith('bytes='):
+            return None
+        if self.headers.get('If-Range') not in (None, etag):
+            return None
+        first, _, last = header[6:].partition('-')
+        start = int(first)
+        end = int(last) + 1 if last else size
+        if start >= size:
+            return None
+        return start, min(end, size)
+
+
+class FixtureServer:
+    """A FixtureHandler server on a background thread; port 0 picks a free port"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name='fixture-server')
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, name: str, **params) -> str:
+        return file_url(self.base_url, name, **params)
+
+    def start(self) -> 'FixtureServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    args = parser.parse_args()
+    server = FixtureServer(args.host, args.port)
+    print(f"Serving synthetic files on {server.base_url}/files/<name>?size=...")
+    server.httpd.serve_forever()
@@ -0,0 +1,107 @@
+"""Memory benchmark: the cost of each queued download and of finished history.
+
+Imports --items rows into a paused DownloadManager (so nothing is
+downloaded) and reports how much the process grew per queued item. Then
+finishes --history items as failed to show that in-memory history stays
+bounded by HISTORY_MEMORY_SIZE however many pass through it.
+
+    python -m benchmarks.memory --items 1000000
+    python -m benchmarks.memory --items 200000 --hosts 5000 --output mem.json
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from typing import Iterator
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+MB = 1024 * 1024
+
+
+def rss() -> int:
+    """Current resident set size in bytes"""
+    gc.collect()
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def rows(count: int, hosts: int, start: int = 0) -> Iterator[tuple]:
+    """Import rows the way a manifest produces them: fresh strings, captions repeating per batch"""
+    for i in range(start, start + count):
+        url = f"https://files{i % hosts}.example.com/archive/{i // 1000}/{i:08d}.bin"
+        yield url, f"batch {i // 10000}", 1 + i % 9, None, None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000000, help='queued entries to measure')
+    parser.add_argument('--hosts', type=int, default=100, help='distinct hosts among the URLs')
+    parser.add_argument('--history', type=int, default=100000, help='items to finish as failed')
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='bench-memory-')
+    import logging
+    from app.config import Config
+    from app.core.logger import main_logger
+    main_logger.setLevel(logging.CRITICAL)
+    Config.DOWNLOAD_DIR = directory
+    Config.PERSIST_DOWNLOADS = False
+    Config.CACHE_ENABLED = False
+    Config.RESUME_ON_STARTUP = False
+    Config.TELEGRAM_ENABLED = False
+    Config.AUTOSCALE_WORKERS = False
+    from app.core.download_manager import DownloadManager
+
+    manager = DownloadManager(max_workers=1, bandwidth_limit=0)
+    manager.pause()
+    baseline = rss()
+    started = time.perf_counter()
+    manager.import_downloads(rows(args.items, args.hosts))
+    elapsed = time.perf_counter() - started
+    queued = rss() - baseline
+    result = {
+        'items': len(manager.download_queue),
+        'hosts': args.hosts,
+        'import_seconds': round(elapsed, 2),
+        'queued_mb': round(queued / MB, 1),
+        'bytes_per_queued_item': round(queued / max(1, args.items)),
+    }
+    print(f"{result['items']} queued items: {result['queued_mb']}MB, "
+          f"{result['bytes_per_queued_item']} bytes each ({elapsed:.1f}s to import)")
+
+    if args.history:
+        # Drain the queue and fail everything, as a long run with a bad host would
+        before = rss()
+        failed = 0
+        while failed < args.history:
+            item = manager.download_queue.pop()
+            if item is None:
+                break
+            manager.download_queue.done(item.url)
+            manager._fail_transfer(item, None, ValueError('benchmark'))
+            failed += 1
+        result.update({
+            'failed': failed,
+            'failed_in_memory': len(manager.history),
+            'history_size': Config.HISTORY_MEMORY_SIZE,
+            'failed_reported': manager.get_failed_downloads_count(),
+            'history_growth_mb': round((rss() - before) / MB, 1),
+        })
+        print(f"{failed} failed: {result['failed_in_memory']} kept in memory, "
+              f"{result['failed_reported']} reported, process grew {result['history_growth_mb']}MB")
+
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,378 @@
+"""Throughput benchmarks for the download engines.
+
+Starts the fixture server in its own process, then runs each scenario in a
+fresh process (so CPU time and peak RSS belong to that scenario alone)
+against a DownloadManager with a temporary download directory. Results are
+written as JSON; pass an earlier file with --compare to flag regressions.
+
+    python -m benchmarks.run --engine threaded --scale 0.25
+    python -m benchmarks.run --scenario small_files --compare benchmarks/results/old.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.fixture_server import FixtureServer, digest, file_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+KB = 1024
+MB = 1024 * 1024
+
+# (url, priority, expected size)
+Job = Tuple[str, int, int]
+
+
+@dataclass
+class Scenario:
+    name: str
+    description: str
+    # Builds the jobs from a url(name, **params) function and the scale
+    jobs: Callable[[Callable[..., str], float], List[Job]]
+    workers: int = 8
+    config: Dict[str, object] = field(default_factory=dict)
+    # Called on a helper thread while the scenario runs
+    control: Optional[Callable[['Run'], None]] = None
+    retries: int = 0
+
+
+def _count(n: int, scale: float) -> int:
+    return max(1, int(n * scale))
+
+
+def _pause_resume(run: 'Run'):
+    run.wait_for_bytes(0.3)
+    run.manager.pause()
+    time.sleep(1.0)
+    run.manager.resume()
+    run.wait_for_bytes(0.6)
+    for url in list(run.pending)[:5]:
+        if run.manager.pause_download(url):
+            time.sleep(0.2)
+            run.manager.resume_download(url)
+
+
+SCENARIOS = [
+    Scenario(
+        'small_files', 'Many 64KB files: per-item overhead',
+        lambda url, scale: [(url(f"s{i}.bin", size=64 * KB), 5, 64 * KB) for i in range(_count(1000, scale))],
+        workers=16
+    ),
+    Scenario(
+        'huge_files', 'A few large files: raw streaming throughput, segmented when ranges work',
+        lambda url, scale: [(url(f"h{i}.bin", size=_count(512 * MB, scale)), 5, _count(512 * MB, scale))
+                          for i in range(2)],
+        workers=2
+    ),
+    Scenario(
+        'no_ranges', 'Large files from a server without Range support: one connection each',
+        lambda url, scale: [(url(f"n{i}.bin", size=_count(128 * MB, scale), ranges=0), 5, _count(128 * MB, scale))
+                          for i in range(4)],
+        workers=4
+    ),
+    Scenario(
+        'high_latency', 'Small files behind 50ms of server latency: concurrency bound',
+        lambda url, scale: [(url(f"l{i}.bin", size=16 * KB, latency=0.05), 5, 16 * KB)
+                          for i in range(_count(400, scale))],
+        workers=32
+    ),
+    Scenario(
+        'mixed_priorities', 'Shaped 256KB files at random priorities through few workers',
+        lambda url, scale: [(url(f"p{i}.bin", size=256 * KB, rate=8 * MB), random.Random(i).randint(1, 9), 256 * KB)
+                          for i in range(_count(400, scale))],
+        workers=4
+    ),
+    Scenario(
+        'pause_resume', 'Shaped 8MB files with a global pause and per-item pause/resume mid-run',
+        lambda url, scale: [(url(f"r{i}.bin", size=8 * MB, rate=16 * MB), 5, 8 * MB)
+                          for i in range(_count(24, scale))],
+        workers=8, control=_pause_resume
+    ),
+    Scenario(
+        'flaky', '256KB files with 10% 503s and 10% truncated bodies, failed items retried',
+        lambda url, scale: [(url(f"f{i}.bin", size=256 * KB, fail=0.1, truncate=0.1), 5, 256 * KB)
+                          for i in range(_count(400, scale))],
+        workers=16, retries=5
+    ),
+]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 4)
+
+
+class Run:
+    """One scenario executing against a DownloadManager in this process"""
+
+    def __init__(self, manager, jobs: List[Job]):
+        self.manager = manager
+        self.jobs = jobs
+        self.total_bytes = sum(size for _, _, size in jobs)
+        self.added: Dict[str, float] = {}
+        self.latencies: Dict[str, float] = {}
+        self.priorities = {url: priority for url, priority, _ in jobs}
+        self.pending = set(url for url, _, _ in jobs)
+        self.failed: Dict[str, str] = {}
+        self.retries = 0
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        manager.events.add_listener(self.on_event)
+
+    def on_event(self, event_type: str, data: dict):
+        if event_type != 'state' or data['status'] not in ('completed', 'failed'):
+            return
+        with self._lock:
+            url = data['url']
+            if url not in self.pending:
+                return
+            if data['status'] == 'failed':
+                self.failed[url] = data['error']
+                return
+            self.latencies[url] = time.perf_counter() - self.added[url]
+            self.failed.pop(url, None)
+            self.pending.discard(url)
+            if not self.pending:
+                self.done.set()
+
+    def wait_for_bytes(self, fraction: float, timeout: float = 60):
+        deadline = time.monotonic() + timeout
+        while self.manager.bytes_downloaded < fraction * self.total_bytes and time.monotonic() < deadline:
+            if self.done.is_set():
+                return
+            time.sleep(0.01)
+
+    def retry_failures(self, retries: int, deadline: float):
+        """Retry failed items until they complete, run out of retries or time"""
+        attempts: Dict[str, int] = {}
+        while not self.done.wait(0.05) and time.monotonic() < deadline:
+            with self._lock:
+                failed = [url for url in self.failed if attempts.get(url, 0) < retries]
+                for url in failed:
+                    del self.failed[url]
+            for url in failed:
+                attempts[url] = attempts.get(url, 0) + 1
+                self.retries += 1
+                self.manager.retry_failed(url)
+            with self._lock:
+                if self.pending and set(self.pending) <= set(self.failed):
+                    return
+
+
+def run_scenario(scenario: Scenario, base_url: str, engine: str, scale: float, timeout: float) -> dict:
+    """Run one scenario; called in a child process"""
+    directory = tempfile.mkdtemp(prefix=f"bench-{scenario.name}-")
+    os.environ['DOWNLOAD_DIR'] = directory
+    import logging
+    from app.config import Config
+    from app.core.logger import main_logger
+    # Expected failures (flaky scenario) would otherwise flood the console
+    main_logger.setLevel(logging.CRITICAL)
+    Config.DOWNLOAD_DIR = directory
+    Config.PERSIST_DOWNLOADS = False
+    Config.CACHE_ENABLED = False
+    Config.RESUME_ON_STARTUP = False
+    Config.TELEGRAM_ENABLED = False
+    for key, value in scenario.config.items():
+        setattr(Config, key, value)
+    from app.core.download_manager import create_download_manager
+
+    jobs = scenario.jobs(lambda name, **params: file_url(base_url, name, **params), scale)
+    digests = {size: digest(size) for size in set(size for _, _, size in jobs)}
+
+    manager = create_download_manager(engine, max_workers=scenario.workers, bandwidth_limit=0)
+    try:
+        run = Run(manager, jobs)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        for url, priority, size in jobs:
+            run.added[url] = time.perf_counter()
+            manager.add_download(url, '', priority, expected_digest=digests[size], expected_size=size)
+        if scenario.control:
+            threading.Thread(target=scenario.control, args=(run,), daemon=True).start()
+        deadline = time.monotonic() + timeout
+        if scenario.retries:
+            run.retry_failures(scenario.retries, deadline)
+        else:
+            while not run.done.wait(0.05) and time.monotonic() < deadline:
+                if run.pending and set(run.pending) <= set(run.failed):
+                    break
+        elapsed = time.perf_counter() - started
+        after = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        # Stop the engine's threads, event loop and sessions so nothing carries into the next scenario
+        manager.close()
+
+    completed = len(run.latencies)
+    completed_bytes = sum(size for url, _, size in jobs if url in run.latencies)
+    latencies = list(run.latencies.values())
+    result = {
+        'description': scenario.description,
+        'files': len(jobs),
+        'completed': completed,
+        'failed': len(run.pending),
+        'retries': run.retries,
+        'timed_out': bool(run.pending) and time.monotonic() >= deadline,
+        'bytes': completed_bytes,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': round(completed_bytes / MB / elapsed, 2),
+        'files_per_s': round(completed / elapsed, 2),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'cpu_seconds': round((after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime), 3),
+        'peak_rss_mb': round(after.ru_maxrss / 1024, 1),
+        'workers': scenario.workers,
+    }
+    if scenario.name == 'mixed_priorities':
+        for label, band in (('high', (1, 3)), ('low', (7, 9))):
+            values = [latency for url, latency in run.latencies.items()
+                      if band[0] <= run.priorities[url] <= band[1]]
+            result[f"latency_p50_{label}_priority"] = percentile(values, 50)
+    if run.failed:
+        result['errors'] = sorted(set(run.failed.values()))[:5]
+    shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def _serve(port_queue):
+    server = FixtureServer().start()
+    port_queue.put(server.base_url)
+    server.thread.join()
+
+
+def _child(args, queue):
+    name, base_url, engine, scale, timeout = args
+    scenario = next(s for s in SCENARIOS if s.name == name)
+    try:
+        queue.put(run_scenario(scenario, base_url, engine, scale, timeout))
+    except Exception as e:
+        queue.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Metrics compared by --compare: (key, True when higher is better)
+COMPARED = [('mb_per_s', True), ('files_per_s', True), ('latency_p50', False),
+            ('latency_p99', False), ('cpu_seconds', False), ('peak_rss_mb', False)]
+
+
+def compare(baseline: dict, report: dict, threshold: float) -> List[str]:
+    """Print a comparison table and return the regressions beyond `threshold` percent"""
+    regressions = []
+    print(f"\n{'scenario':<18}{'metric':<14}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, result in report['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before or 'error' in result or 'error' in before:
+            continue
+        for key, higher_is_better in COMPARED:
+            old, new = before.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = -change if higher_is_better else change
+            flag = ' !' if worse > threshold else ''
+            if flag:
+                regressions.append(f"{name}.{key}: {old} -> {new} ({change:+.1f}%)")
+            print(f"{name:<18}{key:<14}{old:>12.4g}{new:>12.4g}{change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', default='threaded', choices=['threaded', 'asyncio'])
+    parser.add_argument('--scenario', action='append', choices=[s.name for s in SCENARIOS],
+                        help='run only this scenario (repeatable)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply file counts and sizes')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds allowed per scenario')
+    parser.add_argument('--output', help=f"result file (default {os.path.relpath(RESULTS_DIR, ROOT)}/<engine>-<time>.json)")
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent change counted as a regression')
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    context = multiprocessing.get_context('spawn')
+    port_queue = context.Queue()
+    server = context.Process(target=_serve, args=(port_queue,), daemon=True)
+    server.start()
+    base_url = port_queue.get(timeout=30)
+
+    report = {
+        'meta': {
+            'engine': args.engine,
+            'scale': args.scale,
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'started': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': {}
+    }
+    try:
+        for scenario in scenarios:
+            print(f"{scenario.name}: {scenario.description} ...", flush=True)
+            queue = context.Queue()
+            child = context.Process(target=_child,
+                                    args=((scenario.name, base_url, args.engine, args.scale, args.timeout), queue))
+            child.start()
+            try:
+                result = queue.get(timeout=args.timeout + 120)
+            except Exception:
+                result = {'error': 'no result (timed out or crashed)'}
+            child.join(5)
+            if child.is_alive():
+                child.kill()
+            report['results'][scenario.name] = result
+            if 'error' in result:
+                print(f"  error: {result['error']}")
+            else:
+                print(f"  {result['completed']}/{result['files']} files in {result['seconds']}s: "
+                      f"{result['mb_per_s']} MB/s, {result['files_per_s']} files/s, "
+                      f"p50 {result['latency_p50']}s, p99 {result['latency_p99']}s, "
+                      f"cpu {result['cpu_seconds']}s, rss {result['peak_rss_mb']}MB")
+    finally:
+        server.kill()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{args.engine}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold}%:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
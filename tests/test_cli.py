@@ -0,0 +1,22 @@
+from app import cli
+from app.config import Config
+from app.core.download_manager import DownloadManager
+from app.core.logger import console_handler
+
+
+def test_invalid_manifest_closes_manager(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(Config, 'CACHE_ENABLED', False)
+    monkeypatch.setattr(Config, 'PIPELINE_STAGES', '')
+    # Settings cli.configure() changes for the run
+    for name in ('PERSIST_DOWNLOADS', 'RESUME_ON_STARTUP', 'TELEGRAM_ENABLED', 'DOWNLOAD_DIR'):
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(console_handler, 'level', console_handler.level)
+    closed = []
+    close = DownloadManager.close
+    monkeypatch.setattr(DownloadManager, 'close', lambda self: closed.append(self) or close(self))
+    manifest = tmp_path / 'urls.csv'
+    manifest.write_bytes(b'\xff\xfe not utf-8\n')
+
+    assert cli.main([str(manifest), '-o', str(tmp_path / 'out'), '--report', '-', '-q']) == cli.EXIT_USAGE
+    assert len(closed) == 1
+    assert 'invalid manifest' in capsys.readouterr().err
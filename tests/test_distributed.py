@@ -0,0 +1,83 @@
+import functools
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.config import Config
+from app.core.coordinator import CoordinatorManager
+from app.core.worker import RemoteWorker
+
+KB = 1024
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def files(tmp_path):
+    root = tmp_path / 'served'
+    root.mkdir()
+    (root / 'small.bin').write_bytes(b'x' * 300 * KB)
+    (root / 'large.bin').write_bytes(b'y' * 4096 * KB)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def cluster(tmp_path, monkeypatch):
+    for name, value in {
+        'DOWNLOAD_DIR': str(tmp_path / 'downloads'),
+        'PERSIST_DOWNLOADS': False, 'RESUME_ON_STARTUP': False, 'TELEGRAM_ENABLED': False,
+        'CACHE_ENABLED': False, 'AUTOSCALE_WORKERS': False, 'PIPELINE_STAGES': '',
+        'SEGMENTED_DOWNLOADS': False, 'DEFAULT_BANDWIDTH_LIMIT': 0,
+        'COORDINATOR_TOKEN': None, 'HEARTBEAT_INTERVAL': 0.1, 'LEASE_TIMEOUT': 4,
+    }.items():
+        monkeypatch.setattr(Config, name, value)
+    manager = CoordinatorManager(max_workers=2, bandwidth_limit=0, address='tcp://127.0.0.1:0', local_workers=0)
+    worker = RemoteWorker(manager.address, 'test-worker', 2)
+    threading.Thread(target=worker.run, daemon=True).start()
+    yield manager, worker
+    worker.stop()
+    manager.close()
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.02)
+
+
+def test_lease_carries_coordinator_limit(files, cluster):
+    manager, worker = cluster
+    manager.set_bandwidth_limit(200 * KB)
+    started = time.monotonic()
+    manager.add_download(f"{files}/small.bin")
+    wait_for(lambda: manager.history.get(f"{files}/small.bin", 'completed') is not None)
+    assert time.monotonic() - started >= 1.2  # 300KB at 200KB/s
+    assert worker.engine.rate_limiter.get_global_limit() == 200 * KB
+
+
+def test_limit_change_reaches_running_transfer(files, cluster):
+    manager, worker = cluster
+    url = f"{files}/large.bin"
+    manager.set_download_bandwidth_limit(url, 1024 * KB)
+    manager.add_download(url)
+    wait_for(lambda: worker.engine.active_downloads.get(url) is not None)
+    assert worker.engine.rate_limiter.get_item_limits() == {url: 1024 * KB}
+
+    manager.set_bandwidth_limit(64 * KB)
+    wait_for(lambda: worker.engine.rate_limiter.get_global_limit() == 64 * KB, timeout=2)
+    time.sleep(0.3)  # let debt taken at the old rate drain
+    before = worker.engine.bytes_downloaded
+    time.sleep(1)
+    assert worker.engine.bytes_downloaded - before <= 160 * KB
+    manager.cancel_download(url)
+    wait_for(lambda: manager.history.get(url, 'cancelled') is not None)
+    wait_for(lambda: not worker.engine.rate_limiter.get_item_limits())
@@ -0,0 +1,69 @@
+from app.core.download_manager import DownloadItem, DownloadManager
+from app.core.history import DownloadHistory
+from app.core.store import DownloadStore
+
+
+def describe(item):
+    return DownloadManager.describe_item(None, item)
+
+
+def finished(url, status):
+    item = DownloadItem(url)
+    item.status = status
+    return item
+
+
+def make_history(store=None):
+    return DownloadHistory(1, store, describe, DownloadManager._item_from_row)
+
+
+def persisted(store, item):
+    """What the manager's store listener does for each state change"""
+    store.record(describe(item))
+    return item
+
+
+def test_refinish_after_eviction_replaces_spilled_status():
+    history = make_history()
+    history.add(finished('http://a/1', 'failed'))
+    history.add(finished('http://a/2', 'completed'))  # evicts the failure to the spill database
+    assert history.count('failed') == 1
+
+    history.add(finished('http://a/1', 'completed'))
+    assert history.count('failed') == 0
+    assert history.count('completed') == 2
+    assert history.count() == 2
+    assert history.get('http://a/1', 'failed') is None
+
+
+def test_refinish_after_eviction_with_store(tmp_path):
+    store = DownloadStore(str(tmp_path / 'downloads.db'))
+    history = make_history(store)
+    try:
+        history.add(persisted(store, finished('http://a/1', 'failed')))
+        history.add(persisted(store, finished('http://a/2', 'completed')))
+        assert history.count('failed') == 1
+
+        history.add(persisted(store, finished('http://a/1', 'completed')))
+        assert history.count('failed') == 0
+        assert history.count() == 2
+    finally:
+        store.close()
+
+
+def test_retried_failure_is_not_counted_twice(tmp_path):
+    store = DownloadStore(str(tmp_path / 'downloads.db'))
+    history = make_history(store)
+    try:
+        history.add(persisted(store, finished('http://a/1', 'failed')))
+        history.add(persisted(store, finished('http://a/2', 'completed')))
+        retried = history.pop('http://a/1', 'failed')  # read back from disk, as a manual retry does
+        assert retried is not None
+        assert history.count('failed') == 0
+
+        retried.status = 'completed'
+        history.add(persisted(store, retried))
+        assert history.count('failed') == 0
+        assert history.count('completed') == 2
+    finally:
+        store.close()
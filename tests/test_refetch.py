@@ -0,0 +1,159 @@
+import functools
+import gzip
+import os
+import queue
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.config import Config
+from app.core.download_manager import FINISHED_STATUSES, create_download_manager
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def served(tmp_path):
+    root = tmp_path / 'served'
+    root.mkdir()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield root, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    for name, value in {
+        'DOWNLOAD_DIR': str(tmp_path / 'downloads'), 'CACHE_DIR': str(tmp_path / 'cache'),
+        'DATABASE_FILE': str(tmp_path / 'downloads.db'), 'CACHE_ENABLED': True,
+        'PERSIST_DOWNLOADS': True, 'RESUME_ON_STARTUP': False, 'TELEGRAM_ENABLED': False,
+        'AUTOSCALE_WORKERS': False, 'PIPELINE_STAGES': '', 'SEGMENTED_DOWNLOADS': False,
+    }.items():
+        monkeypatch.setattr(Config, name, value)
+
+
+@pytest.fixture(params=['threaded', 'asyncio'])
+def manager(request, config):
+    manager = create_download_manager(request.param, max_workers=1, bandwidth_limit=0)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def pipeline_manager(config, tmp_path, monkeypatch):
+    """Threaded manager factory with post-processing stages"""
+    managers = []
+
+    def make(stages):
+        monkeypatch.setattr(Config, 'PIPELINE_STAGES', stages)
+        monkeypatch.setattr(Config, 'PIPELINE_DEST_DIR', str(tmp_path / 'done'))
+        managers.append(create_download_manager('threaded', max_workers=1, bandwidth_limit=0))
+        return managers[-1]
+
+    yield make
+    for manager in managers:
+        manager.close()
+
+
+def publish(root, name, data, mtime):
+    path = root / name
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))  # Last-Modified has one-second resolution
+
+
+def fetch(manager, url):
+    """Queue a URL and return the status it finishes with"""
+    finished = queue.Queue()
+    processed = queue.Queue()
+
+    def listener(event_type, data):
+        if data['url'] != url:
+            return
+        if event_type == 'state' and data['status'] in FINISHED_STATUSES:
+            finished.put(data['status'])
+        elif event_type == 'pipeline' and data['finished']:
+            processed.put(data['status'])
+
+    manager.events.add_listener(listener)
+    try:
+        manager.add_download(url)
+        status = finished.get(timeout=10)
+        if status == 'completed' and manager.pipeline is not None:
+            assert processed.get(timeout=10) == 'done'
+    finally:
+        manager.events.remove_listener(listener)
+    manager.store.flush()  # the validators a re-queue hours later would find
+    return status
+
+
+def test_requeued_url_fetches_changed_content(served, manager):
+    root, base = served
+    publish(root, 'f.txt', b'version-1', 1_600_000_000)
+    assert fetch(manager, f"{base}/f.txt") == 'completed'
+
+    publish(root, 'f.txt', b'version-2', 1_600_000_100)
+    assert fetch(manager, f"{base}/f.txt") == 'completed'
+    with open(os.path.join(Config.DOWNLOAD_DIR, 'f.txt'), 'rb') as f:
+        assert f.read() == b'version-2'
+    assert manager.cache.hits == 0
+
+
+def test_requeued_unchanged_url_is_skipped(served, manager):
+    root, base = served
+    publish(root, 'f.txt', b'version-1', 1_600_000_000)
+    assert fetch(manager, f"{base}/f.txt") == 'completed'
+
+    assert fetch(manager, f"{base}/f.txt") == 'skipped_unchanged'
+    assert manager.skipped_unchanged == 1
+    with open(os.path.join(Config.DOWNLOAD_DIR, 'f.txt'), 'rb') as f:
+        assert f.read() == b'version-1'
+
+
+def test_unchanged_url_relinks_removed_file_from_cache(served, manager):
+    root, base = served
+    publish(root, 'f.txt', b'version-1', 1_600_000_000)
+    assert fetch(manager, f"{base}/f.txt") == 'completed'
+    os.remove(os.path.join(Config.DOWNLOAD_DIR, 'f.txt'))
+
+    assert fetch(manager, f"{base}/f.txt") == 'skipped_unchanged'
+    assert manager.cache.hits == 1
+    with open(os.path.join(Config.DOWNLOAD_DIR, 'f.txt'), 'rb') as f:
+        assert f.read() == b'version-1'
+
+
+def test_validators_follow_moved_file(served, pipeline_manager, tmp_path):
+    root, base = served
+    manager = pipeline_manager('move')
+    moved = tmp_path / 'done' / 'f.txt'
+    publish(root, 'f.txt', b'version-1', 1_600_000_000)
+    assert fetch(manager, f"{base}/f.txt") == 'completed'
+    assert manager.store.get_validator(f"{base}/f.txt")['path'] == str(moved)
+
+    assert fetch(manager, f"{base}/f.txt") == 'skipped_unchanged'
+    assert manager.history.get(f"{base}/f.txt", 'skipped_unchanged').filename == str(moved)
+
+    publish(root, 'f.txt', b'version-2', 1_600_000_100)
+    assert fetch(manager, f"{base}/f.txt") == 'completed'
+    assert moved.read_bytes() == b'version-2'
+
+
+def test_validators_follow_decompressed_file(served, pipeline_manager, tmp_path):
+    root, base = served
+    manager = pipeline_manager('decompress')
+    decompressed = tmp_path / 'downloads' / 'f.txt'
+    publish(root, 'f.txt.gz', gzip.compress(b'version-1'), 1_600_000_000)
+    assert fetch(manager, f"{base}/f.txt.gz") == 'completed'
+    validator = manager.store.get_validator(f"{base}/f.txt.gz")
+    assert validator['path'] == str(decompressed) and validator['digest'] is None
+
+    assert fetch(manager, f"{base}/f.txt.gz") == 'skipped_unchanged'
+
+    publish(root, 'f.txt.gz', gzip.compress(b'version-2'), 1_600_000_100)
+    assert fetch(manager, f"{base}/f.txt.gz") == 'completed'
+    assert decompressed.read_bytes() == b'version-2'